@@ -4,10 +4,14 @@ from . import views
 urlpatterns = [
     path('getPersonalInfo',views.getPersonalInfo.as_view(),name="getPersonalInfo"),
     path("getPatients",views.getPatients.as_view(),name="getPatients"),
+    path("getPatientPanel",views.getPatientPanel.as_view(),name="getPatientPanel"),
     path("getTodayPatients",views.getTodayPatients.as_view(),name="getTodayPatients"),
+    path("getAgenda",views.getAgenda.as_view(),name="getAgenda"),
+    path("async/getAgenda",views.getAgendaAsync.as_view(),name="getAgendaAsync"),
     path("getServices",views.getServices.as_view(),name="getServices"),
     path("CreateMessageDoc",views.CreateMessageDoc.as_view(),name="CreateMessageDoc"),
     path('getPatientInfo/<int:patient_id>', views.getPatientInfo.as_view(),name="getPatientInfo"),
-    path("checkAppointment/<int:appointment_id>/<str:action>",views.checkAppointment.as_view(),name="checkAppointment")
+    path("checkAppointment/<int:appointment_id>/<str:action>",views.checkAppointment.as_view(),name="checkAppointment"),
+    path("checkAppointments/<str:action>",views.checkAppointments.as_view(),name="checkAppointments"),
     
 ]
\ No newline at end of file
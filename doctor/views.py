@@ -4,9 +4,18 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated,AllowAny  # Import this!
 from sharedapp.serializers import DoctorSerializer,UserSerializer,PatientSerializer,AppointmentSerializer,ServiceSerializer,MessageDocSerializer
 from sharedapp.models import Doctor,User,Patient,Appointment,Service,MessageDoc
+import datetime
 from django.utils import timezone
 from rest_framework import generics
 from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from sharedapp import availability, bulk, quotas, versions
+from sharedapp.asyncviews import AsyncAPIView, json_response
+from sharedapp.pagination import KeysetPaginator, PaginationError, get_page_size
+from sharedapp.profiles import ProfileMixin
+from sharedapp.projections import Projection
+from sharedapp.thumbnails import thumbnail_urls
 
 
 class checkAppointment(APIView):
@@ -18,20 +27,13 @@ class checkAppointment(APIView):
             with transaction.atomic():
                 # 1. Get the appointment
                 try:
-                    appt = Appointment.objects.select_related('apointment_doc', 'apointment_pat').get(apointment_id=appointment_id)
+                    appt = Appointment.objects.get(apointment_id=appointment_id)
                 except Appointment.DoesNotExist:
                     return Response({"error": "Appointment not found"}, status=status.HTTP_404_NOT_FOUND)
 
                 if action == "cancel":
                     # 2. Increase Quotas (Refund)
-                    doctor = appt.apointment_doc
-                    patient = appt.apointment_pat
-
-                    doctor.doctor_leftcotas += 1
-                    patient.patient_leftcotas += 1
-
-                    doctor.save()
-                    patient.save()
+                    quotas.refund(appt.apointment_doc_id, appt.apointment_pat_id)
 
                     # 3. Delete the appointment record
                     appt.delete()
@@ -52,14 +54,36 @@ class checkAppointment(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CreateMessageDoc(generics.CreateAPIView):
+class checkAppointments(ProfileMixin, APIView):
+    """ checkAppointment for a list of the doctor's appointments: {"ids": [...]}
+
+    Runs as a few set-based statements in one transaction; each id reports
+    done, already_done (complete only) or not_found.
+    """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'doctor'
+    ACTIONS = {'complete': bulk.complete_appointments, 'cancel': bulk.cancel_appointments}
+
+    def patch(self, request, action):
+        if action not in self.ACTIONS:
+            return Response({"error": "Invalid action. Use 'cancel' or 'complete'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = bulk.parse_ids(request.data)
+            results = self.ACTIONS[action](request.user.user_role_id, ids)
+            return Response({"results": results}, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CreateMessageDoc(ProfileMixin, generics.CreateAPIView):
     queryset = MessageDoc.objects.all()
     serializer_class = MessageDocSerializer
+    profile_role = 'doctor'
 
     def perform_create(self, serializer):
-        # 1. Find the Doctor instance using the ID from the User model
+        # 1. The sender is the caller's Doctor profile
         # Note: Your model expects a Doctor instance, not just an integer
-        doctor_instance = Doctor.objects.get(doctor_id=self.request.user.user_role_id)
+        doctor_instance = self.request.profile
         
         # 2. Save the message with the sender
         # 'message_date' is auto-generated because of auto_now_add=True in your model
@@ -71,6 +95,7 @@ class CreateMessageDoc(generics.CreateAPIView):
 
 class getServices(APIView):
     permission_classes=[IsAuthenticated]
+    @versions.conditional(lambda request: [versions.key('services', request.user.user_role_id)])
     def get(self,request):
         try:
             
@@ -85,8 +110,8 @@ class getPatientInfo(APIView):
     def get(self, request, patient_id): 
         try:
             # Now 'patient_id' is available to use in your queries
-            patient = Patient.objects.get(patient_id=patient_id)
-            user = User.objects.filter(user_role="patient", user_role_id=patient_id).first()
+            patient = Patient.objects.select_related('user_link').get(patient_id=patient_id)
+            user = patient.user_link
           
             obj = {
                 "patient_info": PatientSerializer(patient).data,
@@ -100,14 +125,26 @@ class getPatientInfo(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-class getPersonalInfo(APIView):
+class getPersonalInfo(ProfileMixin, APIView):
     permission_classes = [IsAuthenticated]
+    profile_role = 'doctor'
+
+    # Cacheable read: 304 while neither the account nor the profile changed. POST is kept for older clients.
+    @versions.conditional(lambda request: [
+        versions.key('user', request.user.pk), versions.key('doctor', request.user.user_role_id),
+    ])
+    def get(self, request):
+        return self.post(request)
+
     def post(self, request):
         try:
             # 1. Use the ID stored on the User model to find the Doctor
             # We use user_role_id because that's your custom link
-            doctor = Doctor.objects.get(doctor_id=request.user.user_role_id)
-            the_user = User.objects.get(id=request.user.id)
+            # The profile comes with its account (see sharedapp.profiles)
+            doctor = request.profile
+            the_user = doctor.user_link
+            if doctor.user_link_id != request.user.id:
+                the_user = User.objects.get(id=request.user.id)
             # 2. Pass the 'doctor' object to the serializer
             serializer1 = DoctorSerializer(doctor)
             serializer2 = UserSerializer(the_user)
@@ -130,22 +167,20 @@ class getTodayPatients(APIView):
 
     def get(self, request):
         try:
-            today = timezone.now().date()
+            today = timezone.localdate()
+            start, end = availability.local_range(today, today)
             
-            # 1. Filter using the ID from the logged-in User
+            # 1. Filter using the ID from the logged-in User, over today's datetime range
             todays_appointments = Appointment.objects.filter(
-                apointment_date__date=today,
-                apointment_doc__doctor_id=request.user.user_role_id
-            )
+                apointment_doc_id=request.user.user_role_id,
+                apointment_date__gte=start,
+                apointment_date__lt=end,
+            ).select_related('apointment_pat__user_link').order_by('apointment_date')
 
             responseList = []
             for item in todays_appointments:
-                # 2. FIX: Access patient_id via dot notation
-                # item.apointment_pat is the Patient object
-                p_id = item.apointment_pat.patient_id
-
-                # 3. Find the base User account
-                the_user = User.objects.filter(user_role_id=p_id, user_role="patient").first()
+                # 2. The base User account is joined in the same query
+                the_user = item.apointment_pat.user_link
                 
                 # 4. FIX: Get the Patient object (item.apointment_pat IS the patient object already!)
                 # You don't need to query Patient.objects.get() again.
@@ -161,30 +196,172 @@ class getTodayPatients(APIView):
             
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-class getPatients(APIView):
+
+
+# ==========================================
+# AGENDA
+# ==========================================
+# Shared by getAgenda and its async variant, getAgendaAsync.
+
+AGENDA_MAX_DAYS = 31
+
+# Flat columns for each row, patient and service joined in the same query
+AGENDA_FIELDS = (
+    'apointment_id', 'apointment_date', 'apointment_status', 'apointment_urgent', 'apointment_comment',
+    'apointment_service_id', 'apointment_service__service_name', 'apointment_service__service_duration',
+    'apointment_pat_id', 'apointment_pat__patient_phone', 'apointment_pat__patient_cancer',
+    'apointment_pat__user_link__username', 'apointment_pat__user_link__first_name',
+    'apointment_pat__user_link__last_name',
+)
+
+
+def agenda_period(params):
+    today = timezone.localdate()
+    if 'from' in params or 'to' in params:
+        first_day = datetime.date.fromisoformat(params.get('from', today.isoformat()))
+        last_day = datetime.date.fromisoformat(params.get('to', first_day.isoformat()))
+    elif params.get('range', 'today') == 'today':
+        first_day = last_day = today
+    elif params['range'] == 'week':
+        first_day, last_day = today, today + datetime.timedelta(days=6)
+    else:
+        raise ValueError("range must be 'today' or 'week'.")
+    if last_day < first_day or (last_day - first_day).days >= AGENDA_MAX_DAYS:
+        raise ValueError(f"Ask for 1 to {AGENDA_MAX_DAYS} days at a time.")
+    return first_day, last_day
+
+
+def agenda_rows(doctor_id, first_day, last_day):
+    # A half-open datetime range on the bare column, served by (apointment_doc, apointment_date)
+    start, end = availability.local_range(first_day, last_day)
+    return Appointment.objects.filter(
+        apointment_doc_id=doctor_id,
+        apointment_date__gte=start,
+        apointment_date__lt=end,
+    ).order_by('apointment_date', 'apointment_id').values_list(*AGENDA_FIELDS)
+
+
+def agenda_entry(row):
+    # Lightweight rows, no model instances
+    (appointment_id, date, done, urgent, comment, service_id, service_name, duration,
+     patient_id, phone, cancer, username, first_name, last_name) = row
+    date = timezone.localtime(date)
+    return {
+        "appointment_id": appointment_id,
+        "start": date,
+        "end": date + availability.duration_of(duration),
+        "status": done,
+        "urgent": urgent,
+        "comment": comment,
+        "service": {"id": service_id, "name": service_name},
+        "patient": {
+            "id": patient_id, "username": username, "first_name": first_name, "last_name": last_name,
+            "phone": phone, "cancer": cancer,
+        },
+    }
+
+
+class getAgenda(ProfileMixin, APIView):
+    """The logged-in doctor's appointments over a period, in time order.
+
+    ?range=today (default) or week (today and the next 6 days), or
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD for a custom period of up to 31 days.
+    """
     permission_classes = [IsAuthenticated]
+    profile_role = 'doctor'
+
     def get(self, request):
         try:
-            # 1. Use the ID stored on the User model to find the Doctor
-            # We use user_role_id because that's your custom link
-            doctor = Doctor.objects.get(doctor_id=request.user.user_role_id)
-            patients=Patient.objects.filter(patient_willaya=doctor.doctor_willaya)
+            first_day, last_day = agenda_period(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            responseList=[]
-            for item in patients:
-                obj={}
-                the_user = User.objects.filter(user_role_id=item.patient_id,user_role="patient").first()
-                forthismatch_appointment=Appointment.objects.filter(apointment_pat=item.patient_id,
-                                    apointment_doc=request.user.user_role_id).order_by('-apointment_date').first()
-                if forthismatch_appointment :
-                    obj["status"]="regulare suivi"
-                    obj['last_visit_date']=forthismatch_appointment.apointment_date
-                else :
-                    obj["status"]="new patient for you "
-                    obj['last_visit_date']="null"
-                obj["username"]=the_user.username
-                obj["patient_info"]=PatientSerializer(item).data
+        rows = agenda_rows(request.user.user_role_id, first_day, last_day)
+        return Response({
+            "from": first_day,
+            "to": last_day,
+            "appointments": [agenda_entry(row) for row in rows],
+        }, status=status.HTTP_200_OK)
+
+
+class getAgendaAsync(AsyncAPIView):
+    """ getAgenda, read with the async ORM (see sharedapp.asyncviews) """
+    profile_role = 'doctor'
 
+    async def get(self, request):
+        try:
+            first_day, last_day = agenda_period(request.query_params)
+        except ValueError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = agenda_rows(request.user.user_role_id, first_day, last_day)
+        return json_response({
+            "from": first_day,
+            "to": last_day,
+            "appointments": [agenda_entry(row) async for row in rows],
+        })
+
+
+# ==========================================
+# PATIENT PANEL
+# ==========================================
+# The patients of the doctor's willaya, each annotated with the date of
+# their latest appointment with this doctor by one correlated subquery
+# (served by the (apointment_doc, apointment_pat, apointment_date) index).
+# Patients never seen get NEVER_VISITED, so the sort key is never NULL and
+# keyset pagination can compare it.
+
+NEVER_VISITED = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+PANEL = Projection(patient_info=(PatientSerializer, ''))
+PANEL_USER_FIELDS = ('user_link__username', 'user_link__first_name', 'user_link__last_name')
+
+# ?sort= value -> keyset ordering
+PANEL_SORTS = {
+    'patient_id': ('patient_id',),
+    'last_visit': ('last_visit', 'patient_id'),
+    '-last_visit': ('-last_visit', '-patient_id'),
+}
+
+
+def patient_panel(doctor):
+    latest = Appointment.objects.filter(
+        apointment_doc=doctor.doctor_id, apointment_pat=OuterRef('pk')
+    ).order_by('-apointment_date').values('apointment_date')[:1]
+    return Patient.objects.filter(patient_willaya=doctor.doctor_willaya).annotate(
+        last_visit=Coalesce(Subquery(latest), Value(NEVER_VISITED))
+    )
+
+
+def panel_entry(row):
+    visited = row['last_visit'] != NEVER_VISITED
+    return {
+        "status": "regulare suivi" if visited else "new patient for you ",
+        "last_visit_date": row['last_visit'] if visited else None,
+        "username": row['user_link__username'],
+        "first_name": row['user_link__first_name'],
+        "last_name": row['user_link__last_name'],
+        **PANEL.shape(row),
+        "thumbnails": thumbnail_urls(row['patient_pic_ref']),
+    }
+
+
+class getPatients(ProfileMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    profile_role = 'doctor'
+
+    def get(self, request):
+        try:
+            # 1. The caller's Doctor profile
+            doctor = request.profile
+            # 2. Patients, their User accounts and their last visit with this doctor, in one query
+            rows = PANEL.values(patient_panel(doctor), 'last_visit', *PANEL_USER_FIELDS).order_by('patient_id')
+
+            responseList=[]
+            for row in rows:
+                obj = panel_entry(row)
+                if obj['last_visit_date'] is None:
+                    obj['last_visit_date'] = "null"
                 responseList.append(obj)
 
             return Response(responseList, status=status.HTTP_200_OK)
@@ -192,4 +369,53 @@ class getPatients(APIView):
         except Doctor.DoesNotExist:
             return Response(
                             {"error": "Doctor profile not found."}, 
-                            status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+                            status=status.HTTP_404_NOT_FOUND)
+
+
+class getPatientPanel(ProfileMixin, APIView):
+    """The doctor's patient panel, one page at a time.
+
+    ?sort=patient_id (default) | last_visit | -last_visit, ?search= on the
+    patients' names, and ?cursor= / ?page_size= as returned by the previous page.
+    """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'doctor'
+
+    def get(self, request):
+        try:
+            doctor = request.profile
+        except Doctor.DoesNotExist:
+            return Response({"error": "Doctor profile not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            # 1. Sort order
+            ordering = PANEL_SORTS.get(request.query_params.get('sort', 'patient_id'))
+            if ordering is None:
+                return Response(
+                    {"error": f"sort must be one of {', '.join(PANEL_SORTS)}."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            # 2. Optional name search
+            panel = patient_panel(doctor)
+            search = request.query_params.get('search', '').strip()
+            if search:
+                panel = panel.filter(
+                    Q(user_link__username__icontains=search)
+                    | Q(user_link__first_name__icontains=search)
+                    | Q(user_link__last_name__icontains=search)
+                )
+
+            # 3. One page, last visits computed by the database
+            paginator = KeysetPaginator(ordering, get_page_size(request))
+            page, next_cursor = paginator.paginate(
+                PANEL.values(panel, 'last_visit', *PANEL_USER_FIELDS), request.query_params.get('cursor')
+            )
+
+            return Response({
+                "results": [panel_entry(row) for row in page],
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
+
+        except PaginationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""Gunicorn settings for serving wellnest over ASGI (Procfile.asgi):
+
+    gunicorn wellnest.asgi:application --config gunicorn_asgi.conf.py
+
+The default Procfile keeps the WSGI deployment, where every request holds
+a worker until its client has sent, and received, the whole thing. Here
+each worker is a uvicorn event loop: slow clients, the ``async/...`` read
+endpoints and the event stream only cost it a coroutine, and DRF views
+run in a thread each.
+"""
+import os
+
+# Django keeps one persistent connection per thread, and under ASGI sync
+# code runs on many threads: close connections after each request instead
+# (a pooler such as PgBouncer in front of the database makes up for it).
+# Set before the settings are read below, which fixes the value.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wellnest.settings')
+
+from sharedapp.deployment import process_local_backends  # noqa: E402
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+# One process unless the cache and the events broker are shared: with a
+# process-local one, each worker would keep its own denylist, version
+# stamps and event listeners
+_local = process_local_backends()
+workers = int(os.environ.get('WEB_CONCURRENCY', 1 if _local else 2))
+if workers > 1 and _local:
+    raise RuntimeError(
+        f"{workers} workers need a shared cache and events broker, but {' and '.join(_local)} "
+        "only reach one process: set REDIS_URL, or WEB_CONCURRENCY=1."
+    )
+
+# Event streams stay open: give them time to end on a restart
+graceful_timeout = 30
+keepalive = 5
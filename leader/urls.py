@@ -4,12 +4,18 @@ from . import views  # Ensure you have a views file
 urlpatterns = [
     path("getDoctorMessages",views.getDoctorMessages.as_view(),name="getDoctorMessages"),
     path("getPatientMessages",views.getPatientMessages.as_view(),name="getPatientMessages"),
+    path("getInbox",views.getInbox.as_view(),name="getInbox"),
+    path("async/getInbox",views.getInboxAsync.as_view(),name="getInboxAsync"),
     path("getDoctorList",views.getDoctorList.as_view(),name="getDoctorList"),
     path("getPatientList",views.getPatientList.as_view(),name="getPatientList"),
     path("getInterface",views.getInterface.as_view(),name="getInterface"),
     path("CreatePatient",views. CreatePatient.as_view(),name="CreatePatient"),
+    path("ImportPatients",views.ImportPatients.as_view(),name="ImportPatients"),
+    path("ImportPatients/<uuid:job_id>",views.ImportPatientsJob.as_view(),name="ImportPatientsJob"),
+    path("export/<str:table>.<str:fmt>",views.ExportTable.as_view(),name="ExportTable"),
    path('user-manage/<int:id>',views.UserDetailView.as_view(), name='user-detail-manage'),
    path("markAsDone/<int:message_id>/<str:message_type>",views.markAsDone.as_view(),name="markAsDone"),
+   path("markAsDone/<str:message_type>",views.markManyAsDone.as_view(),name="markManyAsDone"),
    
 
 
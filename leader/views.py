@@ -2,16 +2,74 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status,generics
 from rest_framework.permissions import IsAuthenticated ,AllowAny
-from sharedapp.serializers import MessageDocSerializer,MessagePatSerializer,UserSerializer,DoctorSerializer,UserUpdateSerializer,PatientSerializer,AppointmentSerializer
-from sharedapp.models import MessageDoc,MessagePat,User,Leader,Doctor,Patient,Appointment,Service
+from sharedapp.serializers import MessageDocSerializer,MessagePatSerializer,UserSerializer,UserUpdateSerializer,AppointmentSerializer
+from sharedapp.models import MessageDoc,MessagePat,User,Leader,Doctor,Patient,Appointment,Service,ImportJob
+from sharedapp import availability, bulk, counters, exports, onboarding, quotas, versions
+from sharedapp.hashers import default_patient_password
+from sharedapp.asyncviews import AsyncAPIView, json_response
+from sharedapp.pagination import KeysetPaginator, get_page_size
+from sharedapp.profiles import ProfileMixin
+from sharedapp.projections import Projection
+from sharedapp.thumbnails import thumbnail_urls
+from django.http import StreamingHttpResponse
+import datetime
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import CharField, Value
 from django.contrib.auth.hashers import make_password
 
 # 1. IMPORT YOUR MODELS AND SERIALIZERS HERE
 # from .models import [MODEL_NAME]
 # from .serializers import [SERIALIZER_NAME]
 
+# Inboxes are read newest first; message_id breaks ties inside one table
+INBOX_ORDERING = ('-message_date', '-message_id')
+# The unified inbox also orders on the source table, since ids repeat across tables
+UNIFIED_INBOX_ORDERING = ('-message_date', '-message_type', '-message_id')
+
+# Directory rows, read with values(). The profile columns are listed rather
+# than taken from the serializers, whose exclude would also let out the
+# account link and the stored file digests.
+DOCTOR_DIRECTORY_FIELDS = (
+    'doctor_id', 'doctor_phone', 'doctor_address', 'doctor_willaya',
+    'doctor_cotas', 'doctor_speciality', 'doctor_leftcotas',
+)
+PATIENT_DIRECTORY_FIELDS = (
+    'patient_id', 'patient_companyid', 'patient_datebirth', 'patient_cancer',
+    'patient_leftcotas', 'patient_address', 'patient_phone', 'patient_willaya',
+)
+DOCTOR_DIRECTORY = Projection(doctor_info=(DOCTOR_DIRECTORY_FIELDS, ''), user_info=(UserSerializer, 'user_link__'))
+PATIENT_DIRECTORY = Projection(patient_info=(PATIENT_DIRECTORY_FIELDS, ''), user_info=(UserSerializer, 'user_link__'))
+
+
+def pending_doctor_messages(willaya):
+    return MessageDoc.objects.filter(
+        message_status=False, message_sender__doctor_willaya=willaya
+    ).select_related('message_sender__user_link')
+
+
+def pending_patient_messages(willaya):
+    return MessagePat.objects.filter(
+        message_status=False, message_sender__patient_willaya=willaya
+    ).select_related('message_sender__user_link')
+
+
+def inbox_versions(request):
+    """Stamps covering a leader's inboxes (see sharedapp.versions)."""
+    try:
+        willaya = request.profile.admin_willaya
+    except Leader.DoesNotExist:
+        willaya = None
+    return [versions.key('inbox', willaya), versions.key('inbox', '*')]
+
+
+def inbox_entry(item, serializer_class):
+    user_info = item.message_sender.user_link
+    return {
+        "message_info": serializer_class(item).data,
+        "user_info": UserSerializer(user_info).data if user_info else None
+    }
+
 
 class markAsDone(APIView):
     def patch(self, request, message_id, message_type):
@@ -47,6 +105,28 @@ class markAsDone(APIView):
             )
 
 
+class markManyAsDone(ProfileMixin, APIView):
+    """ markAsDone for a list of messages of the leader's willaya: {"ids": [...]} """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+
+    def patch(self, request, message_type):
+        if message_type not in bulk.MESSAGE_TABLES:
+            return Response(
+                {"error": "Invalid message type. Use 'doctor' or 'patient'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = bulk.parse_ids(request.data)
+            # One UPDATE for the whole list; each id reports done, already_done or not_found
+            results = bulk.mark_messages_done(message_type, ids, request.profile.admin_willaya)
+            return Response({"results": results}, status=status.HTTP_200_OK)
+        except Leader.DoesNotExist:
+            return Response({"error": "You are not registered as a Leader."}, status=403)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = User.objects.all()
     serializer_class = UserUpdateSerializer
@@ -92,7 +172,7 @@ class CreatePatient(APIView):
 
                 # 2. Formula for Default Password
                 # Example: "Pat@" + company_id (e.g., Pat@12345)
-                default_password = f"Pat@{company_id}"
+                default_password = default_patient_password(company_id)
 
                 # 3. Create the Patient Profile first to get the patient_id
                 new_patient = Patient.objects.create(
@@ -126,128 +206,247 @@ class CreatePatient(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class getDoctorMessages(APIView):
+class ImportPatients(ProfileMixin, APIView):
+    """ Onboard a whole company at once from a CSV or JSONL file
+
+    Send the file as multipart field "file"; its extension (.csv / .jsonl)
+    picks the format. Columns are CreatePatient's fields. The file is queued
+    for the import worker (manage.py run_import_jobs): poll status_url for
+    the report, where every row gets a line, created or not.
+    """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "Send the file as multipart field 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        job = onboarding.enqueue(request.user, upload, upload.name)
+        return Response({
+            "job_id": job.job_id,
+            "status": job.job_status,
+            "status_url": request.build_absolute_uri(f'/leader/ImportPatients/{job.job_id}'),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class ImportPatientsJob(ProfileMixin, APIView):
+    """ Where an import stands; once done, its totals and per-row report """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+
+    def get(self, request, job_id):
+        job = ImportJob.objects.filter(pk=job_id, job_owner=request.user).first()
+        if job is None:
+            return Response({"error": "No such import."}, status=status.HTTP_404_NOT_FOUND)
+        body = {"job_id": job.job_id, "status": job.job_status}
+        if job.job_status == 'done':
+            body.update(onboarding.summary(job.job_report), rows=job.job_report)
+        elif job.job_status == 'failed':
+            body["error"] = job.job_error
+        return Response(body, status=status.HTTP_200_OK)
+
+
+class ExportTable(ProfileMixin, APIView):
+    """ Stream a whole table as CSV or JSONL, e.g. export/appointments.csv
+
+    Optional filters: ?willaya=... and, for appointments and messages,
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive).
+    """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+
+    def get(self, request, table, fmt):
+        params = request.query_params
+        try:
+            first_day = datetime.date.fromisoformat(params['from']) if params.get('from') else None
+            last_day = datetime.date.fromisoformat(params['to']) if params.get('to') else None
+            chunks = exports.stream(table, fmt, params.get('willaya'), first_day, last_day)
+        except (ValueError, exports.ExportError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Rows are read and sent as the client downloads them, never all held at once
+        response = StreamingHttpResponse(chunks, content_type=f"{exports.FORMATS[fmt]}; charset=utf-8")
+        response['Content-Disposition'] = f'attachment; filename="{table}.{fmt}"'
+        return response
+
+
+class getDoctorMessages(ProfileMixin, APIView):
     # Change to IsAuthenticated so request.user is always a valid User
     permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
 
+    @versions.conditional(inbox_versions)
     def get(self, request):
         try:
             # 1. Get the current Leader's Willaya
-            # We do this once OUTSIDE the loop
-            leader = Leader.objects.get(admin_id=request.user.user_role_id)
-            leader_willaya = leader.admin_willaya
+            willaya = request.profile.admin_willaya
 
-            # 2. Get all pending messages
-            messages = MessageDoc.objects.filter(message_status=False)
-            
-            object_list = []
-            
-            for item in messages:
-                # 3. Get the Doctor profile of the sender
-                # Note: item.message_sender is the Doctor instance (from your model definition)
-                doctor = item.message_sender 
-                
-                # 4. Check if the Doctor is in the same Willaya as the Leader
-                if doctor.doctor_willaya == leader_willaya:
-                    # Find the User account linked to this doctor to get their name/info
-                    user_info = User.objects.filter(user_role="doctor", user_role_id=doctor.doctor_id).first()
-                    
-                    object_list.append({
-                        "message_info": MessageDocSerializer(item).data,
-                        "user_info": UserSerializer(user_info).data if user_info else None
-                    })
-
-            return Response(object_list, status=status.HTTP_200_OK)
+            # 2. Pending messages from doctors of this willaya, filtered in SQL
+            # (the sender and its User account come along in the same query)
+            messages = pending_doctor_messages(willaya)
+
+            # 3. Only read one page, starting after the client's cursor
+            paginator = KeysetPaginator(INBOX_ORDERING, get_page_size(request))
+            page, next_cursor = paginator.paginate(messages, request.query_params.get('cursor'))
+
+            return Response({
+                "results": [inbox_entry(item, MessageDocSerializer) for item in page],
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
             
         except Leader.DoesNotExist:
             return Response({"error": "You are not registered as a Leader."}, status=403)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-class getPatientMessages(APIView):
+class getPatientMessages(ProfileMixin, APIView):
     permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+    @versions.conditional(inbox_versions)
     def get(self, request):
         try:
             # 1. Get the current Leader's Willaya
-            # We do this once OUTSIDE the loop
-            leader = Leader.objects.get(admin_id=request.user.user_role_id)
-            leader_willaya = leader.admin_willaya
+            willaya = request.profile.admin_willaya
 
-            # 2. Get all pending messages
-            messages = MessagePat.objects.filter(message_status=False)
-            
-            object_list = []
-            
-            for item in messages:
-                # 3. Get the Doctor profile of the sender
-                # Note: item.message_sender is the Doctor instance (from your model definition)
-                patient = item.message_sender 
-                
-                # 4. Check if the Doctor is in the same Willaya as the Leader
-                if patient.patient_willaya == leader_willaya:
-                    # Find the User account linked to this doctor to get their name/info
-                    user_info = User.objects.filter(user_role="patient", user_role_id=patient.patient_id).first()
-                    
-                    object_list.append({
-                        "message_info": MessagePatSerializer(item).data,
-                        "user_info": UserSerializer(user_info).data if user_info else None
-                    })
-
-            return Response(object_list, status=status.HTTP_200_OK)
+            # 2. Pending messages from patients of this willaya, filtered in SQL
+            # (the sender and its User account come along in the same query)
+            messages = pending_patient_messages(willaya)
+
+            # 3. Only read one page, starting after the client's cursor
+            paginator = KeysetPaginator(INBOX_ORDERING, get_page_size(request))
+            page, next_cursor = paginator.paginate(messages, request.query_params.get('cursor'))
+
+            return Response({
+                "results": [inbox_entry(item, MessagePatSerializer) for item in page],
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
             
         except Leader.DoesNotExist:
             return Response({"error": "You are not registered as a Leader."}, status=403)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def unified_inbox(willaya):
+    # Tag each source so rows from both tables have a unique position
+    doctor_messages = pending_doctor_messages(willaya).annotate(
+        message_type=Value("doctor", output_field=CharField()))
+    patient_messages = pending_patient_messages(willaya).annotate(
+        message_type=Value("patient", output_field=CharField()))
+    return [doctor_messages, patient_messages]
+
+
+def unified_inbox_entry(item):
+    serializer_class = MessageDocSerializer if item.message_type == "doctor" else MessagePatSerializer
+    return {"message_type": item.message_type, **inbox_entry(item, serializer_class)}
+
+
+class getInbox(ProfileMixin, APIView):
+    """ Doctor and patient messages of the leader's willaya in one stream """
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+    @versions.conditional(inbox_versions)
+    def get(self, request):
+        try:
+            willaya = request.profile.admin_willaya
+
+            # Read one page from each table and merge them
+            paginator = KeysetPaginator(UNIFIED_INBOX_ORDERING, get_page_size(request))
+            page, next_cursor = paginator.paginate_merged(unified_inbox(willaya), request.query_params.get('cursor'))
+
+            results = [unified_inbox_entry(item) for item in page]
+            return Response({"results": results, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+        except Leader.DoesNotExist:
+            return Response({"error": "You are not registered as a Leader."}, status=403)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class getInboxAsync(AsyncAPIView):
+    """ getInbox, read with the async ORM (see sharedapp.asyncviews) """
+    profile_role = 'admin'
+    load_profile = True
+    profile_missing = "You are not registered as a Leader."
+
+    @versions.conditional(inbox_versions)
+    async def get(self, request):
+        try:
+            paginator = KeysetPaginator(UNIFIED_INBOX_ORDERING, get_page_size(request))
+            page, next_cursor = await paginator.apaginate_merged(
+                unified_inbox(request.profile.admin_willaya), request.query_params.get('cursor'))
+
+            results = [unified_inbox_entry(item) for item in page]
+            return json_response({"results": results, "next_cursor": next_cursor})
+
+        except Exception as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     
-class getDoctorList(APIView):
-    
+class getDoctorList(ProfileMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
+
     def get(self, request):
         try:
-            # 1. Use .filter() instead of .get() to get an iterable list
+            # 1. Optional filters: ?willaya=...&speciality=<id>
             doctors = Doctor.objects.all()
-            
-            object_list = []
-            for item in doctors:
-                # 2. Access the sender. 
-                # Assuming 'message_sender' is a ForeignKey to User
-                user_info = User.objects.filter(user_role_id=item.doctor_id,user_role='doctor').first() 
-                
-                # 3. Serializers need .data to be turned into JSON
-                # Also, use () for the dictionary, not {} which creates a set
-                object_list.append({
-                    "doctor_info": DoctorSerializer(item).data,
-                    "user_info": UserSerializer(user_info).data if user_info else None
-                })
+            if request.query_params.get('willaya'):
+                doctors = doctors.filter(doctor_willaya=request.query_params['willaya'])
+            if request.query_params.get('speciality'):
+                doctors = doctors.filter(doctor_speciality_id=request.query_params['speciality'])
+
+            # 2. Only the directory columns, User joined in the same query
+            rows = DOCTOR_DIRECTORY.values(doctors, 'doctor_pic_ref')
+
+            # 3. One page at a time, in doctor_id order
+            paginator = KeysetPaginator(('doctor_id',), get_page_size(request))
+            page, next_cursor = paginator.paginate(rows, request.query_params.get('cursor'))
 
-            return Response(object_list, status=status.HTTP_200_OK)
+            # 4. Quota moved into slots still counts as left
+            in_slots = quotas.slot_totals([row['doctor_id'] for row in page])
+            for row in page:
+                row['doctor_leftcotas'] += in_slots.get(row['doctor_id'], 0)
+
+            return Response({
+                "results": [
+                    {**DOCTOR_DIRECTORY.shape(row), "thumbnails": thumbnail_urls(row['doctor_pic_ref'])}
+                    for row in page
+                ],
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
             
         except Exception as e:
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-class getPatientList(APIView):
+class getPatientList(ProfileMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    profile_role = 'admin'
 
-    
     def get(self, request):
         try:
-            # 1. Use .filter() instead of .get() to get an iterable list
+            # 1. Optional filters: ?willaya=...&cancer=true|false
             patients = Patient.objects.all()
-            
-            object_list = []
-            for item in patients:
-                # 2. Access the sender. 
-                # Assuming 'message_sender' is a ForeignKey to User
-                user_info = User.objects.filter(user_role_id=item.patient_id,user_role='patient').first() 
-                
-                # 3. Serializers need .data to be turned into JSON
-                # Also, use () for the dictionary, not {} which creates a set
-                object_list.append({
-                    "patient_info": PatientSerializer(item).data,
-                    "user_info": UserSerializer(user_info).data if user_info else None
-                })
+            if request.query_params.get('willaya'):
+                patients = patients.filter(patient_willaya=request.query_params['willaya'])
+            cancer = request.query_params.get('cancer')
+            if cancer:
+                if cancer.lower() not in ('true', 'false', '1', '0'):
+                    return Response({"error": "cancer must be true or false."}, status=status.HTTP_400_BAD_REQUEST)
+                patients = patients.filter(patient_cancer=cancer.lower() in ('true', '1'))
+
+            # 2. Only the directory columns, User joined in the same query
+            rows = PATIENT_DIRECTORY.values(patients)
 
-            return Response(object_list, status=status.HTTP_200_OK)
+            # 3. One page at a time, in patient_id order
+            paginator = KeysetPaginator(('patient_id',), get_page_size(request))
+            page, next_cursor = paginator.paginate(rows, request.query_params.get('cursor'))
+
+            return Response({
+                "results": [PATIENT_DIRECTORY.shape(row) for row in page],
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
             
         except Exception as e:
             return Response(
@@ -257,36 +456,33 @@ class getPatientList(APIView):
 class getInterface(APIView):
     def get(self, request):
         try:
-            # 1. Statistics Counters
+            # 1. Statistics Counters (precomputed, see sharedapp.counters)
+            today = timezone.localdate()
+            totals, todays = counters.read_dashboard(today)
             response_object = {
-                "total_number_patients": Patient.objects.count(),
-                "total_number_doctors": Doctor.objects.count(),
-                "total_number_appointments": Appointment.objects.count(),
-                "total_number_doctmessages": MessageDoc.objects.count(),
-                "total_number_pattmessages": MessagePat.objects.count(),
+                "total_number_patients": totals["patients"],
+                "total_number_doctors": totals["doctors"],
+                "total_number_appointments": totals["appointments"],
+                "total_number_doctmessages": totals["doctor_messages"],
+                "total_number_pattmessages": totals["patient_messages"],
+                "today_number_appointments": todays["appointments"],
+                "today_number_doctmessages": todays["doctor_messages"],
+                "today_number_pattmessages": todays["patient_messages"],
             }
 
             # 2. Get Today's Appointments
-            today = timezone.now().date()
-            # Note: filter using apointment_date__date
-            todays_appointments = Appointment.objects.filter(apointment_date__date=today)
+            # Note: filter on today's datetime range so the apointment_date index is used
+            # The service and both User accounts come along in the same query
+            start, end = availability.local_range(today, today)
+            todays_appointments = Appointment.objects.filter(
+                apointment_date__gte=start, apointment_date__lt=end
+            ).select_related('apointment_service', 'apointment_pat__user_link', 'apointment_doc__user_link')
 
             object_list = []
             for item in todays_appointments:
-                # IMPORTANT: Use .apointment_pat_id and .apointment_doc_id 
-                # to get the integer ID from the ForeignKey
-                patient_user = User.objects.filter(
-                    user_role_id=item.apointment_pat_id, 
-                    user_role='patient'
-                ).first() 
-                
-                doctor_user = User.objects.filter(
-                    user_role_id=item.apointment_doc_id, 
-                    user_role='doctor'
-                ).first() 
-                
-                # Fetch the service name using the ForeignKey ID
-                service = Service.objects.filter(service_id=item.apointment_service_id).first()
+                patient_user = item.apointment_pat.user_link
+                doctor_user = item.apointment_doc.user_link
+                service = item.apointment_service
                 
                 object_list.append({
                     "patient_name": patient_user.username if patient_user else "Unknown Patient",
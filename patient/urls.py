@@ -6,16 +6,23 @@ urlpatterns = [
     path("getPersonalInfo",views.getPersonalInfo.as_view(),name="getPersonalInfo"),
     path("getOrdonance",views.getOrdonance.as_view(),name="getOrdonance"),
     path("getHistory",views.getHistory.as_view(),name="getHistory"),
+    path("async/getHistory",views.getHistoryAsync.as_view(),name="getHistoryAsync"),
     path("getAppointments",views.getAppointments.as_view(),name="getAppointments"),
     path("CreateMessagePat",views.CreateMessagePat.as_view(),name="CreateMessagePat"),
     path("ManageAppointment",views.ManageAppointment.as_view(),name="ManageAppointment"),
+    # PUT / DELETE act on one appointment
+    path("ManageAppointment/<int:pk>",views.ManageAppointment.as_view(),name="ManageAppointmentDetail"),
     
 # Get all specialities: /api/specialities/
     path('specialities/', views.SpecialityListView.as_view(), name='speciality-list'),
 
     # Get doctors in speciality #5: /api/speciality/5/doctors/
     path('speciality/<int:spec_id>/doctors/', views.DoctorsBySpecialityView.as_view(), name='doctors-by-spec'),
+    path('async/speciality/<int:spec_id>/doctors/', views.DoctorsBySpecialityAsync.as_view(), name='doctors-by-spec-async'),
 
     # Get services for doctor #10: /api/doctor/10/services/
     path('doct/<int:doctor_id>/services/', views.DoctorServicesView.as_view(), name='doct-services'),
+
+    # Free slots for service #3 of doctor #10: /api/doct/10/services/3/slots?from=2026-01-05&to=2026-01-11
+    path('doct/<int:doctor_id>/services/<int:service_id>/slots', views.DoctorSlotsView.as_view(), name='doct-service-slots'),
 ]
\ No newline at end of file
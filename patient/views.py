@@ -6,36 +6,78 @@ from sharedapp.serializers import PatientSerializer,UserSerializer,AppointmentSe
 from sharedapp.models import Patient,User,Appointment,Ordonance,Doctor,MessagePat,Speciality,Service
 from rest_framework import generics
 from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Sum
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+import datetime
 from django.utils import timezone
+from sharedapp import availability, directory, quotas, versions
+from sharedapp.asyncviews import AsyncAPIView, json_response
+from sharedapp.pagination import KeysetPaginator, get_page_size
+from sharedapp.profiles import ProfileMixin
+from sharedapp.projections import Projection
 
 
+# The public directory (specialities, doctors, services) is cached per
+# generation, see sharedapp.directory; only the quotas are read live.
+
 # 1. Get all Specialities
 class SpecialityListView(generics.ListAPIView):
     queryset = Speciality.objects.all()
     serializer_class = SpecialitySerializer
 
+    def list(self, request, *args, **kwargs):
+        data = directory.cached('specialities', lambda: super(SpecialityListView, self).list(request).data)
+        return Response(data)
+
+
+def live_quotas(spec_id):
+    # Quotas move with every booking: one live query, slots included
+    return (
+        Doctor.objects.filter(doctor_speciality_id=spec_id)
+        .values('doctor_id')
+        .annotate(left=F('doctor_leftcotas') + Coalesce(Sum('quota_slots__slot_left'), 0))
+        .values_list('doctor_id', 'left')
+        .order_by()
+    )
+
+
+def with_live_quotas(results, live):
+    return [
+        {**doctor, 'doctor_leftcotas': live[doctor['doctor_id']]}
+        for doctor in results if doctor['doctor_id'] in live
+    ]
+
+
+def speciality_doctors(spec_id):
+    return Doctor.objects.filter(doctor_speciality_id=spec_id).select_related('user_link')
+
+
 # 2. Get Doctors by Speciality (Including User data)
 class DoctorsBySpecialityView(APIView):
     def get(self, request, spec_id):
-        # Fetch doctors in this speciality
-        doctors = Doctor.objects.filter(doctor_speciality_id=spec_id)
-        
-        results = []
-        for doc in doctors:
-            # Find the corresponding User record
-            user_account = User.objects.filter(user_role='doctor', user_role_id=doc.doctor_id).first()
-            
-            # Merge data
-            doc_data = DoctorWithUserSerializer(doc).data
-            if user_account:
-                doc_data['username'] = user_account.username
-                doc_data['first_name'] = user_account.first_name
-                doc_data['last_name'] = user_account.last_name
-                doc_data['email'] = user_account.email
-            
-            results.append(doc_data)
-            
-        return Response(results, status=status.HTTP_200_OK)
+        # Doctors in this speciality, joined to their User record, from the cache when possible
+        results = directory.cached(
+            f'speciality:{spec_id}:doctors',
+            lambda: DoctorWithUserSerializer(speciality_doctors(spec_id), many=True).data,
+        )
+        live = dict(live_quotas(spec_id))
+        return Response(with_live_quotas(results, live), status=status.HTTP_200_OK)
+
+
+class DoctorsBySpecialityAsync(AsyncAPIView):
+    """ DoctorsBySpecialityView, read with the async ORM (see sharedapp.asyncviews) """
+    authentication_required = False
+
+    async def get(self, request, spec_id):
+        async def build():
+            doctors = [doctor async for doctor in speciality_doctors(spec_id)]
+            return DoctorWithUserSerializer(doctors, many=True).data
+
+        # Same cache entry as the sync view
+        results = await directory.acached(f'speciality:{spec_id}:doctors', build)
+        live = {doctor_id: left async for doctor_id, left in live_quotas(spec_id)}
+        return json_response(with_live_quotas(results, live))
 
 # 3. Get Services for a specific Doctor
 class DoctorServicesView(generics.ListAPIView):
@@ -45,6 +87,45 @@ class DoctorServicesView(generics.ListAPIView):
         doctor_id = self.kwargs['doctor_id']
         return Service.objects.filter(doc_id=doctor_id)
 
+    def list(self, request, *args, **kwargs):
+        data = directory.cached(
+            f'doctor:{self.kwargs["doctor_id"]}:services',
+            lambda: super(DoctorServicesView, self).list(request).data,
+        )
+        return Response(data)
+
+# 4. Free slots for one of a doctor's services: ?from=YYYY-MM-DD&to=YYYY-MM-DD (a week by default)
+class DoctorSlotsView(APIView):
+    MAX_DAYS = 31
+
+    def get(self, request, doctor_id, service_id):
+        try:
+            service = Service.objects.only('service_duration').get(service_id=service_id, doc_id=doctor_id)
+        except Service.DoesNotExist:
+            return Response({"error": "Service not found for this doctor."}, status=404)
+
+        try:
+            today = timezone.localdate()
+            first_day = datetime.date.fromisoformat(request.query_params.get('from', today.isoformat()))
+            last_day = datetime.date.fromisoformat(
+                request.query_params.get('to', (first_day + datetime.timedelta(days=6)).isoformat())
+            )
+        except ValueError:
+            return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=400)
+        if last_day < first_day or (last_day - first_day).days >= self.MAX_DAYS:
+            return Response({"error": f"Ask for 1 to {self.MAX_DAYS} days at a time."}, status=400)
+
+        days = availability.free_slots(doctor_id, service.service_duration, max(first_day, today), last_day)
+        return Response({
+            "doctor": doctor_id,
+            "service": service_id,
+            "duration": service.service_duration.isoformat(),
+            "days": [
+                {"date": day.isoformat(), "slots": [timezone.localtime(start).isoformat() for start in starts]}
+                for day, starts in days.items()
+            ],
+        }, status=status.HTTP_200_OK)
+
 
 class ManageAppointment(APIView):
     # Ensure only logged-in users can access this
@@ -62,38 +143,33 @@ class ManageAppointment(APIView):
             if not patient_id or request.user.user_role != 'patient':
                 return Response({"error": "Only patients can create appointments."}, status=403)
 
-            # Step 2: Lock the rows for Quota calculation (Prevents race conditions)
-            doctor = Doctor.objects.select_for_update().get(doctor_id=data.get('apointment_doc'))
-            patient = Patient.objects.select_for_update().get(patient_id=patient_id)
-            
-            # Step 3: Quota Validation Logic
-            if doctor.doctor_leftcotas <= 0:
-                return Response({"error": "Doctor has no quotas left."}, status=400)
-            
-            if not patient.patient_cancer and patient.patient_leftcotas <= 0:
-                return Response({"error": "Patient has no quotas left."}, status=400)
-
-            # Step 4: Inject IDs into data for Serializer validation
+            # Step 2: Inject IDs into data for Serializer validation
             data['apointment_pat'] = patient_id
             
             serializer = AppointmentSerializer(data=data)
             if serializer.is_valid():
-                serializer.save()
-                
-                # Step 5: Update Quotas in Database
-                doctor.doctor_leftcotas -= 1
-                doctor.save()
-                
-                if not patient.patient_cancer:
-                    patient.patient_leftcotas -= 1
-                    patient.save()
+                doctor_id = serializer.validated_data['apointment_doc'].doctor_id
+                start = serializer.validated_data['apointment_date']
+                duration = serializer.validated_data['apointment_service'].service_duration
+
+                # Step 3: Cheap clash check against the cached agenda before writing anything
+                availability.check_cached(doctor_id, start, duration)
+
+                # Step 4: Save, then take the quotas last so the doctor row is held only until commit.
+                # A refused quota or a clash rolls the appointment back with it.
+                with transaction.atomic():
+                    appointment = serializer.save()
+                    quotas.reserve(doctor_id, patient_id)
+                    availability.ensure_free(doctor_id, start, duration, exclude=appointment.apointment_id)
                 
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        except (Doctor.DoesNotExist, Patient.DoesNotExist):
-            return Response({"error": "Doctor or Patient profile not found."}, status=404)
+        except quotas.QuotaExhausted as e:
+            return Response({"error": str(e)}, status=400)
+        except availability.SlotTaken as e:
+            return Response({"error": str(e)}, status=409)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
@@ -103,39 +179,33 @@ class ManageAppointment(APIView):
         try:
             # We get the existing appointment using the Primary Key from the URL
             old_appointment = Appointment.objects.get(apointment_id=pk)
-            
-            # 1. 'Undo' old quotas first to see if modification is possible
-            doc_old = old_appointment.apointment_doc
-            pat_old = old_appointment.apointment_pat
-            
-            doc_old.doctor_leftcotas += 1
-            doc_old.save()
-            if not pat_old.patient_cancer:
-                pat_old.patient_leftcotas += 1
-                pat_old.save()
+            old_doc_id = old_appointment.apointment_doc_id
+            old_pat_id = old_appointment.apointment_pat_id
 
-            # 2. Try to apply new data
+            # 1. Try to apply new data
             data = request.data.copy()
             data['apointment_pat'] = request.user.user_role_id # Security check again
             
             serializer = AppointmentSerializer(old_appointment, data=data)
             
             if serializer.is_valid():
-                new_doc = Doctor.objects.select_for_update().get(doctor_id=data.get('apointment_doc'))
-                new_pat = Patient.objects.select_for_update().get(patient_id=data.get('apointment_pat'))
-                
-                # Check if new quotas are available
-                if new_doc.doctor_leftcotas > 0 and (new_pat.patient_cancer or new_pat.patient_leftcotas > 0):
-                    serializer.save()
-                    new_doc.doctor_leftcotas -= 1
-                    new_doc.save()
-                    if not new_pat.patient_cancer:
-                        new_pat.patient_leftcotas -= 1
-                        new_pat.save()
+                try:
+                    # 2. 'Undo' old quotas, then take the new ones; all or nothing
+                    with transaction.atomic():
+                        quotas.refund(old_doc_id, old_pat_id)
+                        appointment = serializer.save()
+                        quotas.reserve(appointment.apointment_doc_id, appointment.apointment_pat_id)
+                        availability.ensure_free(
+                            appointment.apointment_doc_id, appointment.apointment_date,
+                            appointment.apointment_service.service_duration, exclude=appointment.apointment_id,
+                        )
                     return Response(serializer.data)
+                except (quotas.QuotaExhausted, availability.SlotTaken):
+                    pass
 
             # 3. If validation fails or quotas are full, DELETE the original (per your instructions)
-            old_appointment.delete()
+            quotas.refund(old_doc_id, old_pat_id)
+            Appointment.objects.filter(apointment_id=pk).delete()
             return Response({"message": "Modification failed. Appointment has been deleted."}, status=400)
 
         except Appointment.DoesNotExist:
@@ -151,16 +221,8 @@ class ManageAppointment(APIView):
             if appointment.apointment_pat_id != request.user.user_role_id:
                 return Response({"error": "You cannot cancel someone else's appointment."}, status=403)
 
-            doctor = appointment.apointment_doc
-            patient = appointment.apointment_pat
-
             # Return the quotas
-            doctor.doctor_leftcotas += 1
-            doctor.save()
-            
-            if not patient.patient_cancer:
-                patient.patient_leftcotas += 1
-                patient.save()
+            quotas.refund(appointment.apointment_doc_id, appointment.apointment_pat_id)
 
             appointment.delete()
             return Response({"message": "Appointment cancelled and quotas returned."}, status=status.HTTP_204_NO_CONTENT)
@@ -168,28 +230,41 @@ class ManageAppointment(APIView):
         except Appointment.DoesNotExist:
             return Response({"error": "Appointment not found."}, status=404)
 
-class CreateMessagePat(generics.CreateAPIView):
+class CreateMessagePat(ProfileMixin, generics.CreateAPIView):
     queryset = MessagePat.objects.all()
     serializer_class = MessagePatSerializer
+    profile_role = 'patient'
 
     def perform_create(self, serializer):
-        # 1. Find the Doctor instance using the ID from the User model
-        # Note: Your model expects a Doctor instance, not just an integer
-        patient_instance = Patient.objects.get(patient_id=self.request.user.user_role_id)
+        # 1. The sender is the caller's Patient profile
+        # Note: Your model expects a Patient instance, not just an integer
+        patient_instance = self.request.profile
         
         # 2. Save the message with the sender
         # 'message_date' is auto-generated because of auto_now_add=True in your model
         serializer.save(message_sender=patient_instance)
 
 
-class getPersonalInfo(APIView):
+class getPersonalInfo(ProfileMixin, APIView):
     permission_classes = [IsAuthenticated]
+    profile_role = 'patient'
+
+    # Cacheable read: 304 while neither the account nor the profile changed. POST is kept for older clients.
+    @versions.conditional(lambda request: [
+        versions.key('user', request.user.pk), versions.key('patient', request.user.user_role_id),
+    ])
+    def get(self, request):
+        return self.post(request)
+
     def post(self, request):
         try:
             # 1. Use the ID stored on the User model to find the Doctor
             # We use user_role_id because that's your custom link
-            patient =Patient.objects.get(patient_id=request.user.user_role_id)
-            the_user = User.objects.get(id=request.user.id)
+            # The profile comes with its account (see sharedapp.profiles)
+            patient = request.profile
+            the_user = patient.user_link
+            if patient.user_link_id != request.user.id:
+                the_user = User.objects.get(id=request.user.id)
             # 2. Pass the 'doctor' object to the serializer
             serializer1 = PatientSerializer(patient)
             serializer2 = UserSerializer(the_user)
@@ -207,85 +282,153 @@ class getPersonalInfo(APIView):
                 {"error": "Patient profile not found."}, 
                 status=status.HTTP_404_NOT_FOUND
             )
-class getOrdonance(APIView):
+class getOrdonance(ProfileMixin, APIView):
+    """The patient's prescriptions grouped by appointment, newest first, a page at a time.
+
+    Metadata only; each ordonance carries a ``file_url`` to download the file.
+    """
     permission_classes = [IsAuthenticated]
+    profile_role = 'patient'
    
     def get(self, request):
         try:
-            # 1. Get all appointments for this patient
-            appointments = Appointment.objects.filter(apointment_pat_id=request.user.user_role_id)
-            
+            # 1. Appointments of this patient that have at least one ordonance,
+            # with the doctor's User account joined in the same query
+            appointments = Appointment.objects.filter(
+                Exists(Ordonance.objects.filter(ordonance_apointment=OuterRef('pk'))),
+                apointment_pat_id=request.user.user_role_id,
+            ).select_related('apointment_doc__user_link').only(
+                'apointment_id', 'apointment_date', 'apointment_doc__doctor_id',
+                'apointment_doc__user_link__id', 'apointment_doc__user_link__username',
+            ).prefetch_related(
+                # 2. Their ordonances in one extra query, without the file bytes
+                Prefetch('ordonance_set', queryset=Ordonance.objects.order_by('ordonance_id'))
+            )
+
+            # 3. One page, newest appointment first
+            paginator = KeysetPaginator(('-apointment_date', '-apointment_id'), get_page_size(request))
+            page, next_cursor = paginator.paginate(appointments, request.query_params.get('cursor'))
+
             response_list = []
-            for item in appointments: 
-                # 2. Get the QuerySet (List) of ordonances for this specific appointment
-                ordonances_queryset = Ordonance.objects.filter(ordonance_apointment_id=item.apointment_id)
-                
-                # 3. Only add to response if there is at least one ordonance
-                if ordonances_queryset.exists():
-                    # Find the doctor's User account
-                    doctor_user = User.objects.filter(
-                        user_role_id=item.apointment_doc_id, 
-                        user_role='doctor'
-                    ).first()
-
-                    response_list.append({
-                        # FIX: Added 'many=True' because ordonances_queryset is a list
-                        "ordonanceInfo": OrdonanceSerializer(ordonances_queryset, many=True).data,
-                        "doctorInfo": doctor_user.username if doctor_user else "Unknown Doctor",
-                        "appointment_date": item.apointment_date
-                    })
+            for item in page:
+                doctor_user = item.apointment_doc.user_link
+                ordonances = OrdonanceSerializer(item.ordonance_set.all(), many=True).data
+                for ordonance in ordonances:
+                    ordonance["file_url"] = reverse(
+                        'stored-file', kwargs={'kind': 'ordonance', 'pk': ordonance['ordonance_id']}
+                    )
+
+                response_list.append({
+                    "ordonanceInfo": ordonances,
+                    "doctorInfo": doctor_user.username if doctor_user else "Unknown Doctor",
+                    "appointment_date": item.apointment_date
+                })
      
-            return Response(response_list, status=status.HTTP_200_OK)
+            return Response({"results": response_list, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
             
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-class getHistory(APIView):
+# ==========================================
+# APPOINTMENT LISTS
+# ==========================================
+# Keyset pages over the (apointment_pat, apointment_status, apointment_date)
+# index, with the doctor and service names joined in the same query.
+
+APPOINTMENT_ROW = Projection(appointment=(AppointmentSerializer, ''))
+APPOINTMENT_EXTRA_FIELDS = (
+    'apointment_doc__user_link__username', 'apointment_doc__user_link__first_name',
+    'apointment_doc__user_link__last_name', 'apointment_doc__doctor_address',
+    'apointment_service__service_name',
+)
+
+
+def appointment_entry(row):
+    return {
+        **APPOINTMENT_ROW.shape(row),
+        "doctor_name": row['apointment_doc__user_link__username'] or "Unknown",
+        "doctor_first_name": row['apointment_doc__user_link__first_name'],
+        "doctor_last_name": row['apointment_doc__user_link__last_name'],
+        "doctor_address": row['apointment_doc__doctor_address'],
+        "service_name": row['apointment_service__service_name'],
+    }
+
+
+def appointment_page(request, appointments, ordering):
+    paginator = KeysetPaginator(ordering, get_page_size(request))
+    page, next_cursor = paginator.paginate(
+        APPOINTMENT_ROW.values(appointments, *APPOINTMENT_EXTRA_FIELDS), request.query_params.get('cursor')
+    )
+    results = [appointment_entry(row) for row in page]
+    return Response({"results": results, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+
+async def aappointment_page(request, appointments, ordering):
+    """``appointment_page`` for async views."""
+    paginator = KeysetPaginator(ordering, get_page_size(request))
+    page, next_cursor = await paginator.apaginate(
+        APPOINTMENT_ROW.values(appointments, *APPOINTMENT_EXTRA_FIELDS), request.query_params.get('cursor')
+    )
+    results = [appointment_entry(row) for row in page]
+    return json_response({"results": results, "next_cursor": next_cursor})
+
+
+def history_versions(request):
+    return [versions.key('appointments', request.user.user_role_id), directory.GENERATION_KEY]
+
+
+def history_of(patient_id):
+    return Appointment.objects.filter(apointment_pat_id=patient_id, apointment_status=True)
+
+
+HISTORY_ORDERING = ('-apointment_date', '-apointment_id')
+
+
+class getHistory(ProfileMixin, APIView):
+    """Completed appointments, newest first, a page at a time (?cursor=, ?page_size=)."""
     permission_classes = [IsAuthenticated]
+    profile_role = 'patient'
    
+    @versions.conditional(history_versions)
     def get(self, request):
         try:
-            # 1. Get all appointments for this patient
-            appointments = Appointment.objects.filter(apointment_pat_id=request.user.user_role_id,
-                                                      apointment_status=True)[:4]
-     
-            return Response(AppointmentSerializer(appointments,many=True).data, status=status.HTTP_200_OK)
+            return appointment_page(request, history_of(request.user.user_role_id), HISTORY_ORDERING)
             
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-class getAppointments(APIView):
+
+
+class getHistoryAsync(AsyncAPIView):
+    """ getHistory, read with the async ORM (see sharedapp.asyncviews) """
+    profile_role = 'patient'
+
+    @versions.conditional(history_versions)
+    async def get(self, request):
+        try:
+            return await aappointment_page(request, history_of(request.user.user_role_id), HISTORY_ORDERING)
+
+        except Exception as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class getAppointments(ProfileMixin, APIView):
+    """Pending appointments from today on, soonest first, a page at a time (?cursor=, ?page_size=)."""
     permission_classes = [IsAuthenticated]
+    profile_role = 'patient'
    
+    # The list starts today, so a new day is a new version too
+    @versions.conditional(lambda request: [
+        versions.key('appointments', request.user.user_role_id), directory.GENERATION_KEY,
+        versions.key('day', timezone.localdate()),
+    ])
     def get(self, request):
         try:
-            # Get the last 4 pending appointments
+            today = timezone.localdate()
             appointments = Appointment.objects.filter(
                 apointment_pat_id=request.user.user_role_id,
-                apointment_status=False
-            )[:4]
-
-            responseList = []
-            for item in appointments:
-                # 1. Use _id to get the number. 
-                # This prevents Django from doing an extra database query for the Doctor object here.
-                doc_id_number = item.apointment_doc_id 
-
-                # 2. Get the Doctor profile (for the address)
-                doctor_profile = Doctor.objects.get(doctor_id=doc_id_number)
-
-                # 3. Get the User account (for the username)
-                # Use the doc_id_number we extracted above
-                user_account = User.objects.filter(
-                    user_role_id=doc_id_number, 
-                    user_role='doctor'
-                ).first()
-
-                responseList.append({
-                    "appointment": AppointmentSerializer(item).data,
-                    "doctor_name": user_account.username if user_account else "Unknown",
-                    "doctor_address": doctor_profile.doctor_address
-                })
-                
-            return Response(responseList, status=status.HTTP_200_OK)
+                apointment_status=False,
+                apointment_date__gte=availability.local_range(today, today)[0],
+            )
+            return appointment_page(request, appointments, ('apointment_date', 'apointment_id'))
             
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
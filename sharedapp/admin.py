@@ -26,15 +26,18 @@ class CustomUserAdmin(UserAdmin):
 class DoctorAdmin(admin.ModelAdmin):
     list_display = ('doctor_id', 'doctor_willaya', 'doctor_phone', 'doctor_speciality')
     search_fields = ('doctor_willaya', 'doctor_phone')
+    raw_id_fields = ('user_link',)
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
     list_display = ('patient_id', 'patient_companyid', 'patient_willaya', 'patient_phone')
     list_filter = ('patient_cancer', 'patient_willaya')
+    raw_id_fields = ('user_link',)
 
 @admin.register(Leader)
 class LeaderAdmin(admin.ModelAdmin):
     list_display = ('admin_id', 'admin_willaya', 'admin_status')
+    raw_id_fields = ('user_link',)
 
 # ==========================================
 # 3. OTHER TABLES
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class SharedappConfig(AppConfig):
     name = 'sharedapp'
+
+    def ready(self):
+        # Register the model signal handlers
+        from . import signals  # noqa: F401
+        # And the deployment checks
+        from . import deployment  # noqa: F401
@@ -0,0 +1,66 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from . import authentication, profiles
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    # DRF's encoder, so a payload reads the same as from the matching APIView
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+class AsyncAPIView(View):
+    """Base for the async read endpoints (the ``async/...`` URLs).
+
+    DRF views are synchronous: under ASGI each request holds a thread for as
+    long as it runs, waiting on the database included. These handlers are
+    coroutines that read through the async ORM (``aget``, ``async for``),
+    so a slow client or a slow query only parks a coroutine.
+
+    They answer like the APIViews they mirror: same JWT, same
+    ``{"error": ...}`` bodies, and ``request.user`` / ``request.auth`` /
+    ``request.query_params`` set as DRF would, so helpers shared with the
+    sync views work on either request. ``profile_role`` turns away other
+    roles; ``load_profile`` puts the caller's profile on ``request.profile``
+    before the handler runs (see sharedapp.profiles). ``query_token`` also
+    accepts the token as ``?access_token=``, for clients that cannot send
+    headers.
+    """
+    authentication_required = True
+    query_token = False
+    profile_role = None
+    load_profile = False
+    profile_missing = "This account has no role profile."
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.query_params = request.GET
+
+        # 1. Same JWT as the API
+        try:
+            credentials = await sync_to_async(authentication.authenticate_plain)(request, self.query_token)
+        except (AuthenticationFailed, InvalidToken) as e:
+            return json_response({"error": str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+        if credentials is None and self.authentication_required:
+            return json_response({"error": "Authentication credentials were not provided."},
+                                 status=status.HTTP_401_UNAUTHORIZED)
+        request.user, request.auth = credentials or (AnonymousUser(), None)
+
+        # 2. Role, read from the token
+        if self.profile_role is not None and getattr(request.user, 'user_role', None) != self.profile_role:
+            return json_response({"error": f"Only {self.profile_role} accounts can use this endpoint."},
+                                 status=status.HTTP_403_FORBIDDEN)
+
+        # 3. Profile, usually from the cache
+        if self.load_profile:
+            try:
+                request.profile = await sync_to_async(profiles.load)(request.user)
+            except ObjectDoesNotExist:
+                return json_response({"error": self.profile_missing}, status=status.HTTP_403_FORBIDDEN)
+
+        return await super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,112 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+
+from .models import User
+
+
+class RolePrincipal(TokenUser):
+    """The caller, as described by the signed claims of their access token.
+
+    Carries what nearly every view needs (``id``, ``user_role``,
+    ``user_role_id``) without a database hit. Views that need the whole
+    account read ``principal.user``, which loads it once.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[settings.SIMPLE_JWT.get('USER_ID_CLAIM', 'user_id')])
+
+    @cached_property
+    def user_role(self):
+        return self.token.get('user_role')
+
+    @cached_property
+    def user_role_id(self):
+        return self.token.get('user_role_id')
+
+    @cached_property
+    def user(self):
+        return User.objects.get(pk=self.id)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """Trust the token's claims instead of loading the User row on every request.
+
+    The only per-request lookup is one cache read against the revocation
+    denylist below.
+    """
+
+    def get_user(self, validated_token):
+        if is_revoked(validated_token):
+            raise AuthenticationFailed("Token has been revoked.", code='token_revoked')
+        return super().get_user(validated_token)
+
+
+def authenticate_plain(request, query_token=False):
+    """(principal, token) for a plain Django request, as DRF would authenticate it.
+
+    For views outside DRF (see sharedapp.asyncviews). Browsers' EventSource
+    cannot send headers, so the event stream passes ``query_token`` to
+    accept ``?access_token=`` as well; tokens in URLs end up in logs, so
+    nothing else does. Raises AuthenticationFailed (or InvalidToken), or
+    returns None without credentials.
+    """
+    auth = StatelessJWTAuthentication()
+    header = auth.get_header(request)
+    if header:
+        raw = auth.get_raw_token(header)
+    else:
+        raw = request.GET.get('access_token', '').encode() if query_token else None
+    if not raw:
+        return None
+    token = auth.get_validated_token(raw)
+    return auth.get_user(token), token
+
+
+# ==========================================
+# REVOCATION DENYLIST
+# ==========================================
+# Held in the cache, so it must be a shared one (REDIS_URL) once several
+# processes serve requests. Entries only need to outlive the tokens they
+# revoke.
+
+def _token_key(jti):
+    return f'auth:revoked-token:{jti}'
+
+
+def _user_key(user_id):
+    return f'auth:revoked-before:{user_id}'
+
+
+def _lifetime():
+    return int(max(
+        settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'], settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME']
+    ).total_seconds())
+
+
+def revoke_token(token):
+    """Reject this one token from now on (logout)."""
+    remaining = int(token['exp'] - time.time())
+    if remaining > 0:
+        cache.set(_token_key(token['jti']), True, timeout=remaining)
+
+
+def revoke_user(user_id):
+    """Reject every token issued to ``user_id`` so far (password change, deactivation...)."""
+    cache.set(_user_key(user_id), int(time.time()), timeout=_lifetime())
+
+
+def is_revoked(token):
+    user_id = token.get(settings.SIMPLE_JWT.get('USER_ID_CLAIM', 'user_id'))
+    keys = [_token_key(token.get('jti')), _user_key(user_id)]
+    found = cache.get_many(keys)
+    if found.get(keys[0]):
+        return True
+    revoked_before = found.get(keys[1])
+    return revoked_before is not None and token.get('iat', 0) < revoked_before
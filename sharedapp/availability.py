@@ -0,0 +1,213 @@
+import datetime
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AgendaDay, Appointment
+
+# Longest appointment we expect; bookings that started this long before a
+# day can still run into it
+MAX_DURATION = datetime.timedelta(days=1)
+
+
+class SlotTaken(Exception):
+    pass
+
+
+def duration_of(service_duration):
+    """Service.service_duration is a TimeField; read it as a length of time."""
+    return datetime.timedelta(
+        hours=service_duration.hour, minutes=service_duration.minute, seconds=service_duration.second
+    )
+
+
+class BookedIntervals:
+    """Sorted, non-overlapping [start, end) intervals of one doctor's appointments.
+
+    Lookups bisect on the start times, so checking a new booking against
+    ``n`` existing ones costs O(log n).
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self.starts = [start for start, _ in intervals]
+        self.ends = [end for _, end in intervals]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def conflicts(self, start, end):
+        """True when [start, end) overlaps a booked interval."""
+        i = bisect_right(self.starts, start)
+        # The last booking starting at or before ``start`` must be over by then...
+        if i and self.ends[i - 1] > start:
+            return True
+        # ...and the next one must not start before ``end``
+        return i < len(self.starts) and self.starts[i] < end
+
+    def free_slots(self, opens, closes, duration, step):
+        """Start times of every free ``duration``-long slot between ``opens`` and ``closes``."""
+        slots = []
+        start = opens
+        i = bisect_right(self.ends, opens)
+        while start + duration <= closes:
+            end = start + duration
+            # Skip bookings that are already over
+            while i < len(self.starts) and self.ends[i] <= start:
+                i += 1
+            if i < len(self.starts) and self.starts[i] < end:
+                # Blocked: jump to the first step boundary after that booking
+                blocked_until = self.ends[i]
+                start += step * -(-(blocked_until - start) // step)
+                continue
+            slots.append(start)
+            start += step
+        return slots
+
+
+# ==========================================
+# PER DOCTOR-DAY INDEX, CACHED
+# ==========================================
+
+def _cache_key(doctor_id, day):
+    return f'availability:{doctor_id}:{day.isoformat()}'
+
+
+def day_bounds(day):
+    """[start, end) of a calendar day in the project's time zone."""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+    return start, end
+
+
+def local_range(first_day, last_day):
+    """Half-open [start, end) covering first_day to last_day inclusive, in the project's time zone.
+
+    Filtering ``apointment_date`` on this range (rather than ``__date``)
+    leaves the column bare, so the date indexes can serve the query.
+    """
+    return day_bounds(first_day)[0], day_bounds(last_day)[1]
+
+
+def _load(doctor_id, start, end, exclude=None):
+    """Intervals of the doctor's appointments that overlap [start, end), from the database."""
+    rows = Appointment.objects.filter(
+        apointment_doc_id=doctor_id,
+        apointment_date__gte=start - MAX_DURATION,
+        apointment_date__lt=end,
+    )
+    if exclude is not None:
+        rows = rows.exclude(apointment_id=exclude)
+    intervals = []
+    for booked, length in rows.values_list('apointment_date', 'apointment_service__service_duration'):
+        booked_end = booked + duration_of(length)
+        if booked_end > start:
+            intervals.append((booked, booked_end))
+    return intervals
+
+
+def booked(doctor_id, days):
+    """{day: BookedIntervals} for one doctor, cached per day until an appointment changes.
+
+    Days missing from the cache are loaded together in a single query.
+    """
+    keys = {_cache_key(doctor_id, day): day for day in days}
+    found = cache.get_many(keys)
+    missing = [day for key, day in keys.items() if key not in found]
+    if missing:
+        start, end = day_bounds(min(missing))[0], day_bounds(max(missing))[1]
+        intervals = _load(doctor_id, start, end)
+        loaded = {}
+        for day in missing:
+            day_start, day_end = day_bounds(day)
+            loaded[_cache_key(doctor_id, day)] = [
+                (booked_start, booked_end) for booked_start, booked_end in intervals
+                if booked_start < day_end and booked_end > day_start
+            ]
+        cache.set_many(loaded, timeout=settings.AVAILABILITY_CACHE_TIMEOUT)
+        found.update(loaded)
+    return {day: BookedIntervals(found[key]) for key, day in keys.items()}
+
+
+def invalidate(doctor_id, moment):
+    """Forget the cached day ``moment`` falls on, once the current transaction commits."""
+    if doctor_id is None or moment is None:
+        return
+    day = timezone.localdate(moment)
+    transaction.on_commit(lambda: cache.delete(_cache_key(doctor_id, day)))
+
+
+# ==========================================
+# QUERIES USED BY THE VIEWS
+# ==========================================
+
+def opening_hours(day):
+    opens = timezone.make_aware(datetime.datetime.combine(day, settings.APPOINTMENT_DAY_START))
+    closes = timezone.make_aware(datetime.datetime.combine(day, settings.APPOINTMENT_DAY_END))
+    return opens, closes
+
+
+def free_slots(doctor_id, service_duration, first_day, last_day):
+    """{day: [start, ...]} of free slots for a service, first_day to last_day inclusive."""
+    duration = duration_of(service_duration)
+    step = datetime.timedelta(minutes=settings.APPOINTMENT_SLOT_STEP)
+    now = timezone.now()
+    days = [first_day + datetime.timedelta(days=n) for n in range((last_day - first_day).days + 1)]
+    # Days already over need no index
+    open_days = [day for day in days if opening_hours(day)[1] > now]
+    index = booked(doctor_id, open_days)
+
+    slots = {}
+    for day in days:
+        if day not in index:
+            slots[day] = []
+            continue
+        opens, closes = opening_hours(day)
+        if opens < now:
+            # Only what is still ahead today, on the step grid
+            opens += step * -(-(now - opens) // step)
+        slots[day] = index[day].free_slots(opens, closes, duration, step)
+    return slots
+
+
+def check_cached(doctor_id, start, service_duration):
+    """Raise SlotTaken when the cached day index already shows a clash.
+
+    A bisect over the doctor's day, without touching the database; call it
+    before writing anything to turn most conflicting bookings away early.
+    """
+    end = start + duration_of(service_duration)
+    day = timezone.localdate(start)
+    if booked(doctor_id, [day])[day].conflicts(start, end):
+        raise SlotTaken("The doctor already has an appointment at this time.")
+
+
+def _lock_days(doctor_id, start, end):
+    """Lock the doctor's AgendaDay rows for every day [start, end) touches, creating them if needed."""
+    first, last = timezone.localdate(start), timezone.localdate(end - datetime.timedelta(microseconds=1))
+    days = [first + datetime.timedelta(days=n) for n in range((last - first).days + 1)]
+    for day in days:
+        # A concurrent first booking of the day waits on the unique index, then finds the row
+        AgendaDay.objects.get_or_create(day_doctor_id=doctor_id, day_date=day)
+    # In date order, so two bookings spanning midnight never wait on each other crosswise
+    list(AgendaDay.objects.select_for_update().filter(day_doctor_id=doctor_id, day_date__in=days)
+         .order_by('day_date').values_list('pk', flat=True))
+
+
+def ensure_free(doctor_id, start, service_duration, exclude=None):
+    """Raise SlotTaken when the database holds a booking overlapping this one.
+
+    The cache may be a moment behind, so this is the check that counts.
+    It locks the doctor's days the booking covers first (see AgendaDay), so
+    concurrent bookings of the same doctor and day get here one after the
+    other and see each other's rows; the doctor row, and with it the quota,
+    is left alone. Call it inside the booking transaction; ``exclude`` is
+    the appointment being checked.
+    """
+    end = start + duration_of(service_duration)
+    _lock_days(doctor_id, start, end)
+    if BookedIntervals(_load(doctor_id, start, end, exclude=exclude)).conflicts(start, end):
+        raise SlotTaken("The doctor already has an appointment at this time.")
@@ -0,0 +1,111 @@
+from collections import Counter
+
+from django.db import transaction
+
+from . import availability, counters, events, quotas, signals, versions
+from .models import Appointment, MessageDoc, MessagePat
+
+MAX_IDS = 1000
+
+# message_type in the URL -> (model, path from the message to its willaya)
+MESSAGE_TABLES = {
+    'doctor': (MessageDoc, 'message_sender__doctor_willaya'),
+    'patient': (MessagePat, 'message_sender__patient_willaya'),
+}
+
+
+class BulkError(ValueError):
+    """Raised for a malformed id list; views answer it with a 400."""
+
+
+def parse_ids(data):
+    """The distinct ids of a ``{"ids": [...]}`` body, in the order given."""
+    ids = data.get('ids') if hasattr(data, 'get') else None
+    if not isinstance(ids, list) or not ids:
+        raise BulkError("Send a non-empty list of ids as 'ids'.")
+    if len(ids) > MAX_IDS:
+        raise BulkError(f"Send at most {MAX_IDS} ids at a time.")
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise BulkError("ids must be integers.")
+    return list(dict.fromkeys(ids))
+
+
+def outcomes(ids, done, skipped=(), skipped_as=None):
+    """One ``{"id", "outcome"}`` per requested id; ids in neither set were not found (or not yours)."""
+    results = []
+    for i in ids:
+        outcome = 'done' if i in done else skipped_as if i in skipped else 'not_found'
+        results.append({"id": i, "outcome": outcome})
+    return results
+
+
+# ==========================================
+# MESSAGES
+# ==========================================
+
+def mark_messages_done(message_type, ids, willaya):
+    """Mark a leader's pending messages as done with a single UPDATE."""
+    model, willaya_path = MESSAGE_TABLES[message_type]
+    with transaction.atomic():
+        # Locked, so two leaders clearing the same inbox report each message once
+        rows = dict(
+            model.objects.select_for_update(of=('self',))
+            .filter(pk__in=ids, **{willaya_path: willaya})
+            .values_list('message_id', 'message_status')
+        )
+        pending = [i for i, handled in rows.items() if not handled]
+        if pending:
+            model.objects.filter(pk__in=pending).update(message_status=True)
+            # update() sends no signals: expire the inbox ETags and tell the listeners ourselves
+            versions.touch(('inbox', willaya))
+            events.publish(events.willaya_channel(willaya), 'messages', 'updated', pending, message_type=message_type)
+    return outcomes(ids, set(pending), set(rows), 'already_done')
+
+
+# ==========================================
+# APPOINTMENTS
+# ==========================================
+# The per-row receivers (dashboard counters, availability cache, version
+# stamps, events) are muted and replaced by one aggregated call each.
+
+def _locked_appointments(doctor_id, ids):
+    return {
+        row[0]: row[1:]
+        for row in Appointment.objects.select_for_update(of=('self',))
+        .filter(pk__in=ids, apointment_doc_id=doctor_id)
+        .values_list('apointment_id', 'apointment_status', 'apointment_pat_id',
+                     'apointment_date', 'apointment_doc__doctor_willaya')
+    }
+
+
+def complete_appointments(doctor_id, ids):
+    with transaction.atomic():
+        rows = _locked_appointments(doctor_id, ids)
+        pending = [i for i, (completed, *_) in rows.items() if not completed]
+        if pending:
+            Appointment.objects.filter(pk__in=pending).update(apointment_status=True)
+            versions.touch(*{('appointments', rows[i][1]) for i in pending})
+            events.publish(events.doctor_channel(doctor_id), 'appointments', 'updated', pending)
+    return outcomes(ids, set(pending), set(rows), 'already_done')
+
+
+def cancel_appointments(doctor_id, ids):
+    """Delete appointments, their prescriptions and refund the quotas, as set-based statements."""
+    with transaction.atomic():
+        rows = _locked_appointments(doctor_id, ids)
+        if rows:
+            found = list(rows)
+            # The ORM delete cascades to the prescriptions (and whatever points at an
+            # appointment later on); their stored files are left to manage.py sweep_filestore
+            with signals.muted(Appointment):
+                Appointment.objects.filter(pk__in=found).delete()
+
+            quotas.refund_many([(doctor_id, patient_id) for _, patient_id, _, _ in rows.values()])
+            buckets = Counter((willaya, counters.day_of(date)) for _, _, date, willaya in rows.values())
+            for (willaya, day), n in buckets.items():
+                counters.bump('appointments', willaya, day, delta=-n)
+            for moment in {date for _, _, date, _ in rows.values()}:
+                availability.invalidate(doctor_id, moment)
+            versions.touch(*{('appointments', patient_id) for _, patient_id, _, _ in rows.values()})
+            events.publish(events.doctor_channel(doctor_id), 'appointments', 'deleted', found)
+    return outcomes(ids, set(rows))
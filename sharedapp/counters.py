@@ -0,0 +1,120 @@
+import random
+from collections import defaultdict
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DashboardCounter
+
+
+def day_of(value):
+    """Calendar day a datetime falls on, in the project's time zone."""
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        return timezone.localdate(value)
+    return value.date()
+
+
+def _add(metric, willaya, day, delta):
+    # Any shard will do: the count is their sum
+    shard = random.randrange(settings.DASHBOARD_COUNTER_SHARDS)
+    counters = DashboardCounter.objects.filter(
+        counter_metric=metric, counter_willaya=willaya, counter_day=day, counter_shard=shard
+    )
+    if counters.update(counter_value=F('counter_value') + delta):
+        return
+
+    # First row for this bucket; another request may be creating it right now
+    try:
+        with transaction.atomic():
+            DashboardCounter.objects.create(
+                counter_metric=metric, counter_willaya=willaya, counter_day=day, counter_shard=shard,
+                counter_value=delta,
+            )
+    except IntegrityError:
+        counters.update(counter_value=F('counter_value') + delta)
+
+
+def bump(metric, willaya, day=None, delta=1):
+    """Add ``delta`` to the willaya total and, when ``day`` is given, to that day's bucket.
+
+    Runs inside the caller's transaction, so a rolled back write also rolls
+    back its counter update. Only one shard of each bucket stays locked until
+    the commit, so writers of the same willaya seldom wait on each other.
+    """
+    if willaya is None or not delta:
+        return
+    _add(metric, willaya, None, delta)
+    if day is not None:
+        _add(metric, willaya, day, delta)
+
+
+def read_dashboard(day):
+    """National totals and the totals for ``day``, in a single query (shards summed)."""
+    rows = (
+        DashboardCounter.objects.filter(Q(counter_day__isnull=True) | Q(counter_day=day))
+        .values('counter_metric', 'counter_day')
+        .annotate(value=Sum('counter_value'))
+        .order_by()
+    )
+    totals = defaultdict(int)
+    today = defaultdict(int)
+    for row in rows:
+        bucket = totals if row['counter_day'] is None else today
+        bucket[row['counter_metric']] += row['value']
+    return totals, today
+
+
+def rebuild(get_model=global_apps.get_model):
+    """Recompute every counter from the source tables.
+
+    Used by the ``rebuild_dashboard_counters`` command to repair drift left by
+    raw SQL or queryset ``update()`` calls, which bypass the signal handlers.
+    (Migration 0004 keeps its own frozen copy.) Appointments
+    and messages are counted under the willaya their doctor / sender had when
+    they were written; a rebuild files them under the current one.
+    """
+    Counter = get_model('sharedapp', 'DashboardCounter')
+    Patient = get_model('sharedapp', 'Patient')
+    Doctor = get_model('sharedapp', 'Doctor')
+    Appointment = get_model('sharedapp', 'Appointment')
+    MessageDoc = get_model('sharedapp', 'MessageDoc')
+    MessagePat = get_model('sharedapp', 'MessagePat')
+
+    values = defaultdict(int)
+
+    # 1. Tables that only have a total per willaya
+    for metric, queryset in (
+        ('patients', Patient.objects.values(willaya=F('patient_willaya'))),
+        ('doctors', Doctor.objects.values(willaya=F('doctor_willaya'))),
+    ):
+        for row in queryset.annotate(n=Count('pk')).order_by():
+            values[(metric, row['willaya'], None)] += row['n']
+
+    # 2. Tables that are also bucketed per day
+    for metric, queryset in (
+        ('appointments', Appointment.objects.values(
+            willaya=F('apointment_doc__doctor_willaya'), day=TruncDate('apointment_date'))),
+        ('doctor_messages', MessageDoc.objects.values(
+            willaya=F('message_sender__doctor_willaya'), day=TruncDate('message_date'))),
+        ('patient_messages', MessagePat.objects.values(
+            willaya=F('message_sender__patient_willaya'), day=TruncDate('message_date'))),
+    ):
+        for row in queryset.annotate(n=Count('pk')).order_by():
+            values[(metric, row['willaya'], None)] += row['n']
+            values[(metric, row['willaya'], row['day'])] += row['n']
+
+    with transaction.atomic():
+        Counter.objects.all().delete()
+        Counter.objects.bulk_create(
+            [
+                Counter(counter_metric=metric, counter_willaya=willaya, counter_day=day, counter_value=n)
+                for (metric, willaya, day), n in values.items()
+            ],
+            batch_size=1000,
+        )
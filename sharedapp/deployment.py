@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core import checks
+
+# Backends whose state lives in the memory of one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+PROCESS_LOCAL_BROKERS = ('sharedapp.events.LocalBroker',)
+
+
+def process_local_backends():
+    """Names of the settings pointing at a backend that other worker processes cannot see.
+
+    The cache holds the token denylist, version stamps, profiles and the
+    directory; the broker carries the event stream. With either of them
+    local, every worker process answers from its own copy.
+    """
+    local = []
+    if settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+        local.append('CACHES')
+    if settings.EVENTS_BROKER in PROCESS_LOCAL_BROKERS:
+        local.append('EVENTS_BROKER')
+    return local
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_backends(app_configs, **kwargs):
+    if settings.WEB_CONCURRENCY <= 1:
+        return []
+    local = process_local_backends()
+    messages = []
+    if 'CACHES' in local:
+        messages.append(checks.Error(
+            f"WEB_CONCURRENCY is {settings.WEB_CONCURRENCY} but CACHES only reaches one process: "
+            "a logout or a write would only be seen by the worker that served it.",
+            hint="Set REDIS_URL (or CACHE_DIR), or run a single worker.",
+            id='sharedapp.E001',
+        ))
+    if 'EVENTS_BROKER' in local:
+        # Only the ASGI deployment serves the event stream; WSGI workers answer it with a 501
+        messages.append(checks.Warning(
+            f"WEB_CONCURRENCY is {settings.WEB_CONCURRENCY} but EVENTS_BROKER only reaches one process: "
+            "under ASGI, event stream listeners would miss the events of other workers.",
+            hint="Set REDIS_URL (or EVENTS_BROKER=sharedapp.events.RedisBroker) before serving the stream.",
+            id='sharedapp.W001',
+        ))
+    return messages
@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'directory:generation'
+
+
+def generation():
+    """Current directory generation; every cached entry is keyed by it."""
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # Lost (restart, eviction): start from the clock so no old generation comes back
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def bump():
+    """Make every cached directory entry unreachable, once the current transaction commits.
+
+    Entries are never deleted one by one: after a bump nobody asks for the
+    old keys any more and the cache backend lets them expire.
+    """
+    def _bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+    transaction.on_commit(_bump)
+
+
+def cached(name, build):
+    """``build()``'s result, cached under ``name`` for the current generation."""
+    key = f'directory:{generation()}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout=settings.DIRECTORY_CACHE_TIMEOUT)
+    return value
+
+
+async def acached(name, build):
+    """``cached`` for async views: ``build`` is a coroutine function."""
+    value = await cache.aget(GENERATION_KEY)
+    if value is None:
+        await cache.aadd(GENERATION_KEY, time.time_ns(), timeout=None)
+        value = await cache.aget(GENERATION_KEY)
+    key = f'directory:{value}:{name}'
+    result = await cache.aget(key)
+    if result is None:
+        result = await build()
+        await cache.aset(key, result, timeout=settings.DIRECTORY_CACHE_TIMEOUT)
+    return result
@@ -0,0 +1,111 @@
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+from .filestore import CHUNK_SIZE, get_store, sniff
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _ByteRange:
+    """Read-only view of ``length`` bytes of a file, starting at ``start``."""
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        fileobj.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single ``bytes=`` range, None to send the whole file.
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Malformed or multi-range requests get the full body
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def serve_stored_file(request, digest, filename):
+    """Send a stored file with ETag, Range and X-Sendfile / X-Accel-Redirect support.
+
+    ``filename`` has no extension; it is added from the sniffed content type.
+    """
+    store = get_store()
+    etag = f'"{digest}"'
+
+    # 1. Content never changes for a digest, so a matching ETag is all we need
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    content_type, extension = sniff(digest, store)
+    filename = f'{filename}.{extension}'
+
+    # 2. Let the front web server do the sending when it is set up for it
+    mode = settings.FILESTORE_SENDFILE_MODE
+    if mode in ('x-sendfile', 'x-accel-redirect'):
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-sendfile':
+            response['X-Sendfile'] = str(store.path(digest))
+        else:
+            relative = store.path(digest).relative_to(store.root).as_posix()
+            response['X-Accel-Redirect'] = settings.FILESTORE_ACCEL_PREFIX.rstrip('/') + '/' + relative
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    else:
+        # 3. Otherwise stream it ourselves, in chunks, honouring a single Range
+        size = store.size(digest)
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if byte_range is None:
+            response = FileResponse(store.open(digest), content_type=content_type, filename=filename)
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            body = _ByteRange(store.open(digest), start, end - start + 1)
+            response = FileResponse(body, status=206, content_type=content_type, filename=filename)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.block_size = CHUNK_SIZE
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
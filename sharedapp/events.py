@@ -0,0 +1,224 @@
+import asyncio
+import itertools
+import json
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# ==========================================
+# CHANNELS
+# ==========================================
+# Leaders follow the messages of their willaya, doctors the appointments of
+# their own agenda. Events are small: enough to update a list in place, or
+# to know which endpoint to refetch.
+
+def willaya_channel(willaya):
+    return f'willaya:{willaya}' if willaya is not None else None
+
+
+def doctor_channel(doctor_id):
+    return f'doctor:{doctor_id}' if doctor_id is not None else None
+
+
+def publish(channel, kind, action, ids, **data):
+    """Send ``{"type", "action", "ids", ...data}`` to ``channel`` once the current transaction commits."""
+    if channel is None or not ids:
+        return
+    event = {"type": kind, "action": action, "ids": list(ids), **data}
+    transaction.on_commit(lambda: broker().publish(channel, event))
+
+
+@lru_cache(maxsize=None)
+def broker():
+    """The process-wide broker named by EVENTS_BROKER."""
+    return import_string(settings.EVENTS_BROKER)()
+
+
+# ==========================================
+# BROKERS
+# ==========================================
+
+class Broker:
+    """What the event stream needs from a pub/sub backend.
+
+    ``publish`` is called from ordinary (sync) code, in any thread.
+    ``subscribe`` returns a ``Subscription``, used as an async context
+    manager. A broker shared between processes (RedisBroker, or Postgres
+    LISTEN/NOTIFY...) plugs in through EVENTS_BROKER.
+    """
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channels):
+        raise NotImplementedError
+
+
+class Subscription:
+    """Events for one listener, buffered up to EVENTS_QUEUE_SIZE.
+
+    A listener that falls that far behind is not waited for: its buffer is
+    dropped and it receives a single ``{"type": "resync"}`` telling it to
+    refetch instead. Brokers override ``open`` and ``close``.
+    """
+
+    def __init__(self, channels):
+        self.channels = list(channels)
+        self.loop = None
+        self.queue = None
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _put(self, event):
+        # Runs on the subscriber's event loop
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {"type": "resync"}
+        self.queue.put_nowait(event)
+
+    def deliver(self, event):
+        """Thread-safe: hand ``event`` to the subscriber's loop."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop is closed: the listener is gone and unsubscribes on its way out
+            pass
+
+    async def get(self, timeout=None):
+        """Next event, or None when ``timeout`` seconds pass without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalSubscription(Subscription):
+    def __init__(self, broker, channels):
+        super().__init__(channels)
+        self.broker = broker
+
+    def open(self):
+        with self.broker._lock:
+            for channel in self.channels:
+                self.broker._subscribers.setdefault(channel, set()).add(self)
+
+    def close(self):
+        with self.broker._lock:
+            for channel in self.channels:
+                listeners = self.broker._subscribers.get(channel)
+                if listeners is not None:
+                    listeners.discard(self)
+                    if not listeners:
+                        del self.broker._subscribers[channel]
+
+
+class LocalBroker(Broker):
+    """In-process pub/sub: only reaches listeners served by the same process.
+
+    Fine for a single ASGI worker and for tests; deployments with several
+    worker processes need a shared broker such as RedisBroker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> set of LocalSubscription
+        self._ids = itertools.count(1)
+
+    def publish(self, channel, event):
+        event = {**event, "id": next(self._ids)}
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, channels):
+        return LocalSubscription(self, channels)
+
+
+class RedisSubscription(Subscription):
+    def __init__(self, broker, channels):
+        super().__init__(channels)
+        self.broker = broker
+        self.client = None
+        self.pubsub = None
+        self.listener = None
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        # One connection per listener: a pub/sub connection cannot be shared,
+        # and an asyncio client belongs to the loop it was made on
+        self.client = self.broker.async_client()
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(*(self.broker.key(channel) for channel in self.channels))
+        # Wait for the confirmations, so the subscription is live when the stream says "ready"
+        confirmed = 0
+        while confirmed < len(self.channels):
+            message = await self.pubsub.get_message(timeout=settings.EVENTS_KEEPALIVE)
+            if message is None:
+                break
+            confirmed += message['type'] == 'subscribe'
+        self.listener = asyncio.create_task(self._listen())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.listener.cancel()
+        try:
+            await self.listener
+        except asyncio.CancelledError:
+            pass
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def _listen(self):
+        async for message in self.pubsub.listen():
+            if message['type'] == 'message':
+                self._put(json.loads(message['data']))
+
+
+class RedisBroker(Broker):
+    """Redis pub/sub: reaches the listeners of every worker process.
+
+    Publishing goes through a regular client, from any thread; each listener
+    holds its own asyncio connection. Events are numbered by one shared
+    counter, so ids stay increasing whichever worker sent them.
+    """
+    PREFIX = 'wellnest:events:'
+
+    def __init__(self):
+        import redis
+
+        self.url = settings.EVENTS_REDIS_URL
+        self.client = redis.Redis.from_url(self.url)
+
+    def key(self, channel):
+        return self.PREFIX + channel
+
+    def async_client(self):
+        import redis.asyncio
+
+        return redis.asyncio.Redis.from_url(self.url)
+
+    def publish(self, channel, event):
+        event = {**event, "id": self.client.incr(self.PREFIX + 'ids')}
+        self.client.publish(self.key(channel), json.dumps(event, cls=DjangoJSONEncoder))
+
+    def subscribe(self, channels):
+        return RedisSubscription(self, channels)
@@ -0,0 +1,130 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import availability
+from .models import Appointment, Doctor, MessageDoc, MessagePat, Patient
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+class ExportError(Exception):
+    pass
+
+
+class Export:
+    """One exportable table: flat ``header -> lookup`` columns, plus the lookups its filters use.
+
+    Blob columns are never listed, and related names come from joins in the
+    same query, so one pass over a server-side cursor produces the file.
+    """
+
+    def __init__(self, model, columns, willaya, date=None):
+        self.model = model
+        self.headers = list(columns)
+        self.lookups = list(columns.values())
+        self.willaya = willaya
+        self.date = date
+
+    def queryset(self, willaya=None, first_day=None, last_day=None):
+        rows = self.model.objects.all()
+        if willaya:
+            rows = rows.filter(**{self.willaya: willaya})
+        if first_day or last_day:
+            if self.date is None:
+                raise ExportError("This table has no date to filter on.")
+            start, end = availability.local_range(first_day or last_day, last_day or first_day)
+            rows = rows.filter(**{f'{self.date}__gte': start, f'{self.date}__lt': end})
+        # Primary key order: stable, and served by the primary key index
+        return rows.order_by('pk').values_list(*self.lookups)
+
+
+EXPORTS = {
+    'appointments': Export(Appointment, {
+        'apointment_id': 'apointment_id', 'apointment_date': 'apointment_date',
+        'apointment_status': 'apointment_status', 'apointment_urgent': 'apointment_urgent',
+        'apointment_comment': 'apointment_comment',
+        'service_id': 'apointment_service_id', 'service_name': 'apointment_service__service_name',
+        'service_price': 'apointment_service__service_price',
+        'doctor_id': 'apointment_doc_id', 'doctor_username': 'apointment_doc__user_link__username',
+        'doctor_willaya': 'apointment_doc__doctor_willaya',
+        'patient_id': 'apointment_pat_id', 'patient_username': 'apointment_pat__user_link__username',
+        'patient_companyid': 'apointment_pat__patient_companyid',
+    }, willaya='apointment_doc__doctor_willaya', date='apointment_date'),
+    'patients': Export(Patient, {
+        'patient_id': 'patient_id', 'patient_companyid': 'patient_companyid',
+        'patient_datebirth': 'patient_datebirth', 'patient_cancer': 'patient_cancer',
+        'patient_leftcotas': 'patient_leftcotas', 'patient_address': 'patient_address',
+        'patient_phone': 'patient_phone', 'patient_willaya': 'patient_willaya',
+        'username': 'user_link__username', 'email': 'user_link__email',
+        'first_name': 'user_link__first_name', 'last_name': 'user_link__last_name',
+    }, willaya='patient_willaya'),
+    'doctors': Export(Doctor, {
+        'doctor_id': 'doctor_id', 'doctor_phone': 'doctor_phone', 'doctor_address': 'doctor_address',
+        'doctor_willaya': 'doctor_willaya', 'doctor_cotas': 'doctor_cotas', 'doctor_leftcotas': 'doctor_leftcotas',
+        'speciality_id': 'doctor_speciality_id', 'speciality_name': 'doctor_speciality__speciality_name',
+        'username': 'user_link__username', 'email': 'user_link__email',
+        'first_name': 'user_link__first_name', 'last_name': 'user_link__last_name',
+    }, willaya='doctor_willaya'),
+    'doctor_messages': Export(MessageDoc, {
+        'message_id': 'message_id', 'message_date': 'message_date', 'message_title': 'message_title',
+        'message_text': 'message_text', 'message_urgent': 'message_urgent', 'message_status': 'message_status',
+        'doctor_id': 'message_sender_id', 'doctor_username': 'message_sender__user_link__username',
+        'doctor_willaya': 'message_sender__doctor_willaya',
+    }, willaya='message_sender__doctor_willaya', date='message_date'),
+    'patient_messages': Export(MessagePat, {
+        'message_id': 'message_id', 'message_date': 'message_date', 'message_title': 'message_title',
+        'message_text': 'message_text', 'message_urgent': 'message_urgent', 'message_status': 'message_status',
+        'patient_id': 'message_sender_id', 'patient_username': 'message_sender__user_link__username',
+        'patient_willaya': 'message_sender__patient_willaya',
+    }, willaya='message_sender__patient_willaya', date='message_date'),
+}
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _lines(export, rows, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(export.headers)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(export.headers, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream(table, fmt, willaya=None, first_day=None, last_day=None, chunk_size=None):
+    """The export as an iterator of text chunks.
+
+    Rows come from a server-side cursor (``iterator()``) ``chunk_size`` at
+    a time and are written out as they arrive, so memory does not grow with
+    the table. Arguments are checked before the first chunk is produced.
+    """
+    export = EXPORTS.get(table)
+    if export is None:
+        raise ExportError(f"table must be one of {', '.join(EXPORTS)}.")
+    if fmt not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}.")
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = export.queryset(willaya, first_day, last_day).iterator(chunk_size=chunk_size)
+    return _chunks(_lines(export, rows, fmt), chunk_size)
+
+
+def _chunks(lines, size):
+    # Fewer, larger writes to the socket than one per row
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import Doctor, MessagePat, Ordonance, Patient
+
+CHUNK_SIZE = 64 * 1024
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Leading bytes -> (content type, file extension) for what we actually store
+MAGIC_NUMBERS = [
+    (b'%PDF', ('application/pdf', 'pdf')),
+    (b'\x89PNG\r\n\x1a\n', ('image/png', 'png')),
+    (b'\xff\xd8\xff', ('image/jpeg', 'jpg')),
+    (b'GIF87a', ('image/gif', 'gif')),
+    (b'GIF89a', ('image/gif', 'gif')),
+]
+
+
+class ContentAddressedStore:
+    """Files on local disk, named by the SHA-256 of their content.
+
+    Saving the same bytes twice stores them once, and a stored file never
+    changes, so its digest doubles as a strong ETag. Files are fanned out
+    as ``<root>/ab/cd/abcd...`` to keep directories small.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, digest):
+        if not DIGEST_RE.match(digest or ''):
+            raise ValueError(f"Not a SHA-256 digest: {digest!r}")
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest):
+        return self.path(digest).is_file()
+
+    def size(self, digest):
+        return self.path(digest).stat().st_size
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def temporary_file(self):
+        """A named temp file on the same filesystem, so adding it is a rename."""
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+
+    def save(self, content):
+        """Store ``content`` (bytes or a binary file object) and return its digest."""
+        sha = hashlib.sha256()
+        with self.temporary_file() as tmp:
+            if isinstance(content, (bytes, bytearray, memoryview)):
+                sha.update(content)
+                tmp.write(content)
+            else:
+                for chunk in iter(lambda: content.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    tmp.write(chunk)
+        digest = sha.hexdigest()
+        self.add(tmp.name, digest)
+        return digest
+
+    def add(self, source_path, digest):
+        """Move an already-written file into the store under ``digest``."""
+        target = self.path(digest)
+        if target.exists():
+            # Same content is already stored: deduplicate, and mark the file
+            # as fresh so a sweep running meanwhile leaves it alone
+            os.remove(source_path)
+            os.utime(target)
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, target)
+
+    def stored(self):
+        """(digest, last modified) of every file in the store."""
+        for path in self.root.glob('[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*'):
+            if DIGEST_RE.match(path.name):
+                yield path.name, path.stat().st_mtime
+
+    def remove(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+@lru_cache(maxsize=None)
+def _store(root):
+    return ContentAddressedStore(root)
+
+
+def get_store():
+    return _store(str(settings.FILESTORE_ROOT))
+
+
+def sniff(digest, store=None):
+    """(content type, extension) of a stored file, from its first bytes."""
+    with (store or get_store()).open(digest) as stored:
+        head = stored.read(16)
+    for magic, kind in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    return 'application/octet-stream', 'bin'
+
+
+# ==========================================
+# MODEL FIELDS BACKED BY THE STORE
+# ==========================================
+# Each stored payload keeps its legacy inline BinaryField (``<field>``) next
+# to the reference column (``<field>_ref``). The inline column is emptied
+# once the bytes are in the store and only read for rows still written the
+# old way.
+
+def empty_blob(instance, blob_field):
+    return None if instance._meta.get_field(blob_field).null else b''
+
+
+def attach(instance, blob_field, content):
+    """Store ``content`` and point ``instance.<blob_field>_ref`` at it."""
+    return link(instance, blob_field, get_store().save(content))
+
+
+def link(instance, blob_field, digest):
+    """Point ``instance.<blob_field>_ref`` at a file already in the store."""
+    ref_field = f'{blob_field}_ref'
+    setattr(instance, ref_field, digest)
+    setattr(instance, blob_field, empty_blob(instance, blob_field))
+    instance.save(update_fields=[ref_field, blob_field])
+    return digest
+
+
+def stored_digest(instance, blob_field):
+    """Digest of the payload behind ``blob_field``, moving legacy inline bytes on the way."""
+    digest = getattr(instance, f'{blob_field}_ref')
+    if digest:
+        return digest
+
+    # Row written before the store existed: move its bytes out now
+    inline = getattr(instance, blob_field)
+    if inline:
+        return attach(instance, blob_field, bytes(inline))
+    return None
+
+
+# ==========================================
+# SWEEPING
+# ==========================================
+# A file may back several rows (same bytes are stored once) and rows go in
+# bulk deletes that skip the per-row receivers, so files are not released one by one:
+# sweep() removes the files no row points at any more. Recent files are left
+# alone, since a file is stored before the row pointing at it is saved.
+
+STORED_FIELDS = {
+    Doctor: 'doctor_pic',
+    Patient: 'patient_pic',
+    Ordonance: 'ordonance_file',
+    MessagePat: 'message_pic',
+}
+
+
+def referenced_digests():
+    digests = set()
+    for model, blob_field in STORED_FIELDS.items():
+        ref_field = f'{blob_field}_ref'
+        refs = model._base_manager.exclude(**{ref_field: ''}).values_list(ref_field, flat=True).distinct()
+        digests.update(refs.iterator())
+    return digests
+
+
+def sweep(grace, store=None, dry_run=False):
+    """Remove files older than ``grace`` seconds that no row references; returns their digests."""
+    store = store or get_store()
+    cutoff = time.time() - grace
+    # Candidates first, references second: a file linked in between is then
+    # either in the references or was touched by add() after the cutoff
+    candidates = [digest for digest, modified in store.stored() if modified < cutoff]
+    referenced = referenced_digests()
+    removed = []
+    for digest in candidates:
+        if digest in referenced:
+            continue
+        try:
+            if store.path(digest).stat().st_mtime >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        if not dry_run:
+            store.remove(digest)
+        removed.append(digest)
+    return removed
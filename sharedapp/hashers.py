@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with the work factor set by PASSWORD_HASH_ITERATIONS (Django's default if unset).
+
+    Same algorithm name as Django's hasher, so existing hashes keep
+    verifying; a successful login rehashes any password stored with another
+    iteration count (see MyTokenObtainPairSerializer).
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+def default_patient_password(company_id):
+    # Example: "Pat@" + company_id (e.g., Pat@12345); the patient changes it after the first login
+    return f"Pat@{company_id}"
+
+
+def hash_many(passwords, executor=None):
+    """make_password() for every password, spread over ``executor``'s processes when given.
+
+    Hashing is CPU bound, so threads would not help; worker processes only
+    need the settings module, not the app registry.
+    """
+    if executor is None:
+        return [make_password(password) for password in passwords]
+    return list(executor.map(make_password, passwords, chunksize=16))
@@ -0,0 +1,117 @@
+import asyncio
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sharedapp.models import User
+from sharedapp.serializers import MyTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure a running server's throughput on some paths while slow clients hold connections open. "
+        "Run it once against the WSGI deployment (Procfile) and once against the ASGI one (Procfile.asgi), "
+        "e.g. on /doctor/getAgenda and /doctor/async/getAgenda."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Server base URL, e.g. http://127.0.0.1:8000")
+        parser.add_argument('paths', nargs='+', help="Paths to measure one after the other, query string included.")
+        parser.add_argument('--token', help="Access token sent as 'Authorization: Bearer ...'.")
+        parser.add_argument('--user', help="Username to issue an access token for (needs this server's database).")
+        parser.add_argument('--clients', type=int, default=10, help="Clients sending requests back to back.")
+        parser.add_argument('--slow-clients', type=int, default=50,
+                            help="Clients that send their request headers one line at a time.")
+        parser.add_argument('--slow-delay', type=float, default=1.0, help="Seconds between two lines of a slow client.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds spent on each path.")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Seconds before a request counts as failed.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError("url must look like http://host:port")
+        token = options['token']
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['user']}.")
+            token = str(MyTokenObtainPairSerializer.get_token(user).access_token)
+
+        self.stdout.write(
+            f"{options['clients']} clients, {options['slow_clients']} slow clients "
+            f"({options['slow_delay']}s per header line), {options['duration']}s per path"
+        )
+        self.stdout.write(f"{'path':<50} {'req/s':>8} {'ok':>6} {'failed':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        for path in options['paths']:
+            result = asyncio.run(_measure(url, path, token, options))
+            self.stdout.write(
+                f"{path:<50} {result['rate']:>8.1f} {result['ok']:>6} {result['failed']:>6} "
+                f"{result['p50']:>8.0f} {result['p95']:>8.0f}"
+            )
+
+
+def _request_lines(url, path, token):
+    lines = [f'GET {path} HTTP/1.1', f'Host: {url.netloc}', 'User-Agent: bench_slow_clients', 'Connection: close']
+    if token:
+        lines.append(f'Authorization: Bearer {token}')
+    return [f'{line}\r\n'.encode() for line in lines] + [b'\r\n']
+
+
+async def _fetch(url, lines, delay, timeout):
+    """Status code of one request on a fresh connection, ``delay`` seconds between its lines."""
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    context = ssl.create_default_context() if url.scheme == 'https' else None
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(url.hostname, port, ssl=context), timeout)
+    try:
+        if delay:
+            for line in lines:
+                writer.write(line)
+                await writer.drain()
+                await asyncio.sleep(delay)
+        else:
+            writer.write(b''.join(lines))
+            await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        # Connection: close, so the body ends with the connection
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def _measure(url, path, token, options):
+    lines = _request_lines(url, path, token)
+    deadline = time.monotonic() + options['duration']
+    latencies, failures = [], [0]
+
+    async def client(delay, record):
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                status = await _fetch(url, lines, delay, options['timeout'])
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                status = None
+            if record:
+                if status is not None and status < 400:
+                    latencies.append(time.monotonic() - started)
+                else:
+                    failures[0] += 1
+
+    # Only the regular clients are measured; the slow ones are the load
+    await asyncio.gather(
+        *(client(options['slow_delay'], False) for _ in range(options['slow_clients'])),
+        *(client(0, True) for _ in range(options['clients'])),
+    )
+    latencies.sort()
+    milliseconds = [latency * 1000 for latency in latencies] or [0]
+    return {
+        "ok": len(latencies),
+        "failed": failures[0],
+        "rate": len(latencies) / options['duration'],
+        "p50": statistics.median(milliseconds),
+        "p95": milliseconds[min(len(milliseconds) - 1, int(len(milliseconds) * 0.95))],
+    }
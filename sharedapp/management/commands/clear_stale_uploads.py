@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sharedapp import uploads
+from sharedapp.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads that were never finished, and their partial files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Age after which an unfinished upload is dropped.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = UploadSession.objects.filter(upload_completed=False, upload_created__lt=cutoff)
+        count = 0
+        for session in stale.iterator():
+            uploads.discard(session)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Removed {count} stale upload(s)."))
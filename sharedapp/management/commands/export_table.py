@@ -0,0 +1,35 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sharedapp import exports
+
+
+class Command(BaseCommand):
+    help = "Write a table as CSV or JSONL, in constant memory (same data as the leader export endpoint)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=list(exports.EXPORTS))
+        parser.add_argument('--format', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--willaya')
+        parser.add_argument('--from', dest='first_day', type=datetime.date.fromisoformat, help="YYYY-MM-DD, inclusive.")
+        parser.add_argument('--to', dest='last_day', type=datetime.date.fromisoformat, help="YYYY-MM-DD, inclusive.")
+        parser.add_argument('--chunk-size', type=int, help="Rows fetched per database round trip.")
+        parser.add_argument('--output', help="File to write; standard output by default.")
+
+    def handle(self, *args, **options):
+        try:
+            chunks = exports.stream(
+                options['table'], options['format'], options['willaya'],
+                options['first_day'], options['last_day'], options['chunk_size'],
+            )
+        except exports.ExportError as e:
+            raise CommandError(str(e))
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='') as out:
+            for chunk in chunks:
+                out.write(chunk)
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sharedapp import onboarding
+
+
+class Command(BaseCommand):
+    help = "Create patients and their accounts from a CSV or JSONL file (same columns as CreatePatient)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=onboarding.FORMATS, help="Default: taken from the file extension.")
+        parser.add_argument('--batch-size', type=int, help="Valid rows committed per transaction.")
+        parser.add_argument('--workers', type=int, help="Processes hashing the default passwords.")
+        parser.add_argument('--report', help="Write the per-row report here, as JSONL.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                rows = onboarding.read_rows(stream, options['format'] or onboarding.format_of(path))
+                report = onboarding.import_patients(
+                    rows, batch_size=options['batch_size'], workers=options['workers'])
+        except (OSError, UnicodeDecodeError, onboarding.OnboardingError) as e:
+            raise CommandError(str(e))
+
+        if options['report']:
+            with open(options['report'], 'w') as out:
+                for entry in report:
+                    out.write(json.dumps(entry) + '\n')
+        for entry in report:
+            if entry['status'] == 'error':
+                self.stderr.write(f"line {entry['line']}: {json.dumps(entry['errors'])}")
+        totals = onboarding.summary(report)
+        self.stdout.write(self.style.SUCCESS(f"{totals['created']} patient(s) created, {totals['failed']} row(s) failed."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from sharedapp import counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the leader dashboard counters from the source tables."
+
+    def handle(self, *args, **options):
+        counters.rebuild()
+        self.stdout.write(self.style.SUCCESS("Dashboard counters rebuilt."))
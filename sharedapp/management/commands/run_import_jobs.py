@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sharedapp import onboarding
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the patient imports queued by leader/ImportPatients, oldest first, "
+        "hashing the default passwords in a process pool (the worker line of the Procfiles)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+        parser.add_argument('--poll', type=float, default=5.0, help="Seconds between two looks at an empty queue.")
+        parser.add_argument('--batch-size', type=int, help="Valid rows committed per transaction.")
+        parser.add_argument('--workers', type=int, help="Processes hashing the default passwords.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = onboarding.next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+            if not onboarding.run_job(job, batch_size=options['batch_size'], workers=options['workers']):
+                continue
+            job.refresh_from_db()
+            if job.job_status == 'done':
+                totals = onboarding.summary(job.job_report)
+                self.stdout.write(f"{job.job_id}: {totals['created']} patient(s) created, {totals['failed']} row(s) failed.")
+            else:
+                self.stderr.write(f"{job.job_id}: {job.job_error}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sharedapp import quotas
+from sharedapp.models import Doctor
+
+
+class Command(BaseCommand):
+    help = "Spread a doctor's remaining quota over several slots before a busy booking window, or fold it back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('doctor_id', type=int)
+        parser.add_argument('--slots', type=int, default=8, help="Number of slots to spread the quota over.")
+        parser.add_argument('--collect', action='store_true', help="Fold the slots back into the doctor row.")
+
+    def handle(self, *args, **options):
+        doctor_id = options['doctor_id']
+        try:
+            if options['collect']:
+                quotas.collect(doctor_id)
+            else:
+                quotas.spread(doctor_id, options['slots'])
+        except Doctor.DoesNotExist:
+            raise CommandError(f"Doctor {doctor_id} does not exist.")
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Doctor {doctor_id} has {quotas.remaining(doctor_id)} quota(s) left."
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from sharedapp import filestore
+
+
+class Command(BaseCommand):
+    help = "Delete stored files that no picture, ordonance or message references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help="Files younger than this are kept, as they may not be linked yet.")
+        parser.add_argument('--dry-run', action='store_true', help="Only list what would be deleted.")
+
+    def handle(self, *args, **options):
+        removed = filestore.sweep(options['hours'] * 3600, dry_run=options['dry_run'])
+        for digest in removed:
+            self.stdout.write(digest)
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(removed)} unreferenced file(s)."))
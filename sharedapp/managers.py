@@ -0,0 +1,50 @@
+from django.db import models
+
+
+def blob_fields(model):
+    """Names of the BinaryField columns stored on ``model``'s own table."""
+    return [field.name for field in model._meta.concrete_fields if isinstance(field, models.BinaryField)]
+
+
+def related_blob_lookups(model, relations):
+    """Deferrable lookups for the blobs of every model reached by ``relations``.
+
+    ``relations`` are select_related() paths such as ``'apointment_pat__user_link'``;
+    each model along each path contributes its BinaryFields.
+    """
+    lookups = []
+    for relation in relations:
+        current, prefix = model, ''
+        for part in relation.split('__'):
+            current = current._meta.get_field(part).related_model
+            prefix += part + '__'
+            lookups.extend(prefix + name for name in blob_fields(current))
+    return lookups
+
+
+class BlobDeferringQuerySet(models.QuerySet):
+    """QuerySet that never reads BinaryField columns unless asked to."""
+
+    def select_related(self, *fields):
+        queryset = super().select_related(*fields)
+        # Joined rows would otherwise drag the related tables' blobs along
+        if fields and fields != (None,):
+            queryset = queryset.defer(*related_blob_lookups(self.model, fields))
+        return queryset
+
+    def with_blobs(self):
+        """Explicit opt-in for the few endpoints that really need the bytes."""
+        return self.defer(None)
+
+
+class BlobDeferringManager(models.Manager.from_queryset(BlobDeferringQuerySet)):
+    """Default manager that leaves the model's own blob columns out of every query.
+
+    A deferred blob is still loaded on first attribute access, so code that
+    genuinely reads the bytes keeps working, at the cost of one extra query.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = blob_fields(self.model)
+        return queryset.defer(*fields) if fields else queryset
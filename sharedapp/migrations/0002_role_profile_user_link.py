@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='user_link',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='doctor_profile', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='leader',
+            name='user_link',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leader_profile', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='user_link',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='patient_profile', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
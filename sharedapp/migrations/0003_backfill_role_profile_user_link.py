@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:08
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+# role value on User -> (profile model, profile primary key)
+ROLE_PROFILES = {
+    'doctor': ('Doctor', 'doctor_id'),
+    'patient': ('Patient', 'patient_id'),
+    'admin': ('Leader', 'admin_id'),
+}
+
+
+def backfill_user_link(apps, schema_editor):
+    User = apps.get_model('sharedapp', 'User')
+
+    for role, (model_name, pk_name) in ROLE_PROFILES.items():
+        Profile = apps.get_model('sharedapp', model_name)
+        # One UPDATE per table: pick the oldest account matching the old (role, id) pair
+        matching_user = User.objects.filter(
+            user_role=role, user_role_id=OuterRef(pk_name)
+        ).order_by('id').values('id')[:1]
+        Profile.objects.filter(user_link__isnull=True).update(user_link=Subquery(matching_user))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0002_role_profile_user_link'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user_link, migrations.RunPython.noop),
+    ]
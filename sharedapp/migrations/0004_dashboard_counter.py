@@ -0,0 +1,75 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:10
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+
+
+def seed_counters(apps, schema_editor):
+    # A frozen copy of sharedapp.counters.rebuild as it was when the table was
+    # added, on the historical models, so later changes there do not alter it
+    Counter = apps.get_model('sharedapp', 'DashboardCounter')
+    Patient = apps.get_model('sharedapp', 'Patient')
+    Doctor = apps.get_model('sharedapp', 'Doctor')
+    Appointment = apps.get_model('sharedapp', 'Appointment')
+    MessageDoc = apps.get_model('sharedapp', 'MessageDoc')
+    MessagePat = apps.get_model('sharedapp', 'MessagePat')
+
+    values = defaultdict(int)
+
+    # 1. Tables that only have a total per willaya
+    for metric, queryset in (
+        ('patients', Patient.objects.values(willaya=F('patient_willaya'))),
+        ('doctors', Doctor.objects.values(willaya=F('doctor_willaya'))),
+    ):
+        for row in queryset.annotate(n=Count('pk')).order_by():
+            values[(metric, row['willaya'], None)] += row['n']
+
+    # 2. Tables that are also bucketed per day
+    for metric, queryset in (
+        ('appointments', Appointment.objects.values(
+            willaya=F('apointment_doc__doctor_willaya'), day=TruncDate('apointment_date'))),
+        ('doctor_messages', MessageDoc.objects.values(
+            willaya=F('message_sender__doctor_willaya'), day=TruncDate('message_date'))),
+        ('patient_messages', MessagePat.objects.values(
+            willaya=F('message_sender__patient_willaya'), day=TruncDate('message_date'))),
+    ):
+        for row in queryset.annotate(n=Count('pk')).order_by():
+            values[(metric, row['willaya'], None)] += row['n']
+            values[(metric, row['willaya'], row['day'])] += row['n']
+
+    Counter.objects.all().delete()
+    Counter.objects.bulk_create(
+        [
+            Counter(counter_metric=metric, counter_willaya=willaya, counter_day=day, counter_value=n)
+            for (metric, willaya, day), n in values.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0003_backfill_role_profile_user_link'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('counter_id', models.AutoField(primary_key=True, serialize=False)),
+                ('counter_metric', models.CharField(choices=[('patients', 'Patients'), ('doctors', 'Doctors'), ('appointments', 'Appointments'), ('doctor_messages', 'Doctor messages'), ('patient_messages', 'Patient messages')], max_length=20)),
+                ('counter_willaya', models.CharField(max_length=50)),
+                ('counter_day', models.DateField(blank=True, null=True)),
+                ('counter_value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'dashboard_counter',
+                'constraints': [models.UniqueConstraint(fields=('counter_metric', 'counter_willaya', 'counter_day'), name='dashboard_counter_daily_unique'), models.UniqueConstraint(condition=models.Q(('counter_day__isnull', True)), fields=('counter_metric', 'counter_willaya'), name='dashboard_counter_total_unique')],
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
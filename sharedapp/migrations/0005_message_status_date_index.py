@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0004_dashboard_counter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messagedoc',
+            index=models.Index(fields=['message_status', 'message_date'], name='messagedoc_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messagepat',
+            index=models.Index(fields=['message_status', 'message_date'], name='messagpat_status_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0005_message_status_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['patient_willaya', 'patient_id'], name='patient_willaya_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0006_patient_willaya_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='doctor_pic_ref',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='messagepat',
+            name='message_pic_ref',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='ordonance',
+            name='ordonance_file_ref',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='patient_pic_ref',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:15
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations
+
+# model -> inline BinaryField whose bytes move to the file store
+STORED_FIELDS = {
+    'Doctor': 'doctor_pic',
+    'Patient': 'patient_pic',
+    'Ordonance': 'ordonance_file',
+    'MessagePat': 'message_pic',
+}
+
+
+# A frozen copy of the store layout sharedapp.filestore had when this ran:
+# <root>/ab/cd/<sha256>, written through <root>/tmp and renamed in place
+
+def _path(digest):
+    return Path(settings.FILESTORE_ROOT) / digest[:2] / digest[2:4] / digest
+
+
+def _save(content):
+    digest = hashlib.sha256(content).hexdigest()
+    target = _path(digest)
+    if target.exists():
+        return digest
+    tmp_dir = Path(settings.FILESTORE_ROOT) / 'tmp'
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        tmp.write(content)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp.name, target)
+    return digest
+
+
+def move_to_store(apps, schema_editor):
+
+    for model_name, blob_field in STORED_FIELDS.items():
+        Model = apps.get_model('sharedapp', model_name)
+        empty = None if Model._meta.get_field(blob_field).null else b''
+        rows = Model.objects.filter(**{f'{blob_field}_ref': ''}).only('pk', blob_field)
+
+        # One row at a time, so memory stays at one blob however big the table is
+        for row in rows.iterator(chunk_size=50):
+            content = getattr(row, blob_field)
+            if not content:
+                continue
+            Model.objects.filter(pk=row.pk).update(**{
+                f'{blob_field}_ref': _save(bytes(content)),
+                blob_field: empty,
+            })
+
+
+def move_back_inline(apps, schema_editor):
+
+    for model_name, blob_field in STORED_FIELDS.items():
+        Model = apps.get_model('sharedapp', model_name)
+        rows = Model.objects.exclude(**{f'{blob_field}_ref': ''}).only('pk', f'{blob_field}_ref')
+        for row in rows.iterator(chunk_size=50):
+            digest = getattr(row, f'{blob_field}_ref')
+            content = _path(digest).read_bytes()
+            Model.objects.filter(pk=row.pk).update(**{f'{blob_field}_ref': '', blob_field: content})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0007_filestore_refs'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_store, move_back_inline),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:15
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0008_move_blobs_to_filestore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('upload_target', models.CharField(choices=[('ordonance', 'Ordonance file'), ('message-picture', 'Patient message picture')], max_length=20)),
+                ('upload_target_id', models.IntegerField()),
+                ('upload_size', models.BigIntegerField()),
+                ('upload_sha256', models.CharField(max_length=64)),
+                ('upload_received', models.BigIntegerField(default=0)),
+                ('upload_completed', models.BooleanField(default=False)),
+                ('upload_created', models.DateTimeField(auto_now_add=True)),
+                ('upload_owner', models.ForeignKey(db_column='upload_owner', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'upload_session',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0009_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaSlot',
+            fields=[
+                ('slot_id', models.AutoField(primary_key=True, serialize=False)),
+                ('slot_index', models.PositiveSmallIntegerField()),
+                ('slot_left', models.IntegerField(default=0)),
+                ('slot_doctor', models.ForeignKey(db_column='slot_doctor', on_delete=django.db.models.deletion.CASCADE, related_name='quota_slots', to='sharedapp.doctor')),
+            ],
+            options={
+                'db_table': 'quota_slot',
+                'constraints': [models.UniqueConstraint(fields=('slot_doctor', 'slot_index'), name='quota_slot_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0010_quota_slot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['apointment_doc', 'apointment_date'], name='apointment_doc_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['apointment_date'], name='apointment_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0011_appointment_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['apointment_doc', 'apointment_pat', 'apointment_date'], name='apointment_doc_pat_idx'),
+        ),
+    ]
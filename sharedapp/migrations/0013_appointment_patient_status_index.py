@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0012_appointment_doctor_patient_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['apointment_pat', 'apointment_status', 'apointment_date'], name='apointment_pat_status_idx'),
+        ),
+    ]
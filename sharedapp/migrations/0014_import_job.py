@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:00
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0013_appointment_patient_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('job_format', models.CharField(max_length=10)),
+                ('job_status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('job_report', models.JSONField(blank=True, null=True)),
+                ('job_error', models.TextField(blank=True, default='')),
+                ('job_created', models.DateTimeField(auto_now_add=True)),
+                ('job_started', models.DateTimeField(blank=True, null=True)),
+                ('job_finished', models.DateTimeField(blank=True, null=True)),
+                ('job_owner', models.ForeignKey(db_column='job_owner', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'import_job',
+                'indexes': [models.Index(fields=['job_status', 'job_created'], name='import_job_queue_index')],
+            },
+        ),
+    ]
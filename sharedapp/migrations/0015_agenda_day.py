@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0014_import_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendaDay',
+            fields=[
+                ('day_id', models.AutoField(primary_key=True, serialize=False)),
+                ('day_date', models.DateField()),
+                ('day_doctor', models.ForeignKey(db_column='day_doctor', on_delete=django.db.models.deletion.CASCADE, related_name='agenda_days', to='sharedapp.doctor')),
+            ],
+            options={
+                'db_table': 'agenda_day',
+                'constraints': [models.UniqueConstraint(fields=('day_doctor', 'day_date'), name='agenda_day_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharedapp', '0015_agenda_day'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dashboardcounter',
+            name='dashboard_counter_daily_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='dashboardcounter',
+            name='dashboard_counter_total_unique',
+        ),
+        migrations.AddField(
+            model_name='dashboardcounter',
+            name='counter_shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='dashboardcounter',
+            constraint=models.UniqueConstraint(fields=('counter_metric', 'counter_willaya', 'counter_day', 'counter_shard'), name='dashboard_counter_daily_shard_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dashboardcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('counter_day__isnull', True)), fields=('counter_metric', 'counter_willaya', 'counter_shard'), name='dashboard_counter_total_shard_unique'),
+        ),
+    ]
@@ -1,6 +1,10 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from .managers import BlobDeferringManager
+
 # ==========================================
 # 1. CUSTOM USER MODEL
 # ==========================================
@@ -18,6 +22,16 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.username} ({self.user_role})"
 
+    @property
+    def role_profile(self):
+        # The Doctor / Patient / Leader row linked to this account (or None)
+        accessor = {
+            'doctor': 'doctor_profile',
+            'patient': 'patient_profile',
+            'admin': 'leader_profile',
+        }.get(self.user_role)
+        return getattr(self, accessor, None) if accessor else None
+
 # ==========================================
 # 2. ROLE TABLES (CLEANED)
 # ==========================================
@@ -36,9 +50,15 @@ class Doctor(models.Model):
     doctor_address = models.CharField(max_length=200)
     doctor_willaya = models.CharField(max_length=50)
     doctor_pic = models.BinaryField(null=True, blank=True)
+    # SHA-256 of the file in sharedapp.filestore; the inline column above is legacy
+    doctor_pic_ref = models.CharField(max_length=64, blank=True, default='')
     doctor_cotas = models.IntegerField()
     doctor_speciality = models.ForeignKey(Speciality, on_delete=models.CASCADE, db_column='doctor_speciality_id')
     doctor_leftcotas = models.IntegerField()
+    # Real link to the account, so the ORM can join instead of matching user_role/user_role_id
+    user_link = models.OneToOneField(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='doctor_profile')
+
+    objects = BlobDeferringManager()
 
     class Meta:
         db_table = 'doctor'
@@ -53,16 +73,27 @@ class Patient(models.Model):
     patient_address = models.CharField(max_length=200)
     patient_phone = models.IntegerField()
     patient_pic = models.BinaryField()
+    patient_pic_ref = models.CharField(max_length=64, blank=True, default='')
     patient_willaya = models.CharField(max_length=50)
+    # Real link to the account, so the ORM can join instead of matching user_role/user_role_id
+    user_link = models.OneToOneField(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='patient_profile')
+
+    objects = BlobDeferringManager()
 
     class Meta:
         db_table = 'patient'
+        indexes = [
+            # Willaya-filtered patient directories and panels, in id order
+            models.Index(fields=['patient_willaya', 'patient_id'], name='patient_willaya_idx'),
+        ]
 
 class Leader(models.Model):  # Renamed from Admin
     admin_id = models.AutoField(primary_key=True)
     # Removed: admin_pwd, admin_email (Now in User model)
     admin_willaya = models.CharField(max_length=50)
     admin_status = models.BooleanField(default=False)
+    # Real link to the account, so the ORM can join instead of matching user_role/user_role_id
+    user_link = models.OneToOneField(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='leader_profile')
 
     class Meta:
         db_table = 'leader'
@@ -79,6 +110,8 @@ class Service(models.Model):
     service_description = models.CharField(max_length=500)
     doc = models.ForeignKey(Doctor, on_delete=models.CASCADE, db_column='doc_id')
 
+    objects = BlobDeferringManager()
+
     class Meta:
         db_table = 'service'
 
@@ -92,15 +125,30 @@ class Appointment(models.Model):
     apointment_status = models.BooleanField(default=False)
     apointment_comment = models.CharField(max_length=1000)
 
+    objects = BlobDeferringManager()
+
     class Meta:
         db_table = 'apointment'
+        indexes = [
+            # Doctor agendas: one doctor's bookings over a datetime range
+            models.Index(fields=['apointment_doc', 'apointment_date'], name='apointment_doc_date_idx'),
+            # Patient panels: a patient's latest visit with one doctor
+            models.Index(fields=['apointment_doc', 'apointment_pat', 'apointment_date'], name='apointment_doc_pat_idx'),
+            # Patient history / upcoming lists, in date order
+            models.Index(fields=['apointment_pat', 'apointment_status', 'apointment_date'], name='apointment_pat_status_idx'),
+            # Leader board: everybody's bookings over a datetime range
+            models.Index(fields=['apointment_date'], name='apointment_date_idx'),
+        ]
 
 class Ordonance(models.Model):
     ordonance_id = models.AutoField(primary_key=True)
     ordonance_apointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, db_column='ordonance_apointment')
     ordonance_file = models.BinaryField()
+    ordonance_file_ref = models.CharField(max_length=64, blank=True, default='')
     ordonance_description = models.CharField(max_length=500)
 
+    objects = BlobDeferringManager()
+
     class Meta:
         db_table = 'ordonance'
 
@@ -113,8 +161,14 @@ class MessageDoc(models.Model):
     message_status = models.BooleanField(default=False)
     message_date = models.DateTimeField(auto_now_add=True)
 
+    objects = BlobDeferringManager()
+
     class Meta:
         db_table = 'messagedoc'
+        indexes = [
+            # Leader inboxes: pending messages, newest first
+            models.Index(fields=['message_status', 'message_date'], name='messagedoc_status_date_idx'),
+        ]
 
 class MessagePat(models.Model):
     message_id = models.AutoField(primary_key=True)
@@ -125,6 +179,153 @@ class MessagePat(models.Model):
     message_status = models.BooleanField(default=False)
     message_date = models.DateTimeField(auto_now_add=True)
     message_pic = models.BinaryField(null=True, blank=True)
+    message_pic_ref = models.CharField(max_length=64, blank=True, default='')
+
+    objects = BlobDeferringManager()
+
+    class Meta:
+        db_table = 'messagpat'
+        indexes = [
+            # Leader inboxes: pending messages, newest first
+            models.Index(fields=['message_status', 'message_date'], name='messagpat_status_date_idx'),
+        ]
+
+# ==========================================
+# 4. PRECOMPUTED DASHBOARD COUNTERS
+# ==========================================
+
+class DashboardCounter(models.Model):
+    """Running row counts per willaya (counter_day empty) and per willaya and day.
+
+    Kept current by the signal handlers in sharedapp.counters so the leader
+    dashboard never has to COUNT(*) the big tables. A count is the sum of its
+    shards: writers each bump one shard, at random, instead of all queueing
+    on a single row.
+    """
+    METRIC_CHOICES = [
+        ('patients', 'Patients'),
+        ('doctors', 'Doctors'),
+        ('appointments', 'Appointments'),
+        ('doctor_messages', 'Doctor messages'),
+        ('patient_messages', 'Patient messages'),
+    ]
+
+    counter_id = models.AutoField(primary_key=True)
+    counter_metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    counter_willaya = models.CharField(max_length=50)
+    counter_day = models.DateField(null=True, blank=True)
+    counter_shard = models.PositiveSmallIntegerField(default=0)
+    counter_value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'dashboard_counter'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['counter_metric', 'counter_willaya', 'counter_day', 'counter_shard'],
+                name='dashboard_counter_daily_shard_unique',
+            ),
+            # NULL days are distinct in a plain unique constraint, so totals get their own
+            models.UniqueConstraint(
+                fields=['counter_metric', 'counter_willaya', 'counter_shard'],
+                condition=models.Q(counter_day__isnull=True),
+                name='dashboard_counter_total_shard_unique',
+            ),
+        ]
+
+
+
+# ==========================================
+# 5. CHUNKED UPLOADS
+# ==========================================
+
+class UploadSession(models.Model):
+    """A resumable upload in progress, see sharedapp.uploads."""
+    TARGET_CHOICES = [
+        ('ordonance', 'Ordonance file'),
+        ('message-picture', 'Patient message picture'),
+    ]
+
+    upload_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    upload_owner = models.ForeignKey(User, on_delete=models.CASCADE, db_column='upload_owner')
+    upload_target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    upload_target_id = models.IntegerField()
+    upload_size = models.BigIntegerField()
+    upload_sha256 = models.CharField(max_length=64)
+    upload_received = models.BigIntegerField(default=0)
+    upload_completed = models.BooleanField(default=False)
+    upload_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'upload_session'
+
+# ==========================================
+# 6. SPREAD DOCTOR QUOTAS
+# ==========================================
+
+class QuotaSlot(models.Model):
+    """One share of a doctor's remaining quota, see sharedapp.quotas.
+
+    A popular doctor's quota can be spread over several slots so that
+    concurrent bookings decrement different rows instead of queueing on the
+    doctor row. While slots exist, the doctor's remaining quota is
+    ``doctor_leftcotas`` plus the sum of their ``slot_left``.
+    """
+    slot_id = models.AutoField(primary_key=True)
+    slot_doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, db_column='slot_doctor', related_name='quota_slots')
+    slot_index = models.PositiveSmallIntegerField()
+    slot_left = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'quota_slot'
+        constraints = [
+            models.UniqueConstraint(fields=['slot_doctor', 'slot_index'], name='quota_slot_unique'),
+        ]
+
+# ==========================================
+# 7. PATIENT IMPORT JOBS
+# ==========================================
+
+class ImportJob(models.Model):
+    """A patient import file waiting for, or handled by, the import worker, see sharedapp.onboarding."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    job_owner = models.ForeignKey(User, on_delete=models.CASCADE, db_column='job_owner')
+    job_format = models.CharField(max_length=10)
+    job_status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    # One entry per row of the file, as returned by onboarding.import_patients
+    job_report = models.JSONField(null=True, blank=True)
+    job_error = models.TextField(blank=True, default='')
+    job_created = models.DateTimeField(auto_now_add=True)
+    job_started = models.DateTimeField(null=True, blank=True)
+    job_finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'import_job'
+        indexes = [models.Index(fields=['job_status', 'job_created'], name='import_job_queue_index')]
+
+# ==========================================
+# 8. BOOKING LOCKS
+# ==========================================
+
+class AgendaDay(models.Model):
+    """A doctor's day that has seen bookings, see sharedapp.availability.
+
+    Bookings lock the rows of the days they cover while they check for
+    overlaps, so two bookings of the same doctor and day are checked one
+    after the other, while other days and other doctors go on in parallel.
+    """
+    day_id = models.AutoField(primary_key=True)
+    day_doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, db_column='day_doctor', related_name='agenda_days')
+    day_date = models.DateField()
 
     class Meta:
-        db_table = 'messagpat'
\ No newline at end of file
+        db_table = 'agenda_day'
+        constraints = [
+            models.UniqueConstraint(fields=['day_doctor', 'day_date'], name='agenda_day_unique'),
+        ]
@@ -0,0 +1,206 @@
+import csv
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import counters
+from .filestore import get_store
+from .hashers import default_patient_password, hash_many
+from .models import ImportJob, Patient, User
+from .serializers import PatientImportSerializer
+
+FORMATS = ('csv', 'jsonl')
+
+
+class OnboardingError(Exception):
+    """The file as a whole cannot be read (unknown format, no header...)."""
+
+
+# ==========================================
+# READING
+# ==========================================
+# Rows are read and validated one at a time, so a file of any size only
+# ever holds one batch in memory.
+
+def format_of(name, default='csv'):
+    extension = os.path.splitext(name or '')[1].lstrip('.').lower()
+    return extension if extension in FORMATS else default
+
+
+def read_rows(stream, fmt):
+    """(line number, dict) for every row of a text ``stream``; unparsable lines give (line, None)."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames:
+            raise OnboardingError("The CSV file has no header row.")
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise OnboardingError(f"format must be one of {', '.join(FORMATS)}.")
+
+
+# ==========================================
+# IMPORTING
+# ==========================================
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _validated(rows, report):
+    """Rows that pass the serializer; the others are reported as they go by."""
+    for line, row in rows:
+        if row is None:
+            report.append({"line": line, "status": "error", "errors": {"row": ["Not a JSON object."]}})
+            continue
+        serializer = PatientImportSerializer(data=row)
+        if serializer.is_valid():
+            yield line, serializer.validated_data
+        else:
+            report.append({"line": line, "status": "error", "errors": serializer.errors})
+
+
+def _insert(batch, executor, seen_usernames):
+    """Create the patients and accounts of one batch in a single transaction; one report entry per row."""
+    # 1. Usernames already taken, in the database or earlier in the file
+    usernames = [data['username'] for _, data in batch]
+    taken = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    report, rows = [], []
+    for line, data in batch:
+        if data['username'] in taken or data['username'] in seen_usernames:
+            report.append({"line": line, "status": "error", "errors": {"username": ["Already taken."]}})
+        else:
+            seen_usernames.add(data['username'])
+            rows.append((line, data))
+    if not rows:
+        return report
+
+    # 2. The expensive part, outside the transaction
+    passwords = [default_patient_password(data['patient_companyid']) for _, data in rows]
+    hashes = hash_many(passwords, executor)
+
+    # 3. Three statements for the whole batch: patients, accounts, links
+    # (bulk_create sends no signals, so the dashboard counters are bumped here)
+    try:
+        with transaction.atomic():
+            patients = Patient.objects.bulk_create([
+                Patient(patient_pic=b'', **{k: v for k, v in data.items() if k.startswith('patient_')})
+                for _, data in rows
+            ])
+            users = User.objects.bulk_create([
+                User(
+                    username=data['username'], email=data['email'], password=hashed,
+                    user_role='patient', user_role_id=patient.patient_id,
+                )
+                for (_, data), patient, hashed in zip(rows, patients, hashes)
+            ])
+            for patient, user in zip(patients, users):
+                patient.user_link = user
+            Patient.objects.bulk_update(patients, ['user_link'])
+            for willaya, n in Counter(patient.patient_willaya for patient in patients).items():
+                counters.bump('patients', willaya, delta=n)
+    except DatabaseError as e:
+        for line, _ in rows:
+            report.append({"line": line, "status": "error", "errors": {"row": [str(e)]}})
+        return report
+
+    for (line, data), patient, password in zip(rows, patients, passwords):
+        report.append({
+            "line": line, "status": "created", "patient_id": patient.patient_id,
+            "username": data['username'], "generated_password": password,
+        })
+    return report
+
+
+def import_patients(rows, batch_size=None, workers=None):
+    """Validate and create patients from ``read_rows`` output; returns one report entry per row, in file order.
+
+    Each batch of ``batch_size`` valid rows is committed on its own, so a
+    failing batch leaves the earlier ones in place. Default passwords are
+    hashed over ``workers`` processes (1 hashes in this process).
+    """
+    batch_size = batch_size or settings.ONBOARDING_BATCH_SIZE
+    workers = workers or settings.ONBOARDING_HASH_WORKERS or os.cpu_count() or 1
+    report, seen_usernames = [], set()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()
+    with pool as executor:
+        for batch in _batches(_validated(rows, report), batch_size):
+            report.extend(_insert(batch, executor, seen_usernames))
+    report.sort(key=lambda entry: entry['line'])
+    return report
+
+
+def summary(report):
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    return {"created": created, "failed": len(report) - created}
+
+
+# ==========================================
+# JOBS
+# ==========================================
+# Hashing thousands of default passwords takes minutes, far longer than a
+# request may run. The endpoint only stores the file and queues a job; the
+# worker (manage.py run_import_jobs) runs it with its process pool and
+# keeps the report for the leader to fetch.
+
+def job_path(job):
+    return get_store().root / 'imports' / f'{job.job_id}.{job.job_format}'
+
+
+def enqueue(owner, upload, name):
+    """Queue the import of an uploaded file (read in chunks, never whole)."""
+    job = ImportJob(job_owner=owner, job_format=format_of(name))
+    path = job_path(job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as staged:
+        for chunk in upload.chunks():
+            staged.write(chunk)
+    job.save()
+    return job
+
+
+def next_job():
+    return ImportJob.objects.filter(job_status='queued').order_by('job_created').first()
+
+
+def run_job(job, batch_size=None, workers=None):
+    """Run a queued job; False when another worker claimed it first."""
+    claimed = ImportJob.objects.filter(pk=job.pk, job_status='queued').update(
+        job_status='running', job_started=timezone.now())
+    if not claimed:
+        return False
+
+    path = job_path(job)
+    try:
+        # A BOM left by spreadsheets is skipped
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = import_patients(read_rows(stream, job.job_format), batch_size=batch_size, workers=workers)
+        job.job_status, job.job_report = 'done', report
+    except (OSError, UnicodeDecodeError, OnboardingError) as e:
+        job.job_status, job.job_error = 'failed', str(e)
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    job.job_finished = timezone.now()
+    job.save(update_fields=['job_status', 'job_report', 'job_error', 'job_finished'])
+    return True
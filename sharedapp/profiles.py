@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils.functional import cached_property
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.request import Request
+
+from .models import Doctor, Patient, Leader
+
+# user_role value -> profile model it points at
+ROLE_PROFILE_MODELS = {
+    'doctor': Doctor,
+    'patient': Patient,
+    'admin': Leader,
+}
+PROFILE_ROLES = {model: role for role, model in ROLE_PROFILE_MODELS.items()}
+
+
+def _key(role, role_id):
+    return f'profile:{role}:{role_id}'
+
+
+def load(user):
+    """``user``'s Doctor / Patient / Leader row with its account, from the cache when possible.
+
+    Raises the profile model's DoesNotExist when there is none, like a
+    plain ``objects.get()`` would.
+    """
+    model = ROLE_PROFILE_MODELS.get(getattr(user, 'user_role', None))
+    if model is None:
+        raise ObjectDoesNotExist("This account has no role profile.")
+    key = _key(user.user_role, user.user_role_id)
+    profile = cache.get(key)
+    if profile is None:
+        # Blob columns stay deferred (BlobDeferringManager), so the cached row is small
+        profile = model.objects.select_related('user_link').get(pk=user.user_role_id)
+        cache.set(key, profile, timeout=settings.PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+def forget(role, role_id):
+    """Drop a cached profile once the current transaction commits."""
+    if role in ROLE_PROFILE_MODELS and role_id is not None:
+        key = _key(role, role_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+class ProfileRequest(Request):
+    @cached_property
+    def profile(self):
+        # Not cached when it raises, so a missing profile is simply reported again
+        return load(self.user)
+
+
+class ProfileMixin:
+    """Gives an APIView ``request.profile``, the caller's role profile.
+
+    It is loaded on first use and at most once per request (see ``load``).
+    Set ``profile_role`` to turn away callers with another role before the
+    handler runs.
+    """
+    profile_role = None
+
+    def initialize_request(self, request, *args, **kwargs):
+        return ProfileRequest(
+            request,
+            parsers=self.get_parsers(),
+            authenticators=self.get_authenticators(),
+            negotiator=self.get_content_negotiator(),
+            parser_context=self.get_parser_context(request),
+        )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.profile_role is not None and getattr(request.user, 'user_role', None) != self.profile_role:
+            raise PermissionDenied(f"Only {self.profile_role} accounts can use this endpoint.")
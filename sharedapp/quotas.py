@@ -0,0 +1,169 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, When
+
+from . import profiles, versions
+from .models import Doctor, Patient, QuotaSlot
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+# ==========================================
+# RESERVE / REFUND
+# ==========================================
+# Every change is a single conditional UPDATE (``... SET left = left - 1
+# WHERE left > 0``), so the database does the check and the decrement at
+# once. Nobody reads a quota, decides in Python and writes it back, and no
+# row is locked before the booking is known to be valid.
+
+def _take_from_doctor(doctor_id):
+    return Doctor.objects.filter(doctor_id=doctor_id, doctor_leftcotas__gt=0).update(
+        doctor_leftcotas=F('doctor_leftcotas') - 1
+    )
+
+
+def _take_from_slot(doctor_id):
+    """Decrement one of the doctor's quota slots that still has room."""
+    while True:
+        # skip_locked: a slot another booking is holding is passed over, not waited on
+        candidates = list(
+            QuotaSlot.objects.select_for_update(skip_locked=True)
+            .filter(slot_doctor_id=doctor_id, slot_left__gt=0)
+            .order_by('?')
+            .values_list('slot_id', flat=True)[:1]
+        )
+        if not candidates:
+            return False
+        if QuotaSlot.objects.filter(slot_id=candidates[0], slot_left__gt=0).update(
+            slot_left=F('slot_left') - 1
+        ):
+            return True
+        # Backends without row locks: someone emptied that slot in between, pick another
+
+
+def _take_from_patient(patient_id):
+    """Decrement a patient's quota; cancer patients are not counted but must exist."""
+    return Patient.objects.filter(
+        Q(patient_cancer=True) | Q(patient_leftcotas__gt=0), patient_id=patient_id
+    ).update(
+        patient_leftcotas=Case(
+            When(patient_cancer=True, then=F('patient_leftcotas')),
+            default=F('patient_leftcotas') - 1,
+        )
+    )
+
+
+def _changed(doctor_ids, patient_ids):
+    # update() sends no signals: expire what the model receivers would have
+    versions.touch(*[('doctor', i) for i in doctor_ids], *[('patient', i) for i in patient_ids])
+    for i in doctor_ids:
+        profiles.forget('doctor', i)
+    for i in patient_ids:
+        profiles.forget('patient', i)
+
+
+def reserve(doctor_id, patient_id):
+    """Take one quota from the doctor and one from the patient, or neither.
+
+    Raises QuotaExhausted when either has none left. Call it as late as
+    possible in the booking transaction: the doctor row (or slot) stays
+    locked from here until the commit. Which one depends on where the quota
+    is held, so overlapping bookings are kept apart by
+    ``availability.ensure_free``, not by this.
+    """
+    with transaction.atomic():
+        if not _take_from_patient(patient_id):
+            raise QuotaExhausted("Patient has no quotas left.")
+        if not (_take_from_doctor(doctor_id) or _take_from_slot(doctor_id)):
+            raise QuotaExhausted("Doctor has no quotas left.")
+        _changed([doctor_id], [patient_id])
+
+
+def refund(doctor_id, patient_id):
+    """Give back what ``reserve`` took, e.g. when an appointment is cancelled."""
+    Doctor.objects.filter(doctor_id=doctor_id).update(doctor_leftcotas=F('doctor_leftcotas') + 1)
+    Patient.objects.filter(patient_id=patient_id, patient_cancer=False).update(
+        patient_leftcotas=F('patient_leftcotas') + 1
+    )
+    _changed([doctor_id], [patient_id])
+
+
+def _group_by_amount(counts):
+    """{amount: [ids]} from {id: amount}, so equal refunds share one UPDATE."""
+    groups = defaultdict(list)
+    for ident, amount in counts.items():
+        groups[amount].append(ident)
+    return groups
+
+
+def refund_many(pairs):
+    """``refund`` for many (doctor_id, patient_id) pairs, one UPDATE per distinct amount per table."""
+    doctors = Counter(doctor_id for doctor_id, _ in pairs)
+    patients = Counter(patient_id for _, patient_id in pairs)
+    for amount, ids in _group_by_amount(doctors).items():
+        Doctor.objects.filter(doctor_id__in=ids).update(doctor_leftcotas=F('doctor_leftcotas') + amount)
+    for amount, ids in _group_by_amount(patients).items():
+        Patient.objects.filter(patient_id__in=ids, patient_cancer=False).update(
+            patient_leftcotas=F('patient_leftcotas') + amount
+        )
+    _changed(doctors, patients)
+
+
+# ==========================================
+# SPREADING A DOCTOR'S QUOTA
+# ==========================================
+
+def _lock(doctor_id):
+    doctor = Doctor.objects.select_for_update().only('doctor_leftcotas').get(doctor_id=doctor_id)
+    slots = list(QuotaSlot.objects.select_for_update().filter(slot_doctor_id=doctor_id))
+    return doctor, slots
+
+
+def spread(doctor_id, count):
+    """Move a doctor's remaining quota into ``count`` slots, evenly.
+
+    Bookings drain the doctor row first (refunds land there too) and then
+    the slots, so spreading is safe to do while bookings are running.
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    with transaction.atomic():
+        doctor, slots = _lock(doctor_id)
+        left = doctor.doctor_leftcotas + sum(slot.slot_left for slot in slots)
+        QuotaSlot.objects.filter(slot_doctor_id=doctor_id).delete()
+        share, extra = divmod(left, count)
+        QuotaSlot.objects.bulk_create(
+            QuotaSlot(slot_doctor_id=doctor_id, slot_index=i, slot_left=share + (i < extra))
+            for i in range(count)
+        )
+        doctor.doctor_leftcotas = 0
+        doctor.save(update_fields=['doctor_leftcotas'])
+
+
+def collect(doctor_id):
+    """Fold a doctor's slots back into ``doctor_leftcotas``."""
+    with transaction.atomic():
+        doctor, slots = _lock(doctor_id)
+        doctor.doctor_leftcotas += sum(slot.slot_left for slot in slots)
+        doctor.save(update_fields=['doctor_leftcotas'])
+        QuotaSlot.objects.filter(slot_doctor_id=doctor_id).delete()
+
+
+def slot_totals(doctor_ids):
+    """{doctor_id: quota held in slots} for the doctors that have any, in one query."""
+    rows = (
+        QuotaSlot.objects.filter(slot_doctor_id__in=doctor_ids)
+        .values('slot_doctor_id')
+        .annotate(left=Sum('slot_left'))
+        .order_by()
+    )
+    return {row['slot_doctor_id']: row['left'] for row in rows}
+
+
+def remaining(doctor_id):
+    """A doctor's remaining quota, slots included."""
+    left = Doctor.objects.filter(doctor_id=doctor_id).values_list('doctor_leftcotas', flat=True).get()
+    return left + slot_totals([doctor_id]).get(doctor_id, 0)
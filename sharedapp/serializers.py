@@ -1,5 +1,9 @@
+from django.contrib.auth.hashers import check_password, make_password
+from django.db.models import Exists, OuterRef
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .profiles import ROLE_PROFILE_MODELS
+from .thumbnails import thumbnail_urls
 from .models import (
     User, Speciality, Doctor, Patient, Leader, 
     Service, Appointment, Ordonance, MessageDoc, MessagePat
@@ -35,6 +39,19 @@ class PatientSerializer(serializers.ModelSerializer):
         # We explicitly exclude the BinaryField here too
         exclude = ['patient_pic']
 
+class PatientImportSerializer(serializers.ModelSerializer):
+    """ One row of a bulk patient import (sharedapp.onboarding) """
+    username = serializers.CharField(max_length=150)
+    email = serializers.EmailField(required=False, allow_blank=True, default='')
+
+    class Meta:
+        model = Patient
+        fields = [
+            'username', 'email', 'patient_companyid', 'patient_datebirth', 'patient_cancer',
+            'patient_leftcotas', 'patient_address', 'patient_phone', 'patient_willaya',
+        ]
+        extra_kwargs = {'patient_leftcotas': {'required': False, 'default': 0}}
+
 class LeaderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Leader
@@ -70,6 +87,19 @@ class MessagePatSerializer(serializers.ModelSerializer):
 
 
 
+LOGIN_FAILED = "Invalid role, ID or password."
+
+
+def rehash(user, raw_password):
+    """Store ``raw_password`` with the preferred hasher after a login checked it.
+
+    A plain UPDATE: this is the same password, so the signal receivers that
+    revoke tokens on a password change must not see it.
+    """
+    user.password = make_password(raw_password)
+    User.objects.filter(pk=user.pk).update(password=user.password)
+
+
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     # We define the extra fields the frontend must send
     user_role = serializers.CharField(write_only=True)
@@ -80,28 +110,28 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         role_id = attrs.get("role_specific_id")
         password = attrs.get("password")
 
-        # 1. Verification Step: Check if the ID exists in the specific table
-        exists = False
-        if role == 'doctor':
-            exists = Doctor.objects.filter(doctor_id=role_id).exists()
-        elif role == 'patient':
-            exists = Patient.objects.filter(patient_id=role_id).exists()
-        elif role == 'admin':
-            exists = Leader.objects.filter(admin_id=role_id).exists()
-
-        if not exists:
-            raise serializers.ValidationError(f"Invalid ID: No {role} found with ID {role_id}")
-
-        # 2. Find the linked User account
-        # We find the User where user_role and user_role_id match the inputs
-        try:
-            user = User.objects.get(user_role=role, user_role_id=role_id)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("No user account linked to this role and ID.")
-
-        # 3. Check password
-        if not user.check_password(password):
-            raise serializers.ValidationError("Incorrect password.")
+        # 1. The account and its role profile in one query
+        user = None
+        profile_model = ROLE_PROFILE_MODELS.get(role)
+        if profile_model is not None:
+            user = (
+                User.objects.filter(user_role=role, user_role_id=role_id)
+                .filter(Exists(profile_model.objects.filter(pk=OuterRef('user_role_id'))))
+                .only('id', 'username', 'password', 'is_active', 'user_role', 'user_role_id')
+                .first()
+            )
+
+        # 2. Check password. Unknown accounts cost the same hash, so timing
+        # does not tell them apart, and every failure reads the same.
+        if user is None:
+            make_password(password)
+            raise serializers.ValidationError(LOGIN_FAILED)
+        if not check_password(password, user.password, setter=lambda raw: rehash(user, raw)):
+            raise serializers.ValidationError(LOGIN_FAILED)
+
+        # 3. Disabled accounts: requests no longer reload the User, so stop them here
+        if not user.is_active:
+            raise serializers.ValidationError("This account is disabled.")
 
         # 4. Generate Tokens
         refresh = self.get_token(user)
@@ -129,11 +159,16 @@ class DoctorWithUserSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user_link.first_name', read_only=True)
     last_name = serializers.CharField(source='user_link.last_name', read_only=True)
     email = serializers.CharField(source='user_link.email', read_only=True)
+    # Avatar URLs, built from the stored picture's digest without touching the file
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Doctor
         fields = [
             'doctor_id', 'doctor_phone', 'doctor_address', 'doctor_willaya', 
             'doctor_cotas', 'doctor_leftcotas', 'doctor_speciality',
-            'username', 'first_name', 'last_name', 'email'
-        ]
\ No newline at end of file
+            'username', 'first_name', 'last_name', 'email', 'thumbnails'
+        ]
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj.doctor_pic_ref)
\ No newline at end of file
@@ -0,0 +1,378 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import authentication, availability, counters, directory, events, profiles, versions
+from .models import User, Speciality, Doctor, Patient, Leader, Service, Appointment, MessageDoc, MessagePat
+from .profiles import PROFILE_ROLES, ROLE_PROFILE_MODELS
+
+
+# ==========================================
+# MUTING
+# ==========================================
+# Set-based writes (see sharedapp.bulk) replace the per-row receivers below
+# with one aggregated call each, and mute them while the ORM runs.
+
+_muted = ContextVar('muted_senders', default=frozenset())
+
+
+@contextmanager
+def muted(*senders):
+    """Skip the receivers marked ``unless_muted`` for rows of ``senders``."""
+    token = _muted.set(_muted.get() | set(senders))
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def unless_muted(receiver_func):
+    @wraps(receiver_func)
+    def wrapper(sender, **kwargs):
+        if sender not in _muted.get():
+            return receiver_func(sender, **kwargs)
+    return wrapper
+
+
+@receiver(post_save, sender=User)
+def link_role_profile(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the profile's user_link in step with user_role / user_role_id."""
+    # 1. Nothing to do when the save did not touch the role fields
+    if update_fields is not None and not {'user_role', 'user_role_id'} & set(update_fields):
+        return
+
+    profile_model = ROLE_PROFILE_MODELS.get(instance.user_role)
+
+    # 2. Drop links left over from a previous role / id
+    if not created:
+        for model in ROLE_PROFILE_MODELS.values():
+            stale = model.objects.filter(user_link=instance)
+            if model is profile_model:
+                stale = stale.exclude(pk=instance.user_role_id)
+            stale.update(user_link=None)
+
+    # 3. Point the current profile at this account
+    if profile_model is not None and instance.user_role_id is not None:
+        profile_model.objects.filter(pk=instance.user_role_id).exclude(
+            user_link=instance
+        ).update(user_link=instance)
+
+
+# model -> (dashboard metric, path to the willaya, datetime field bucketed per day)
+COUNTED_MODELS = {
+    Patient: ('patients', 'patient_willaya', None),
+    Doctor: ('doctors', 'doctor_willaya', None),
+    Appointment: ('appointments', 'apointment_doc__doctor_willaya', 'apointment_date'),
+    MessageDoc: ('doctor_messages', 'message_sender__doctor_willaya', 'message_date'),
+    MessagePat: ('patient_messages', 'message_sender__patient_willaya', 'message_date'),
+}
+
+
+def _willaya_of(instance, path, seen=None):
+    relation, _, field_name = path.partition('__')
+    if not field_name:
+        return getattr(instance, relation)
+
+    # Reuse the related row when it is already loaded, otherwise fetch just the one column
+    field = instance._meta.get_field(relation)
+    if field.is_cached(instance):
+        return getattr(getattr(instance, relation), field_name)
+    key = (field.related_model, getattr(instance, field.attname))
+    if seen is not None and key in seen:
+        return seen[key]
+    willaya = field.related_model.objects.filter(pk=key[1]).values_list(field_name, flat=True).first()
+    if seen is not None:
+        seen[key] = willaya
+    return willaya
+
+
+def _counter_key(instance, seen=None):
+    metric, willaya_path, day_field = COUNTED_MODELS[type(instance)]
+    day = counters.day_of(getattr(instance, day_field)) if day_field else None
+    return metric, _willaya_of(instance, willaya_path, seen), day
+
+
+def _row_willaya(instance):
+    """Willaya of a counted row; for a deleted one, as taken before the delete."""
+    deleted_key = instance.__dict__.get('_dashboard_deleted_key')
+    if deleted_key is not None:
+        return deleted_key[1]
+    return _willaya_of(instance, COUNTED_MODELS[type(instance)][1])
+
+
+@receiver(pre_save)
+@unless_muted
+def remember_counter_key(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Load the bucket a row was counted in before an update can move it."""
+    spec = COUNTED_MODELS.get(sender)
+    if spec is None or raw or instance._state.adding:
+        return
+
+    metric, willaya_path, day_field = spec
+    watched = {sender._meta.get_field(willaya_path.split('__')[0]).attname, day_field}
+    if update_fields is not None and not watched & set(update_fields):
+        return
+
+    old = sender.objects.filter(pk=instance.pk).values_list(willaya_path, day_field or 'pk').first()
+    if old is not None:
+        instance._dashboard_counter_key = (metric, old[0], counters.day_of(old[1]) if day_field else None)
+
+
+@receiver(post_save)
+@unless_muted
+def count_saved_row(sender, instance, created, raw=False, **kwargs):
+    if sender not in COUNTED_MODELS or raw:
+        return
+
+    if created:
+        counters.bump(*_counter_key(instance), delta=1)
+        return
+
+    # An update only matters when it moved the row to another willaya or day
+    old_key = instance.__dict__.pop('_dashboard_counter_key', None)
+    if old_key is None:
+        return
+    new_key = _counter_key(instance)
+    if new_key != old_key:
+        counters.bump(*old_key, delta=-1)
+        counters.bump(*new_key, delta=1)
+
+
+@receiver(pre_delete)
+@unless_muted
+def remember_deleted_counter_key(sender, instance, origin=None, **kwargs):
+    """Load the bucket of a row about to be deleted, once per parent for a whole cascade."""
+    if sender not in COUNTED_MODELS:
+        return
+    # Rows deleted together share a few parents (a doctor and all their
+    # appointments and messages): their willaya is kept on the delete's origin
+    seen = origin.__dict__.setdefault('_dashboard_willayas', {}) if origin is not None else None
+    instance._dashboard_deleted_key = _counter_key(instance, seen)
+
+
+@receiver(post_delete)
+@unless_muted
+def count_deleted_row(sender, instance, **kwargs):
+    if sender in COUNTED_MODELS:
+        counters.bump(*instance.__dict__.get('_dashboard_deleted_key') or _counter_key(instance), delta=-1)
+
+
+# ==========================================
+# AVAILABILITY CACHE
+# ==========================================
+
+# Appointment fields that decide which doctor-day a booking blocks
+SLOT_FIELDS = {'apointment_doc', 'apointment_doc_id', 'apointment_date', 'apointment_service', 'apointment_service_id'}
+
+
+@receiver(pre_save, sender=Appointment)
+@unless_muted
+def forget_old_slot(sender, instance, raw=False, update_fields=None, **kwargs):
+    """An appointment moved to another doctor or time frees its old day too."""
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not SLOT_FIELDS & set(update_fields):
+        return
+    old = sender.objects.filter(pk=instance.pk).values_list('apointment_doc_id', 'apointment_date').first()
+    if old is not None:
+        availability.invalidate(*old)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@unless_muted
+def forget_new_slot(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not SLOT_FIELDS & set(update_fields):
+        return
+    availability.invalidate(instance.apointment_doc_id, instance.apointment_date)
+
+
+# ==========================================
+# PUBLIC DIRECTORY CACHE
+# ==========================================
+
+# User columns that never show up in the directory
+PRIVATE_USER_FIELDS = {'password', 'last_login'}
+
+
+@receiver(post_save, sender=Speciality)
+@receiver(post_delete, sender=Speciality)
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def refresh_directory(sender, raw=False, **kwargs):
+    if not raw:
+        directory.bump()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_directory_for_doctor(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Only doctors' accounts are listed; logins and password changes do not count."""
+    if raw or instance.user_role != 'doctor':
+        return
+    if update_fields is not None and set(update_fields) <= PRIVATE_USER_FIELDS:
+        return
+    directory.bump()
+
+
+# ==========================================
+# VERSION STAMPS FOR CONDITIONAL GETs
+# ==========================================
+# Inboxes are stamped per willaya; sender profile changes (name, willaya)
+# can move or relabel messages in any inbox, so they touch every inbox.
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def stamp_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    scopes = [('user', instance.pk)]
+    if instance.user_role in ('doctor', 'patient'):
+        scopes.append(('inbox', '*'))
+    versions.touch(*scopes)
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def stamp_doctor(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.touch(('doctor', instance.pk), ('inbox', '*'))
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def stamp_patient(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.touch(('patient', instance.pk), ('inbox', '*'))
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def stamp_services(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.touch(('services', instance.doc_id))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@unless_muted
+def stamp_appointments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.touch(('appointments', instance.apointment_pat_id))
+
+
+@receiver(post_save, sender=MessageDoc)
+@receiver(post_delete, sender=MessageDoc)
+@receiver(post_save, sender=MessagePat)
+@receiver(post_delete, sender=MessagePat)
+def stamp_inbox(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.touch(('inbox', _row_willaya(instance)))
+
+
+# ==========================================
+# EVENT STREAM
+# ==========================================
+# Message events go to the sender's willaya, appointment events to the
+# doctor's agenda (see sharedapp.events).
+
+MESSAGE_TYPES = {MessageDoc: 'doctor', MessagePat: 'patient'}
+
+
+def _action(kwargs):
+    if 'created' not in kwargs:
+        return 'deleted'
+    return 'created' if kwargs['created'] else 'updated'
+
+
+@receiver(post_save, sender=MessageDoc)
+@receiver(post_delete, sender=MessageDoc)
+@receiver(post_save, sender=MessagePat)
+@receiver(post_delete, sender=MessagePat)
+def announce_message(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    willaya = _row_willaya(instance)
+    events.publish(
+        events.willaya_channel(willaya), 'messages', _action(kwargs), [instance.pk],
+        message_type=MESSAGE_TYPES[sender],
+    )
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@unless_muted
+def announce_appointment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        events.publish(events.doctor_channel(instance.apointment_doc_id), 'appointments', _action(kwargs), [instance.pk])
+
+
+# ==========================================
+# ROLE PROFILE CACHE
+# ==========================================
+# Cached profiles carry their account (user_link), so account writes count too.
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+@receiver(post_save, sender=Leader)
+@receiver(post_delete, sender=Leader)
+def forget_profile(sender, instance, raw=False, **kwargs):
+    if not raw:
+        profiles.forget(PROFILE_ROLES[sender], instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_account_profile(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    profiles.forget(instance.user_role, instance.user_role_id)
+
+
+# ==========================================
+# TOKEN REVOCATION
+# ==========================================
+# Access tokens carry the role claims and are no longer checked against the
+# User row, so anything that should end a session revokes its tokens.
+
+# User columns a live token must not outlast
+SECURITY_FIELDS = ('password', 'is_active', 'user_role', 'user_role_id')
+
+
+@receiver(pre_save, sender=User)
+def remember_security_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._security_changed = False
+    if raw or instance._state.adding:
+        return
+    fields = [f for f in SECURITY_FIELDS if update_fields is None or f in update_fields]
+    if not fields:
+        return
+    old = User.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._security_changed = old is not None and any(
+        old[f] != getattr(instance, f) for f in fields
+    )
+
+
+def _revoke_on_commit(user_id):
+    transaction.on_commit(lambda: authentication.revoke_user(user_id))
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_user(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created and instance._security_changed:
+        _revoke_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user(sender, instance, **kwargs):
+    _revoke_on_commit(instance.pk)
@@ -1,3 +1,1564 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    authentication, availability, counters, deployment, directory, downloads, events, filestore, quotas, thumbnails,
+    uploads,
+)
+from .serializers import LOGIN_FAILED, MyTokenObtainPairSerializer
+from .throttling import LoginThrottle
+from .availability import BookedIntervals
+from .filestore import get_store
+from .pagination import KeysetPaginator, encode_cursor
+from .models import (
+    User, Speciality, Doctor, Patient, Leader,
+    Service, Appointment, Ordonance, MessageDoc, MessagePat, UploadSession, DashboardCounter, AgendaDay
+)
+
+BLOB_COLUMNS = ('doctor_pic', 'patient_pic', 'ordonance_file', 'message_pic')
+
+
+def create_world():
+    """One doctor, patient and leader in the same willaya, with a bit of history."""
+    # Cached directory and agenda entries would outlive the rolled back rows of the previous test
+    cache.clear()
+    speciality = Speciality.objects.create(speciality_name='Cardiology')
+    doctor = Doctor.objects.create(
+        doctor_phone=555, doctor_address='1 rue A', doctor_willaya='Alger', doctor_pic=b'doctor-bytes',
+        doctor_cotas=10, doctor_speciality=speciality, doctor_leftcotas=10,
+    )
+    patient = Patient.objects.create(
+        patient_companyid=42, patient_datebirth=datetime.date(1990, 1, 1), patient_leftcotas=5,
+        patient_address='2 rue B', patient_phone=666, patient_pic=b'patient-bytes', patient_willaya='Alger',
+    )
+    leader = Leader.objects.create(admin_willaya='Alger')
+    users = {
+        'doctor': User.objects.create(username='doc', user_role='doctor', user_role_id=doctor.doctor_id),
+        'patient': User.objects.create(username='pat', user_role='patient', user_role_id=patient.patient_id),
+        'admin': User.objects.create(username='lead', user_role='admin', user_role_id=leader.admin_id),
+    }
+    service = Service.objects.create(
+        service_name='Consultation', service_duration=datetime.time(0, 30), service_price=1000,
+        service_description='First visit', doc=doctor,
+    )
+    for status in (False, True):
+        appointment = Appointment.objects.create(
+            apointment_doc=doctor, apointment_service=service, apointment_pat=patient,
+            apointment_date=timezone.now(), apointment_status=status, apointment_comment='',
+        )
+        Ordonance.objects.create(
+            ordonance_apointment=appointment, ordonance_file=b'%PDF-bytes', ordonance_description='Rx',
+        )
+    MessageDoc.objects.create(message_title='Hi', message_text='...', message_sender=doctor)
+    MessagePat.objects.create(message_title='Hi', message_text='...', message_sender=patient, message_pic=b'pic')
+    return speciality, doctor, users
+
+
+def walk_pages(client, url, page_size, **params):
+    """Every page of a cursor-paginated endpoint, following next_cursor to the end."""
+    pages, cursor = [], None
+    while True:
+        response = client.get(url, {**params, 'page_size': page_size, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200, response.content
+        body = response.json()
+        pages.append(body['results'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return pages
+        assert len(pages) < 100, "next_cursor never ran out"
+
+
+class BlobColumnsStayOutOfListQueriesTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+
+    def assertNoBlobColumns(self, role, url):
+        client = APIClient()
+        client.force_authenticate(self.users[role])
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, f"{url}: {response.content!r}")
+        for query in queries.captured_queries:
+            for column in BLOB_COLUMNS:
+                self.assertNotIn(f'"{column}"', query['sql'], f"{url} selected {column}")
+
+    def test_leader_list_endpoints(self):
+        for url in (
+            '/leader/getDoctorMessages', '/leader/getPatientMessages', '/leader/getInbox',
+            '/leader/getDoctorList', '/leader/getPatientList', '/leader/getInterface',
+        ):
+            self.assertNoBlobColumns('admin', url)
+
+    def test_doctor_list_endpoints(self):
+        for url in ('/doctor/getTodayPatients', '/doctor/getAgenda?range=week', '/doctor/getPatients',
+                    '/doctor/getPatientPanel?sort=-last_visit', '/doctor/getServices'):
+            self.assertNoBlobColumns('doctor', url)
+
+    def test_patient_list_endpoints(self):
+        for url in (
+            '/patient/getOrdonance', '/patient/getHistory', '/patient/getAppointments',
+            '/patient/specialities/', f'/patient/speciality/{self.speciality.speciality_id}/doctors/',
+            f'/patient/doct/{self.doctor.doctor_id}/services/',
+        ):
+            self.assertNoBlobColumns('patient', url)
+
+    def test_blobs_load_on_demand(self):
+        self.assertEqual(bytes(Doctor.objects.get().doctor_pic), b'doctor-bytes')
+        with CaptureQueriesContext(connection) as queries:
+            ordonance = Ordonance.objects.with_blobs().first()
+            self.assertEqual(bytes(ordonance.ordonance_file), b'%PDF-bytes')
+        self.assertEqual(len(queries), 1)
+
+
+class QuotaReservationUnderContentionTest(TransactionTestCase):
+    """Many patients book the same doctor at once through the view; the quota must come out exact.
+
+    The concurrent tests need row locks (PostgreSQL): SQLite has a single
+    writer, so it would only show the bookings going through one by one.
+    """
+    THREADS = 16
+    BOOKINGS_PER_THREAD = 5
+    DOCTOR_QUOTA = 50
+
+    def setUp(self):
+        self.speciality = Speciality.objects.create(speciality_name='Cardiology')
+        self.doctor, self.service = self.make_doctor(555)
+        self.patients = []
+        self.users = []
+        for i in range(self.THREADS):
+            patient = Patient.objects.create(
+                patient_companyid=i, patient_datebirth=datetime.date(1990, 1, 1), patient_leftcotas=100,
+                patient_address='2 rue B', patient_phone=i, patient_pic=b'', patient_willaya='Alger',
+            )
+            self.patients.append(patient)
+            self.users.append(User.objects.create(
+                username=f'pat{i}', user_role='patient', user_role_id=patient.patient_id))
+        self.start = timezone.now().replace(microsecond=0) + datetime.timedelta(days=1)
+
+    def make_doctor(self, phone):
+        doctor = Doctor.objects.create(
+            doctor_phone=phone, doctor_address='1 rue A', doctor_willaya='Alger', doctor_cotas=self.DOCTOR_QUOTA,
+            doctor_speciality=self.speciality, doctor_leftcotas=self.DOCTOR_QUOTA,
+        )
+        service = Service.objects.create(
+            service_name='Consultation', service_duration=datetime.time(0, 30), service_price=1000,
+            service_description='First visit', doc=doctor,
+        )
+        return doctor, service
+
+    def book(self, user, start, doctor=None, service=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/patient/ManageAppointment', {
+            'apointment_doc': (doctor or self.doctor).doctor_id,
+            'apointment_service': (service or self.service).service_id,
+            'apointment_date': start.isoformat(), 'apointment_comment': 'Checkup',
+        }, format='json')
+
+    def hammer(self):
+        barrier = threading.Barrier(self.THREADS)
+        booked = []
+        errors = []
+
+        def run(index, user):
+            try:
+                barrier.wait()
+                for n in range(self.BOOKINGS_PER_THREAD):
+                    # Every booking gets its own half hour: only the quota can refuse one
+                    start = self.start + datetime.timedelta(minutes=30 * (index * self.BOOKINGS_PER_THREAD + n))
+                    response = self.book(user, start)
+                    if response.status_code == 201:
+                        booked.append(user.user_role_id)
+                    elif 'no quotas left' not in response.json().get('error', ''):
+                        errors.append(response.json())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(i, user)) for i, user in enumerate(self.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return booked
+
+    def assertQuotaExact(self, booked):
+        self.assertEqual(len(booked), self.DOCTOR_QUOTA)
+        self.assertEqual(quotas.remaining(self.doctor.doctor_id), 0)
+        self.assertEqual(Appointment.objects.filter(apointment_doc=self.doctor).count(), self.DOCTOR_QUOTA)
+        for patient in self.patients:
+            patient.refresh_from_db()
+            self.assertEqual(patient.patient_leftcotas, 100 - booked.count(patient.patient_id))
+
+    @skipUnlessDBFeature('has_select_for_update', 'has_select_for_update_skip_locked')
+    def test_single_counter(self):
+        self.assertQuotaExact(self.hammer())
+
+    @skipUnlessDBFeature('has_select_for_update', 'has_select_for_update_skip_locked')
+    def test_spread_over_slots(self):
+        quotas.spread(self.doctor.doctor_id, 4)
+        self.assertQuotaExact(self.hammer())
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_other_doctors_are_not_held_up(self):
+        other, other_service = self.make_doctor(556)
+        held, release = threading.Event(), threading.Event()
+        errors = []
+
+        def hold():
+            # A booking of self.doctor stopped right before its commit: its quota and day stay locked
+            try:
+                with transaction.atomic():
+                    quotas.reserve(self.doctor.doctor_id, self.patients[0].patient_id)
+                    availability.ensure_free(self.doctor.doctor_id, self.start, self.service.service_duration)
+                    held.set()
+                    release.wait(10)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        outcomes = {}
+
+        def book(name, doctor, service, start):
+            try:
+                outcomes[name] = self.book(self.users[1], start, doctor, service).status_code
+            finally:
+                connections.close_all()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.assertTrue(held.wait(10))
+        later = self.start + datetime.timedelta(hours=2)
+        same = threading.Thread(target=book, args=('same', self.doctor, self.service, later))
+        other_doctor = threading.Thread(target=book, args=('other', other, other_service, self.start))
+        same.start()
+        other_doctor.start()
+
+        # Another doctor's booking, at the very same time, goes through while the first one is held
+        other_doctor.join(5)
+        self.assertFalse(other_doctor.is_alive())
+        self.assertEqual(outcomes.get('other'), 201)
+        # The same doctor's booking waits for it
+        same.join(0.5)
+        self.assertTrue(same.is_alive())
+
+        release.set()
+        holder.join()
+        same.join(10)
+        self.assertEqual(errors, [])
+        self.assertEqual(outcomes.get('same'), 201)
+        self.assertEqual(quotas.remaining(self.doctor.doctor_id), self.DOCTOR_QUOTA - 2)
+        self.assertEqual(quotas.remaining(other.doctor_id), self.DOCTOR_QUOTA - 1)
+
+    def test_refund_after_spreading(self):
+        quotas.spread(self.doctor.doctor_id, 4)
+        quotas.reserve(self.doctor.doctor_id, self.patients[0].patient_id)
+        quotas.refund(self.doctor.doctor_id, self.patients[0].patient_id)
+        quotas.collect(self.doctor.doctor_id)
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.doctor_leftcotas, self.DOCTOR_QUOTA)
+
+
+class OverlappingBookingsTest(TransactionTestCase):
+    """Two patients book overlapping times with a doctor whose quota lives in slots."""
+
+    def setUp(self):
+        speciality = Speciality.objects.create(speciality_name='Cardiology')
+        self.doctor = Doctor.objects.create(
+            doctor_phone=555, doctor_address='1 rue A', doctor_willaya='Alger', doctor_cotas=10,
+            doctor_speciality=speciality, doctor_leftcotas=10,
+        )
+        self.service = Service.objects.create(
+            service_name='Consultation', service_duration=datetime.time(0, 30), service_price=1000,
+            service_description='First visit', doc=self.doctor,
+        )
+        self.patients = []
+        for i in range(2):
+            patient = Patient.objects.create(
+                patient_companyid=i, patient_datebirth=datetime.date(1990, 1, 1), patient_leftcotas=5,
+                patient_address='2 rue B', patient_phone=i, patient_pic=b'', patient_willaya='Alger',
+            )
+            self.patients.append(User.objects.create(
+                username=f'pat{i}', user_role='patient', user_role_id=patient.patient_id))
+        # Two slots: each booking can take its quota without touching the doctor row
+        quotas.spread(self.doctor.doctor_id, 2)
+
+    def book(self, user, start):
+        """Status and error of a ManageAppointment.post, retried while SQLite refuses a second writer."""
+        client = APIClient()
+        client.force_authenticate(user)
+        while True:
+            response = client.post('/patient/ManageAppointment', {
+                'apointment_doc': self.doctor.doctor_id, 'apointment_service': self.service.service_id,
+                'apointment_date': start.isoformat(), 'apointment_comment': 'Checkup',
+            }, format='json')
+            error = str(response.json().get('error', response.json())) if response.status_code != 201 else ''
+            if connection.vendor == 'sqlite' and 'locked' in error:
+                continue
+            return response.status_code, error
+
+    def test_only_one_of_two_overlapping_bookings_commits(self):
+        start = timezone.now().replace(microsecond=0) + datetime.timedelta(days=1)
+        barrier = threading.Barrier(2)
+        outcomes, errors = [], []
+
+        def run(user, start):
+            try:
+                barrier.wait()
+                status, error = self.book(user, start)
+                outcomes.append({201: 'booked', 409: 'taken'}.get(status, error))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=run, args=(self.patients[0], start)),
+            threading.Thread(target=run, args=(self.patients[1], start + datetime.timedelta(minutes=15))),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(outcomes), ['booked', 'taken'])
+        self.assertEqual(Appointment.objects.filter(apointment_doc=self.doctor).count(), 1)
+        # The refused booking gave its quota back with its rollback
+        self.assertEqual(quotas.remaining(self.doctor.doctor_id), 9)
+        # Both waited on the doctor's day, not on the doctor row
+        self.assertEqual(AgendaDay.objects.filter(day_doctor=self.doctor).count(), 1)
+
+
+class AppointmentSlotsTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.service = Service.objects.get()
+        self.day = timezone.localdate() + datetime.timedelta(days=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['patient'])
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(datetime.datetime.combine(self.day, datetime.time(hour, minute)))
+
+    def book(self, start):
+        # TestCase never commits; run the cache invalidation hooks by hand
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/patient/ManageAppointment', {
+                'apointment_doc': self.doctor.doctor_id, 'apointment_service': self.service.service_id,
+                'apointment_date': start.isoformat(), 'apointment_comment': 'Checkup',
+            }, format='json')
+
+    def free_slots(self):
+        response = self.client.get(
+            f'/patient/doct/{self.doctor.doctor_id}/services/{self.service.service_id}/slots',
+            {'from': self.day.isoformat(), 'to': self.day.isoformat()},
+        )
+        self.assertEqual(response.status_code, 200)
+        return [datetime.datetime.fromisoformat(start) for start in response.json()['days'][0]['slots']]
+
+    def test_overlapping_booking_is_rejected(self):
+        self.assertEqual(self.book(self.at(9)).status_code, 201)
+        self.assertEqual(self.book(self.at(9, 15)).status_code, 409)
+        self.assertEqual(self.book(self.at(8, 45)).status_code, 409)
+        # Back to back is fine
+        self.assertEqual(self.book(self.at(9, 30)).status_code, 201)
+
+    def test_free_slots_follow_bookings(self):
+        self.assertIn(self.at(9), self.free_slots())
+        self.book(self.at(9))
+        slots = self.free_slots()
+        self.assertNotIn(self.at(8, 45), slots)
+        self.assertNotIn(self.at(9, 15), slots)
+        self.assertIn(self.at(8, 30), slots)
+        self.assertIn(self.at(9, 30), slots)
+
+    def test_intervals_bisect(self):
+        booked = BookedIntervals([(self.at(10), self.at(11)), (self.at(9), self.at(9, 30))])
+        self.assertFalse(booked.conflicts(self.at(9, 30), self.at(10)))
+        self.assertTrue(booked.conflicts(self.at(10, 59), self.at(11, 30)))
+        self.assertTrue(booked.conflicts(self.at(8), self.at(12)))
+
+
+class AgendaTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['doctor'])
+
+    def test_other_roles_are_turned_away(self):
+        # The patient's role id is the doctor's id too: only the role keeps them apart
+        self.assertEqual(self.users['patient'].user_role_id, self.doctor.doctor_id)
+        for role in ('patient', 'admin'):
+            self.client.force_authenticate(self.users[role])
+            self.assertEqual(self.client.get('/doctor/getAgenda').status_code, 403)
+
+    def test_periods(self):
+        today = timezone.localdate()
+        response = self.client.get('/doctor/getAgenda')
+        self.assertEqual((response.json()['from'], response.json()['to']), (str(today), str(today)))
+        self.assertEqual(len(response.json()['appointments']), 2)
+        self.assertEqual(response.json()['appointments'][0]['patient']['username'], 'pat')
+
+        response = self.client.get('/doctor/getAgenda?range=week')
+        self.assertEqual(response.json()['to'], str(today + datetime.timedelta(days=6)))
+
+        response = self.client.get('/doctor/getAgenda?from=2026-01-01&to=2026-01-31')
+        self.assertEqual((response.json()['from'], response.json()['to']), ('2026-01-01', '2026-01-31'))
+        self.assertEqual(response.json()['appointments'], [])
+        response = self.client.get('/doctor/getAgenda?from=2026-01-05')
+        self.assertEqual(response.json()['to'], '2026-01-05')
+
+    def test_bad_periods_are_rejected(self):
+        for query in ('range=month', 'from=2026-01-01&to=2026-02-01', 'from=2026-01-02&to=2026-01-01',
+                      'from=yesterday'):
+            with self.subTest(query):
+                self.assertEqual(self.client.get(f'/doctor/getAgenda?{query}').status_code, 400)
+
+
+class PatientPanelTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        service = Service.objects.get()
+        self.visited = Patient.objects.get()
+        self.patients = {}
+        for name, willaya, days_ago in [('old', 'Alger', 30), ('new1', 'Alger', None), ('recent', 'Alger', 2),
+                                         ('new2', 'Alger', None), ('far', 'Oran', 1)]:
+            patient = Patient.objects.create(
+                patient_companyid=1, patient_datebirth=datetime.date(1990, 1, 1), patient_leftcotas=5,
+                patient_address='x', patient_phone=1, patient_willaya=willaya,
+            )
+            User.objects.create(username=name, user_role='patient', user_role_id=patient.patient_id)
+            if days_ago is not None:
+                Appointment.objects.create(
+                    apointment_doc=self.doctor, apointment_service=service, apointment_pat=patient,
+                    apointment_date=timezone.now() - datetime.timedelta(days=days_ago),
+                    apointment_status=True, apointment_comment='',
+                )
+            self.patients[name] = patient.patient_id
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['doctor'])
+
+    def panel(self, **params):
+        pages = walk_pages(self.client, '/doctor/getPatientPanel', 2, **params)
+        self.assertTrue(all(len(page) == 2 for page in pages[:-1]))
+        return [entry['username'] for page in pages for entry in page]
+
+    def test_sorts_walk_every_page(self):
+        self.assertEqual(self.panel(), ['pat', 'old', 'new1', 'recent', 'new2'])
+        # Patients never visited tie on last_visit: patient_id decides
+        self.assertEqual(self.panel(sort='last_visit'), ['new1', 'new2', 'old', 'recent', 'pat'])
+        self.assertEqual(self.panel(sort='-last_visit'), ['pat', 'recent', 'old', 'new2', 'new1'])
+
+    def test_search_and_status(self):
+        self.assertEqual(self.panel(search='new'), ['new1', 'new2'])
+        entries = self.client.get('/doctor/getPatientPanel', {'sort': 'last_visit', 'page_size': 3}).json()['results']
+        self.assertEqual([entry['last_visit_date'] is None for entry in entries], [True, True, False])
+
+    def test_bad_sort_or_cursor(self):
+        self.assertEqual(self.client.get('/doctor/getPatientPanel', {'sort': 'name'}).status_code, 400)
+        for cursor in (encode_cursor(['yesterday', 1]), encode_cursor([1])):
+            response = self.client.get('/doctor/getPatientPanel', {'sort': 'last_visit', 'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_full_list(self):
+        rows = self.client.get('/doctor/getPatients').json()
+        self.assertEqual([row['username'] for row in rows], ['pat', 'old', 'new1', 'recent', 'new2'])
+        self.assertEqual([row['last_visit_date'] == 'null' for row in rows], [False, False, True, False, True])
+
+
+class DirectoryCacheTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.client = APIClient()
+
+    def doctors(self):
+        return self.client.get(f'/patient/speciality/{self.speciality.pk}/doctors/').json()
+
+    def assertBumps(self, write):
+        before = directory.generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertGreater(directory.generation(), before)
+
+    def test_reads_are_served_from_the_cache(self):
+        self.client.get('/patient/specialities/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/patient/specialities/').json()[0]['speciality_name'], 'Cardiology')
+        self.assertEqual(len(queries), 0)
+
+    def test_speciality_write(self):
+        self.client.get('/patient/specialities/')
+        self.speciality.speciality_name = 'Cardiologie'
+        self.assertBumps(self.speciality.save)
+        self.assertEqual(self.client.get('/patient/specialities/').json()[0]['speciality_name'], 'Cardiologie')
+
+    def test_doctor_write(self):
+        self.doctors()
+        doctor = Doctor.objects.get(pk=self.doctor.pk)
+        doctor.doctor_address = '3 rue C'
+        self.assertBumps(doctor.save)
+        self.assertEqual(self.doctors()[0]['doctor_address'], '3 rue C')
+
+    def test_service_write(self):
+        url = f'/patient/doct/{self.doctor.pk}/services/'
+        self.assertEqual(len(self.client.get(url).json()), 1)
+        self.assertBumps(lambda: Service.objects.create(
+            service_name='Follow-up', service_duration=datetime.time(0, 15), service_price=500,
+            service_description='Again', doc=self.doctor,
+        ))
+        self.assertEqual(len(self.client.get(url).json()), 2)
+
+    def test_user_write(self):
+        self.doctors()
+        user = self.users['doctor']
+        user.first_name = 'Amina'
+        self.assertBumps(user.save)
+        self.assertEqual(self.doctors()[0]['first_name'], 'Amina')
+
+        # Private columns and other roles' accounts leave the directory alone
+        before = directory.generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            user.set_password('new')
+            user.save(update_fields=['password'])
+            self.users['patient'].save()
+        self.assertEqual(directory.generation(), before)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.patient = Patient.objects.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['admin'])
+
+    def test_ties_on_the_sort_key(self):
+        for i in range(6):
+            MessageDoc.objects.create(message_title=str(i), message_text='...', message_sender=self.doctor)
+        MessageDoc.objects.update(message_date=timezone.now())
+
+        paginator = KeysetPaginator(('-message_date', '-message_id'), page_size=2)
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginator.paginate(MessageDoc.objects.all(), cursor)
+            seen += [message.pk for message in page]
+            if cursor is None:
+                break
+        expected = list(MessageDoc.objects.order_by('-message_id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_tampered_cursors_are_rejected(self):
+        cursors = [
+            'not a cursor!',
+            encode_cursor(['2026-01-01T00:00:00+00:00']),
+            encode_cursor(['yesterday', 1]),
+            encode_cursor(['2026-01-01T00:00:00+00:00', 'one']),
+            encode_cursor([[1], 1]),
+            encode_cursor([None, 1]),
+            'eyJhIjoxfQ',  # {"a":1}
+        ]
+        token = MyTokenObtainPairSerializer.get_token(self.users['admin']).access_token
+        for url in ('/leader/getDoctorMessages', '/leader/getInbox', '/leader/async/getInbox'):
+            for cursor in cursors:
+                response = self.client.get(url, {'cursor': cursor}, headers={'Authorization': f'Bearer {token}'})
+                self.assertEqual(response.status_code, 400, (url, cursor))
+        response = self.client.get('/leader/getInbox', {'cursor': encode_cursor(['yesterday', 'doctor', 1])})
+        self.assertEqual(response.status_code, 400)
+
+    def test_merged_page_boundary_splits_the_two_tables(self):
+        start = timezone.now() - datetime.timedelta(hours=1)
+        for i in range(4):
+            MessageDoc.objects.create(message_title=f'd{i}', message_text='...', message_sender=self.doctor)
+            MessagePat.objects.create(message_title=f'p{i}', message_text='...', message_sender=self.patient)
+        # Interleaved, with doctor and patient messages of the same instant
+        for model in (MessageDoc, MessagePat):
+            for i, message in enumerate(model.objects.order_by('message_id')):
+                model.objects.filter(pk=message.pk).update(message_date=start + datetime.timedelta(minutes=i))
+
+        pages = walk_pages(self.client, '/leader/getInbox', 3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        entries = [(entry['message_type'], entry['message_info']['message_id']) for page in pages for entry in page]
+        self.assertEqual(len(set(entries)), 10)
+        self.assertEqual(entries[:4], [
+            ('patient', MessagePat.objects.order_by('-message_id')[0].pk),
+            ('doctor', MessageDoc.objects.order_by('-message_id')[0].pk),
+            ('patient', MessagePat.objects.order_by('-message_id')[1].pk),
+            ('doctor', MessageDoc.objects.order_by('-message_id')[1].pk),
+        ])
+        # The first page ends between the two rows of one instant
+        self.assertEqual(pages[0][-1]['message_type'], 'patient')
+        self.assertEqual(pages[1][0]['message_type'], 'doctor')
+
+
+class LeaderDirectoryTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        for i in range(4):
+            Doctor.objects.create(
+                doctor_phone=i, doctor_address='x', doctor_willaya='Oran' if i % 2 else 'Alger', doctor_cotas=1,
+                doctor_speciality=self.speciality, doctor_leftcotas=1,
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['admin'])
+
+    def test_only_leaders(self):
+        for url in ('/leader/getDoctorList', '/leader/getPatientList'):
+            self.assertEqual(APIClient().get(url).status_code, 401, url)
+            for role in ('doctor', 'patient'):
+                self.client.force_authenticate(self.users[role])
+                self.assertEqual(self.client.get(url).status_code, 403, (url, role))
+
+    def test_rows_carry_the_listed_fields_only(self):
+        doctor = self.client.get('/leader/getDoctorList').json()['results'][0]
+        self.assertEqual(list(doctor['doctor_info']), [
+            'doctor_id', 'doctor_phone', 'doctor_address', 'doctor_willaya',
+            'doctor_cotas', 'doctor_speciality', 'doctor_leftcotas',
+        ])
+        self.assertEqual(doctor['user_info']['username'], 'doc')
+        self.assertIn('thumbnails', doctor)
+        patient = self.client.get('/leader/getPatientList').json()['results'][0]
+        self.assertNotIn('user_link', patient['patient_info'])
+        self.assertNotIn('patient_pic_ref', patient['patient_info'])
+        self.assertEqual(patient['user_info']['username'], 'pat')
+
+    def test_pages(self):
+        pages = walk_pages(self.client, '/leader/getDoctorList', 2)
+        ids = [entry['doctor_info']['doctor_id'] for page in pages for entry in page]
+        self.assertEqual(ids, sorted(Doctor.objects.values_list('pk', flat=True)))
+        pages = walk_pages(self.client, '/leader/getDoctorList', 2, willaya='Oran')
+        self.assertEqual(sum(len(page) for page in pages), 2)
+
+
+class ConditionalGetTest(TestCase):
+    """Every stamped endpoint: 304 while nothing changed, a new ETag after a write."""
+
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.patient = Patient.objects.get()
+        self.client = APIClient()
+
+    def assertRevalidates(self, role, url, write):
+        self.client.force_authenticate(self.users[role])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, f"{url}: {response.content!r}")
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304, url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200, url)
+        self.assertNotEqual(response['ETag'], etag, url)
+
+    def new_message(self, model, sender):
+        return lambda: model.objects.create(message_title='New', message_text='...', message_sender=sender)
+
+    def test_doctor_endpoints(self):
+        self.assertRevalidates('doctor', '/doctor/getServices', lambda: Service.objects.create(
+            service_name='Follow-up', service_duration=datetime.time(0, 15), service_price=500,
+            service_description='Again', doc=self.doctor,
+        ))
+        self.assertRevalidates('doctor', '/doctor/getPersonalInfo', lambda: Doctor.objects.get(pk=self.doctor.pk).save())
+
+    def test_patient_endpoints(self):
+        self.assertRevalidates('patient', '/patient/getPersonalInfo', lambda: Patient.objects.get().save())
+        self.assertRevalidates('patient', '/patient/getHistory', lambda: Appointment.objects.filter(
+            apointment_status=False).get().save())
+        self.assertRevalidates('patient', '/patient/getAppointments', lambda: Appointment.objects.create(
+            apointment_doc=self.doctor, apointment_service=Service.objects.get(), apointment_pat=self.patient,
+            apointment_date=timezone.now() + datetime.timedelta(days=1), apointment_status=False,
+            apointment_comment='',
+        ))
+
+    def test_leader_endpoints(self):
+        self.assertRevalidates('admin', '/leader/getDoctorMessages', self.new_message(MessageDoc, self.doctor))
+        self.assertRevalidates('admin', '/leader/getPatientMessages', self.new_message(MessagePat, self.patient))
+
+        def mark_done():
+            message = MessagePat.objects.first()
+            message.message_status = True
+            message.save()
+        self.assertRevalidates('admin', '/leader/getInbox', mark_done)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_off_with_several_workers_on_a_local_cache(self):
+        self.client.force_authenticate(self.users['patient'])
+        response = self.client.get('/patient/getHistory')
+        self.assertNotIn('ETag', response)
+        self.assertEqual(self.client.get('/patient/getHistory', headers={'If-None-Match': '"x"'}).status_code, 200)
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = self.settings(FILESTORE_ROOT=root, THUMBNAIL_CACHE_ROOT=os.path.join(root, 'thumbs'))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def picture(self, color):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 300), color).save(buffer, 'PNG')
+        return get_store().save(buffer.getvalue())
+
+    def test_hits_and_misses_are_counted(self):
+        url = thumbnails.thumbnail_urls(self.picture('red'))['small']
+        client = APIClient()
+        self.assertEqual(client.get(url)['X-Thumbnail-Cache'], 'miss')
+        self.assertEqual(client.get(url)['X-Thumbnail-Cache'], 'hit')
+        client.force_authenticate(self.users['admin'])
+        self.assertEqual(client.get('/sharedapp/thumbs/stats').json(), {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_least_recently_used_thumbnails_are_evicted(self):
+        store = thumbnails.ThumbnailCache(os.path.join(get_store().root, 'lru'), max_bytes=10**9)
+        first, second, third = (self.picture(color) for color in ('red', 'green', 'blue'))
+        paths = {digest: store.get(digest, 'small')[0] for digest in (first, second)}
+        now = time.time()
+        os.utime(paths[first], (now - 100, now - 100))
+        os.utime(paths[second], (now - 50, now - 50))
+        # A hit makes the oldest one the most recently used
+        self.assertTrue(store.get(first, 'small')[1])
+
+        sizes = [path.stat().st_size for path in paths.values()]
+        store.max_bytes = sum(sizes) + min(sizes) // 2
+        third_path, _ = store.get(third, 'small')
+        self.assertTrue(paths[first].exists())
+        self.assertFalse(paths[second].exists())
+        self.assertTrue(third_path.exists())
+        self.assertEqual(thumbnails.stats()['evictions'], 1)
+
+    def test_urls_are_stable_then_expire(self):
+        digest = self.picture('red')
+        self.assertEqual(thumbnails.thumbnail_urls(digest), thumbnails.thumbnail_urls(digest))
+        with mock.patch('time.time', return_value=time.time() - settings.THUMBNAIL_URL_MAX_AGE - 1):
+            expired = thumbnails.thumbnail_urls(digest)['small']
+        self.assertEqual(APIClient().get(expired).status_code, 404)
+
+    def test_forged_tokens_are_rejected(self):
+        url = thumbnails.thumbnail_urls(self.picture('red'))['small']
+        self.assertEqual(APIClient().get(url.replace('/small/', '/small/x')).status_code, 404)
+
+
+class StoredFileTest(TestCase):
+    CONTENT = b'%PDF' + bytes(range(96))
+
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = self.settings(FILESTORE_ROOT=root, FILESTORE_SENDFILE_MODE='')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.ordonance = Ordonance.objects.first()
+        self.digest = filestore.attach(self.ordonance, 'ordonance_file', self.CONTENT)
+        self.url = f'/sharedapp/files/ordonance/{self.ordonance.pk}'
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['patient'])
+
+    def test_parse_range(self):
+        self.assertEqual(downloads._parse_range('bytes=10-19', 100), (10, 19))
+        self.assertEqual(downloads._parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(downloads._parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(downloads._parse_range('bytes=-500', 100), (0, 99))
+        self.assertEqual(downloads._parse_range('bytes=95-', 100), (95, 99))
+        # Malformed or multi-range: the whole file
+        for header in ('bytes=-', 'bytes=0-1,5-6', 'items=0-1', 'bytes=a-b'):
+            self.assertIsNone(downloads._parse_range(header, 100), header)
+        for header in ('bytes=100-', 'bytes=20-10', 'bytes=-0'):
+            with self.assertRaises(ValueError, msg=header):
+                downloads._parse_range(header, 100)
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['ETag'], f'"{self.digest}"')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_ranges(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=-5'})
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-5:])
+        response = self.client.get(self.url, headers={'Range': 'bytes=95-'})
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=100-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        # A range of an older version of the file is not honoured
+        response = self.client.get(self.url, headers={'Range': 'bytes=10-19', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_matching_etag_gives_304(self):
+        response = self.client.get(self.url, headers={'If-None-Match': f'"{self.digest}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{self.digest}"')
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': '"stale"'}).status_code, 200)
+
+    def test_who_may_download(self):
+        doctor, patient = self.users['doctor'].user_role_id, self.users['patient'].user_role_id
+        strangers = {
+            'doctor': User.objects.create(username='doc2', user_role='doctor', user_role_id=doctor + 1),
+            'patient': User.objects.create(username='pat2', user_role='patient', user_role_id=patient + 1),
+        }
+        expected = {
+            # kind: (pk, roles allowed among doctor, patient, admin, other doctor, other patient)
+            'doctor-picture': (doctor, {'doctor', 'patient', 'admin', 'doc2', 'pat2'}),
+            'patient-picture': (patient, {'doctor', 'patient', 'admin', 'doc2'}),
+            'ordonance': (self.ordonance.pk, {'doctor', 'patient', 'admin'}),
+            'message-picture': (MessagePat.objects.get().pk, {'patient', 'admin'}),
+        }
+        callers = {**self.users, 'doc2': strangers['doctor'], 'pat2': strangers['patient']}
+        for kind, (pk, allowed) in expected.items():
+            for name, user in callers.items():
+                self.client.force_authenticate(user)
+                response = self.client.get(f'/sharedapp/files/{kind}/{pk}')
+                self.assertEqual(response.status_code, 200 if name in allowed else 403, (kind, name))
+
+    def test_blobs_move_to_the_store_and_back(self):
+        migration = import_module('sharedapp.migrations.0008_move_blobs_to_filestore')
+        store = get_store()
+
+        migration.move_to_store(apps, None)
+        doctor = Doctor.objects.get(pk=self.doctor.pk)
+        self.assertFalse(doctor.doctor_pic)
+        with store.open(doctor.doctor_pic_ref) as stored:
+            self.assertEqual(stored.read(), b'doctor-bytes')
+        # Rows already in the store keep their file
+        self.assertEqual(Ordonance.objects.get(pk=self.ordonance.pk).ordonance_file_ref, self.digest)
+
+        migration.move_back_inline(apps, None)
+        doctor = Doctor.objects.get(pk=self.doctor.pk)
+        self.assertEqual((bytes(doctor.doctor_pic), doctor.doctor_pic_ref), (b'doctor-bytes', ''))
+        self.assertEqual(bytes(Ordonance.objects.get(pk=self.ordonance.pk).ordonance_file), self.CONTENT)
+
+    def test_sweep_removes_unreferenced_files(self):
+        store = get_store()
+        shared = filestore.attach(MessagePat.objects.get(), 'message_pic', self.CONTENT)
+        self.assertEqual(shared, self.digest)
+        replaced = filestore.attach(Doctor.objects.get(pk=self.doctor.pk), 'doctor_pic', b'old picture')
+        filestore.attach(Doctor.objects.get(pk=self.doctor.pk), 'doctor_pic', b'new picture')
+        recent = store.save(b'stored, not linked yet')
+        long_ago = time.time() - 7200
+        for digest, _ in store.stored():
+            if digest != recent:
+                os.utime(store.path(digest), (long_ago, long_ago))
+
+        self.assertEqual(filestore.sweep(3600, dry_run=True), [replaced])
+        self.assertTrue(store.exists(replaced))
+        self.assertEqual(filestore.sweep(3600), [replaced])
+        self.assertFalse(store.exists(replaced))
+        self.assertTrue(store.exists(recent))
+
+        # Still shared with the message after the ordonance is gone
+        self.ordonance.delete()
+        self.assertEqual(filestore.sweep(3600), [])
+        MessagePat.objects.all().delete()
+        out = io.StringIO()
+        call_command('sweep_filestore', '--hours', '1', stdout=out)
+        self.assertIn(self.digest, out.getvalue())
+        self.assertFalse(store.exists(self.digest))
+
+
+class ResumableUploadTest(TestCase):
+    DATA = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = self.settings(FILESTORE_ROOT=root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.ordonance = Ordonance.objects.first()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['doctor'])
+        response = self.client.post('/sharedapp/uploads/', {
+            'target': 'ordonance', 'target_id': self.ordonance.pk, 'size': len(self.DATA),
+            'sha256': hashlib.sha256(self.DATA).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        self.url = f"/sharedapp/uploads/{response.json()['upload_id']}"
+
+    def put(self, start, end, data=None, total=None):
+        data = self.DATA[start:end + 1] if data is None else data
+        return self.client.put(self.url, data, content_type='application/octet-stream', headers={
+            'Content-Range': f'bytes {start}-{end}/{len(self.DATA) if total is None else total}'})
+
+    def assertAttached(self):
+        self.ordonance.refresh_from_db()
+        self.assertEqual(self.ordonance.ordonance_file_ref, hashlib.sha256(self.DATA).hexdigest())
+
+    def test_resume_after_a_dropped_connection(self):
+        self.assertEqual(self.put(0, 499).json()['received'], 500)
+        self.assertEqual(self.client.get(self.url).json()['received'], 500)
+        response = self.put(500, len(self.DATA) - 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['completed'])
+        self.assertAttached()
+
+    def test_duplicate_chunk_is_refused_without_harm(self):
+        self.put(0, 499)
+        response = self.put(0, 499)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['received'], 500)
+        self.assertTrue(self.put(500, len(self.DATA) - 1).json()['completed'])
+        self.assertAttached()
+
+    def test_checksum_mismatch_restarts_the_upload(self):
+        response = self.put(0, len(self.DATA) - 1, data=bytes(len(self.DATA)))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['received'], 0)
+        self.assertTrue(self.put(0, len(self.DATA) - 1).json()['completed'])
+        self.assertAttached()
+
+    def test_concurrent_writers_of_one_chunk(self):
+        session = UploadSession.objects.get()
+        stale = UploadSession.objects.get()
+        uploads.write_chunk(session, 0, io.BytesIO(self.DATA[:500]), 500)
+        with self.assertRaises(uploads.UploadError) as raised:
+            uploads.write_chunk(stale, 0, io.BytesIO(self.DATA[:500]), 500)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(UploadSession.objects.get().upload_received, 500)
+
+    def test_announced_size_must_match(self):
+        response = self.put(0, 499, total=len(self.DATA) + 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['received'], 0)
+
+    def test_target_deleted_mid_upload(self):
+        self.put(0, 499)
+        Ordonance.objects.filter(pk=self.ordonance.pk).delete()
+        response = self.put(500, len(self.DATA) - 1)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class StatelessTokenTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.users['patient'].set_password('old-password')
+        self.users['patient'].save()
+        self.client = APIClient()
+
+    def authenticate(self, issued_ago=0):
+        token = MyTokenObtainPairSerializer.get_token(self.users['patient']).access_token
+        token.set_iat(at_time=timezone.now() - datetime.timedelta(seconds=issued_ago))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_requests_do_not_load_the_user(self):
+        self.authenticate()
+        for url in ('/patient/getHistory', '/patient/getAppointments'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            for query in queries.captured_queries:
+                self.assertNotIn('FROM "sharedapp_user"', query['sql'])
+
+    def test_logout_revokes_the_token(self):
+        self.authenticate()
+        self.assertEqual(self.client.get('/patient/getHistory').status_code, 200)
+        self.assertEqual(self.client.post('/sharedapp/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/patient/getHistory').status_code, 401)
+
+    def test_password_change_revokes_older_tokens(self):
+        self.authenticate(issued_ago=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users['patient'].set_password('new-password')
+            self.users['patient'].save()
+        self.assertEqual(self.client.get('/patient/getHistory').status_code, 401)
+        # A login after the change is fine
+        self.authenticate()
+        self.assertEqual(self.client.get('/patient/getHistory').status_code, 200)
+
+
+class PatientAppointmentListsTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.patient = Patient.objects.get()
+        self.service = Service.objects.get()
+        Appointment.objects.all().delete()
+        self.noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['patient'])
+
+    def book(self, days, completed, ordonances=(), patient=None):
+        """An appointment at noon, ``days`` from today; two bookings on one day tie on the date."""
+        appointment = Appointment.objects.create(
+            apointment_doc=self.doctor, apointment_service=self.service, apointment_pat=patient or self.patient,
+            apointment_date=self.noon + datetime.timedelta(days=days),
+            apointment_status=completed, apointment_comment='',
+        )
+        for description in ordonances:
+            Ordonance.objects.create(ordonance_apointment=appointment, ordonance_description=description)
+        return appointment
+
+    def test_ordonances_newest_first(self):
+        self.book(-10, True, ['a'])
+        self.book(-5, True, ['b1', 'b2'])
+        self.book(-5, True, ['c'])
+        self.book(-3, True)
+        other = Patient.objects.create(
+            patient_companyid=1, patient_datebirth=datetime.date(1990, 1, 1), patient_leftcotas=5,
+            patient_address='x', patient_phone=1, patient_willaya='Alger',
+        )
+        self.book(-1, True, ['not yours'], patient=other)
+
+        pages = walk_pages(self.client, '/patient/getOrdonance', 2)
+        self.assertEqual([len(page) for page in pages], [2, 1])
+        groups = [[o['ordonance_description'] for o in entry['ordonanceInfo']] for page in pages for entry in page]
+        # Same date: the later appointment id comes first
+        self.assertEqual(groups, [['c'], ['b1', 'b2'], ['a']])
+        first = pages[0][0]['ordonanceInfo'][0]
+        self.assertNotIn('ordonance_file', first)
+        self.assertEqual(first['file_url'], f"/sharedapp/files/ordonance/{first['ordonance_id']}")
+        self.assertEqual(pages[0][0]['doctorInfo'], 'doc')
+
+    def appointment_ids(self, url):
+        pages = walk_pages(self.client, url, 2)
+        self.assertTrue(all(len(page) == 2 for page in pages[:-1]))
+        return [entry['appointment']['apointment_id'] for page in pages for entry in page]
+
+    def test_history_newest_first(self):
+        oldest = self.book(-10, True)
+        tied = [self.book(-5, True), self.book(-5, True)]
+        newest = self.book(-1, True)
+        self.book(-2, False)
+        self.assertEqual(self.appointment_ids('/patient/getHistory'),
+                         [newest.pk, tied[1].pk, tied[0].pk, oldest.pk])
+        entry = self.client.get('/patient/getHistory').json()['results'][0]
+        self.assertEqual((entry['doctor_name'], entry['service_name']), ('doc', 'Consultation'))
+
+    def test_upcoming_soonest_first(self):
+        tied = [self.book(1, False), self.book(1, False)]
+        later = self.book(3, False)
+        self.book(-1, False)
+        self.book(2, True)
+        self.assertEqual(self.appointment_ids('/patient/getAppointments'), [tied[0].pk, tied[1].pk, later.pk])
+
+    def test_other_roles_are_turned_away(self):
+        self.client.force_authenticate(self.users['doctor'])
+        for url in ('/patient/getOrdonance', '/patient/getHistory', '/patient/getAppointments'):
+            self.assertEqual(self.client.get(url).status_code, 403, url)
+
+
+class RoleProfileTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.client = APIClient()
+
+    def test_profile_is_cached_until_written(self):
+        self.client.force_authenticate(self.users['doctor'])
+        self.assertEqual(self.client.get('/doctor/getPatients').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/doctor/getPatients').status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "doctor"' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor = Doctor.objects.get(pk=self.doctor.pk)
+            doctor.doctor_address = '3 rue C'
+            doctor.save()
+        response = self.client.get('/doctor/getPersonalInfo')
+        self.assertEqual(response.json()['profile1']['doctor_address'], '3 rue C')
+
+    def test_messages_are_sent_as_the_profile(self):
+        self.client.force_authenticate(self.users['patient'])
+        response = self.client.post('/patient/CreateMessagePat', {'message_title': 'Q', 'message_text': '?'})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(MessagePat.objects.latest('message_id').message_sender.user_link, self.users['patient'])
+
+    def test_other_roles_are_turned_away(self):
+        self.client.force_authenticate(self.users['patient'])
+        for url in ('/doctor/getPatients', '/leader/getInbox'):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class LoginTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.user = self.users['doctor']
+        self.user.set_password('secret')
+        self.user.save()
+        for buckets in LoginThrottle.buckets.values():
+            buckets._buckets.clear()
+        self.client = APIClient()
+
+    def login(self, password='secret', role_id=None):
+        return self.client.post('/sharedapp/login/', {
+            'username': 'doc', 'password': password, 'user_role': 'doctor',
+            'role_specific_id': role_id or self.doctor.doctor_id,
+        }, format='json')
+
+    def test_login_reads_the_account_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.json()['user_role_id'], self.doctor.doctor_id)
+
+    def test_failures_look_the_same(self):
+        for response in (self.login(password='wrong'), self.login(role_id=9999)):
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(LOGIN_FAILED, str(response.json()))
+
+    def test_login_rehashes_to_the_tuned_work_factor(self):
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertIn('$2000$', User.objects.get(pk=self.user.pk).password)
+
+    def test_account_bucket_runs_dry(self):
+        statuses = [self.login(password='wrong').status_code for _ in range(6)]
+        self.assertEqual(statuses, [400] * 5 + [429])
+
+
+class CounterReceiversTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.today = timezone.localdate()
+
+    def count(self, metric, willaya, day=None):
+        return sum(DashboardCounter.objects.filter(
+            counter_metric=metric, counter_willaya=willaya, counter_day=day).values_list('counter_value', flat=True))
+
+    def test_create(self):
+        self.assertEqual(self.count('appointments', 'Alger'), 2)
+        self.assertEqual(self.count('appointments', 'Alger', self.today), 2)
+        self.assertEqual(self.count('patient_messages', 'Alger', self.today), 1)
+        Patient.objects.create(
+            patient_companyid=1, patient_datebirth=datetime.date(1990, 1, 1), patient_leftcotas=5,
+            patient_address='x', patient_phone=1, patient_willaya='Oran',
+        )
+        self.assertEqual((self.count('patients', 'Alger'), self.count('patients', 'Oran')), (1, 1))
+
+    def test_status_flip_leaves_the_counters(self):
+        appointment = Appointment.objects.filter(apointment_status=False).get()
+        appointment.apointment_status = True
+        with CaptureQueriesContext(connection) as queries:
+            appointment.save(update_fields=['apointment_status'])
+        self.assertFalse([q for q in queries.captured_queries if 'dashboard_counter' in q['sql']])
+        appointment.save()
+        self.assertEqual(self.count('appointments', 'Alger', self.today), 2)
+
+    def test_willaya_and_date_moves(self):
+        patient = Patient.objects.get()
+        patient.patient_willaya = 'Oran'
+        patient.save()
+        self.assertEqual((self.count('patients', 'Alger'), self.count('patients', 'Oran')), (0, 1))
+
+        appointment = Appointment.objects.first()
+        appointment.apointment_date -= datetime.timedelta(days=3)
+        appointment.save()
+        earlier = self.today - datetime.timedelta(days=3)
+        self.assertEqual((self.count('appointments', 'Alger', self.today),
+                          self.count('appointments', 'Alger', earlier)), (1, 1))
+        self.assertEqual(self.count('appointments', 'Alger'), 2)
+
+        # Appointments follow their doctor's willaya
+        appointment.apointment_doc = Doctor.objects.create(
+            doctor_phone=1, doctor_address='x', doctor_willaya='Oran', doctor_cotas=1,
+            doctor_speciality=self.speciality, doctor_leftcotas=1,
+        )
+        appointment.save()
+        self.assertEqual((self.count('appointments', 'Alger'), self.count('appointments', 'Oran')), (1, 1))
+        self.assertEqual(self.count('appointments', 'Oran', earlier), 1)
+
+    def test_delete(self):
+        Appointment.objects.first().delete()
+        self.assertEqual(self.count('appointments', 'Alger', self.today), 1)
+
+    def test_seeding_migration(self):
+        migration = import_module('sharedapp.migrations.0004_dashboard_counter')
+        expected = counters.read_dashboard(self.today)
+        DashboardCounter.objects.all().delete()
+        migration.seed_counters(apps, None)
+        self.assertEqual(counters.read_dashboard(self.today), expected)
+        self.assertEqual(self.count('appointments', 'Alger', self.today), 2)
+
+    @override_settings(DASHBOARD_COUNTER_SHARDS=4)
+    def test_writers_spread_over_shards(self):
+        for _ in range(40):
+            MessageDoc.objects.create(message_title='Hi', message_text='...', message_sender=self.doctor)
+        shards = DashboardCounter.objects.filter(
+            counter_metric='doctor_messages', counter_willaya='Alger', counter_day__isnull=True)
+        self.assertGreater(shards.count(), 1)
+        self.assertEqual(self.count('doctor_messages', 'Alger'), 41)
+        totals, today = counters.read_dashboard(self.today)
+        self.assertEqual((totals['doctor_messages'], today['doctor_messages']), (41, 41))
+
+    def test_cascade_reads_each_parent_once(self):
+        for _ in range(3):
+            MessageDoc.objects.create(message_title='Hi', message_text='...', message_sender=self.doctor)
+        with CaptureQueriesContext(connection) as queries:
+            Doctor.objects.get(pk=self.doctor.pk).delete()
+        willaya_reads = [q for q in queries.captured_queries
+                         if q['sql'].startswith('SELECT "doctor"."doctor_willaya"')]
+        self.assertEqual(len(willaya_reads), 1)
+        for metric in ('doctors', 'appointments', 'doctor_messages'):
+            self.assertEqual(self.count(metric, 'Alger'), 0, metric)
+        self.assertEqual(self.count('patients', 'Alger'), 1)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, ONBOARDING_HASH_WORKERS=2, ONBOARDING_BATCH_SIZE=2)
+class ImportPatientsTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['admin'])
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = self.settings(FILESTORE_ROOT=root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def enqueue(self, name, content):
+        response = self.client.post('/leader/ImportPatients', {'file': SimpleUploadedFile(name, content)},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(response.json()['status'], 'queued')
+        return response.json()['status_url']
+
+    def test_rows_are_created_or_reported(self):
+        status_url = self.enqueue('company.csv', (
+            "username,email,patient_companyid,patient_datebirth,patient_address,patient_phone,patient_willaya\n"
+            "amina,a@x.dz,77,1985-03-02,3 rue C,111,Oran\n"
+            "pat,,77,1985-03-02,3 rue C,112,Oran\n"
+            "karim,,77,not-a-date,3 rue C,113,Oran\n"
+            "yacine,,77,1990-07-14,4 rue D,114,Oran\n"
+        ).encode())
+        # Nothing is hashed in the request: the worker does it
+        self.assertFalse(User.objects.filter(username='amina').exists())
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+
+        call_command('run_import_jobs', '--once', stdout=io.StringIO())
+        body = self.client.get(status_url).json()
+        self.assertEqual(body['status'], 'done')
+        self.assertEqual((body['created'], body['failed']), (2, 2))
+        self.assertEqual([row['status'] for row in body['rows']], ['created', 'error', 'error', 'created'])
+        self.assertIn('username', body['rows'][1]['errors'])
+        self.assertIn('patient_datebirth', body['rows'][2]['errors'])
+        self.assertEqual(list((get_store().root / 'imports').iterdir()), [])
+
+        user = User.objects.get(username='amina')
+        self.assertTrue(user.check_password('Pat@77'))
+        self.assertEqual(Patient.objects.get(pk=user.user_role_id).user_link, user)
+        totals, _ = counters.read_dashboard(timezone.localdate())
+        self.assertEqual(totals['patients'], 3)
+
+    def test_unreadable_file_fails_the_job(self):
+        status_url = self.enqueue('company.csv', b'')
+        call_command('run_import_jobs', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+        body = self.client.get(status_url).json()
+        self.assertEqual(body['status'], 'failed')
+        self.assertIn('header', body['error'])
+
+    def test_only_the_owner_sees_the_job(self):
+        status_url = self.enqueue('company.jsonl', b'{"username": "x"}\n')
+        other = User.objects.create(username='lead2', user_role='admin', user_role_id=self.users['admin'].user_role_id)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    def test_other_roles_cannot_import(self):
+        self.client.force_authenticate(self.users['doctor'])
+        jsonl = SimpleUploadedFile('company.jsonl', b'{"username": "x"}\n')
+        self.assertEqual(self.client.post('/leader/ImportPatients', {'file': jsonl}).status_code, 403)
+
+
+class ExportTableTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['admin'])
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        lines = self.download('/leader/export/appointments.csv?willaya=Alger').splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['apointment_id', 'apointment_date'])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('pat', lines[1])
+        self.assertEqual(self.download('/leader/export/appointments.csv?willaya=Oran').splitlines()[1:], [])
+
+    def test_jsonl_export_by_date(self):
+        today = timezone.localdate()
+        url = f'/leader/export/patient_messages.jsonl?from={today}&to={today}'
+        rows = [json.loads(line) for line in self.download(url).splitlines()]
+        self.assertEqual([row['patient_username'] for row in rows], ['pat'])
+        yesterday = today - datetime.timedelta(days=1)
+        self.assertEqual(self.download(f'/leader/export/patient_messages.jsonl?to={yesterday}'), '')
+
+    def test_bad_requests(self):
+        for url in ('/leader/export/users.csv', '/leader/export/patients.xml', '/leader/export/patients.csv?from=2026-01-01'):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+
+
+class BulkActionsTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.client = APIClient()
+
+    def test_mark_many_messages_done(self):
+        self.client.force_authenticate(self.users['admin'])
+        sender = MessageDoc.objects.get().message_sender
+        extra = MessageDoc.objects.create(message_title='Bis', message_text='...', message_sender=sender)
+        done = MessageDoc.objects.create(message_title='Old', message_text='...', message_sender=sender, message_status=True)
+        first = MessageDoc.objects.order_by('message_id').first()
+        ids = [first.message_id, extra.message_id, done.message_id, 9999]
+        response = self.client.patch('/leader/markAsDone/doctor', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([r['outcome'] for r in response.json()['results']], ['done', 'done', 'already_done', 'not_found'])
+        self.assertFalse(MessageDoc.objects.filter(message_status=False).exists())
+
+    def test_complete_and_cancel_many_appointments(self):
+        self.client.force_authenticate(self.users['doctor'])
+        pending, completed = Appointment.objects.order_by('apointment_status')
+        response = self.client.patch('/doctor/checkAppointments/complete',
+                                     {'ids': [pending.pk, completed.pk]}, format='json')
+        self.assertEqual([r['outcome'] for r in response.json()['results']], ['done', 'already_done'])
+
+        before = Patient.objects.get().patient_leftcotas, Doctor.objects.get().doctor_leftcotas
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/doctor/checkAppointments/cancel',
+                                         {'ids': [pending.pk, completed.pk, 9999]}, format='json')
+        self.assertEqual([r['outcome'] for r in response.json()['results']], ['done', 'done', 'not_found'])
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(Ordonance.objects.exists())
+        self.assertEqual(Patient.objects.get().patient_leftcotas, before[0] + 2)
+        self.assertEqual(Doctor.objects.get().doctor_leftcotas, before[1] + 2)
+        totals, _ = counters.read_dashboard(timezone.localdate())
+        self.assertEqual(totals['appointments'], 0)
+
+    def test_cancel_replaces_the_per_row_receivers(self):
+        self.client.force_authenticate(self.users['doctor'])
+        pending, completed = Appointment.objects.order_by('apointment_status')
+        with mock.patch.object(events, 'publish') as publish, \
+                mock.patch.object(availability, 'invalidate') as invalidate:
+            self.client.patch('/doctor/checkAppointments/cancel', {'ids': [pending.pk]}, format='json')
+        # One aggregated call each, none from the receivers of the deleted row
+        publish.assert_called_once_with(
+            events.doctor_channel(self.doctor.pk), 'appointments', 'deleted', [pending.pk])
+        invalidate.assert_called_once_with(self.doctor.pk, pending.apointment_date)
+        # The cascade went through the ORM
+        self.assertFalse(Ordonance.objects.filter(ordonance_apointment=pending.pk).exists())
+
+        # The receivers are only muted during the bulk delete
+        completed_id = completed.pk
+        with mock.patch.object(events, 'publish') as publish:
+            completed.delete()
+        publish.assert_called_once_with(
+            events.doctor_channel(self.doctor.pk), 'appointments', 'deleted', [completed_id])
+
+    def test_bad_id_lists(self):
+        self.client.force_authenticate(self.users['doctor'])
+        for body in ({}, {'ids': []}, {'ids': ['1']}, {'ids': list(range(1001))}):
+            response = self.client.patch('/doctor/checkAppointments/complete', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+
+
+class RecordingBroker(events.LocalBroker):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, channel, event):
+        self.published.append((channel, event['type'], event['action'], event['ids']))
+        super().publish(channel, event)
+
+
+@override_settings(EVENTS_BROKER='sharedapp.tests.RecordingBroker')
+class EventStreamTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        events.broker.cache_clear()
+        self.addCleanup(events.broker.cache_clear)
+        self.token = MyTokenObtainPairSerializer.get_token(self.users['doctor']).access_token
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+
+    def test_writes_are_announced(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = MessageDoc.objects.create(message_title='New', message_text='...', message_sender=self.doctor)
+        appointment = Appointment.objects.filter(apointment_status=False).get()
+        client = APIClient()
+        client.force_authenticate(self.users['doctor'])
+        with self.captureOnCommitCallbacks(execute=True):
+            client.patch('/doctor/checkAppointments/complete', {'ids': [appointment.pk]}, format='json')
+        self.assertEqual(events.broker().published, [
+            ('willaya:Alger', 'messages', 'created', [message.pk]),
+            (f'doctor:{self.doctor.pk}', 'appointments', 'updated', [appointment.pk]),
+        ])
+
+    async def test_stream_pushes_events_to_the_doctor(self):
+        response = await self.async_client.get('/sharedapp/events/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertIn(b'event: ready', await anext(chunks))
+
+        events.broker().publish(events.doctor_channel(self.doctor.pk), {'type': 'appointments', 'action': 'created', 'ids': [7]})
+        chunk = (await anext(chunks)).decode()
+        self.assertIn('event: appointments', chunk)
+        self.assertEqual(json.loads(chunk.split('data: ')[1])['ids'], [7])
+        await chunks.aclose()
+
+    def test_not_served_under_wsgi(self):
+        # The test Client goes through the WSGI handler, which would buffer the endless stream
+        response = self.client.get('/sharedapp/events/', headers=self.headers)
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+
+    @override_settings(EVENTS_KEEPALIVE=0.05)
+    async def test_stream_closes_once_the_token_is_revoked(self):
+        response = await self.async_client.get('/sharedapp/events/', headers=self.headers)
+        chunks = aiter(response.streaming_content)
+        self.assertIn(b'event: ready', await anext(chunks))
+        self.assertEqual(await anext(chunks), b': keep-alive\n\n')
+
+        authentication.revoke_token(self.token)
+        chunk = (await anext(chunks)).decode()
+        self.assertIn('event: closed', chunk)
+        self.assertIn('revoked', chunk)
+        with self.assertRaises(StopAsyncIteration):
+            await anext(chunks)
+
+    async def test_stream_closes_when_the_token_expires(self):
+        self.token.set_exp(lifetime=datetime.timedelta(seconds=1))
+        response = await self.async_client.get('/sharedapp/events/', headers={'Authorization': f'Bearer {self.token}'})
+        chunks = aiter(response.streaming_content)
+        self.assertIn(b'event: ready', await anext(chunks))
+        chunk = (await anext(chunks)).decode()
+        self.assertIn('event: closed', chunk)
+        self.assertIn('expired', chunk)
+        with self.assertRaises(StopAsyncIteration):
+            await anext(chunks)
+
+    async def test_stream_needs_a_leader_or_doctor(self):
+        response = await self.async_client.get('/sharedapp/events/')
+        self.assertEqual(response.status_code, 401)
+        token = MyTokenObtainPairSerializer.get_token(self.users['patient']).access_token
+        response = await self.async_client.get(f'/sharedapp/events/?access_token={token}')
+        self.assertEqual(response.status_code, 403)
+
+
+class AsyncReadEndpointsTest(TestCase):
+    def setUp(self):
+        self.speciality, self.doctor, self.users = create_world()
+        self.headers = {
+            role: {'Authorization': f'Bearer {MyTokenObtainPairSerializer.get_token(user).access_token}'}
+            for role, user in self.users.items()
+        }
+
+    def async_get(self, path, role=None, headers=None):
+        return async_to_sync(self.async_client.get)(path, headers={**self.headers.get(role, {}), **(headers or {})})
+
+    def test_async_variants_answer_like_the_sync_views(self):
+        pairs = [
+            ('/doctor/getAgenda', '/doctor/async/getAgenda', 'doctor'),
+            ('/patient/getHistory', '/patient/async/getHistory', 'patient'),
+            ('/leader/getInbox?page_size=1', '/leader/async/getInbox?page_size=1', 'admin'),
+            (f'/patient/speciality/{self.speciality.pk}/doctors/',
+             f'/patient/async/speciality/{self.speciality.pk}/doctors/', None),
+        ]
+        client = APIClient()
+        for sync_path, async_path, role in pairs:
+            with self.subTest(async_path):
+                expected = client.get(sync_path, headers=self.headers.get(role, {}))
+                response = self.async_get(async_path, role)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+
+    def test_async_history_answers_conditional_requests(self):
+        response = self.async_get('/patient/async/getHistory', 'patient')
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.async_get('/patient/async/getHistory', 'patient', {'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_async_endpoints_check_the_caller(self):
+        self.assertEqual(self.async_get('/doctor/async/getAgenda').status_code, 401)
+        # Tokens in the query string are for the event stream only
+        token = self.headers['doctor']['Authorization'].split()[1]
+        self.assertEqual(self.async_get(f'/doctor/async/getAgenda?access_token={token}').status_code, 401)
+        self.assertEqual(self.async_get('/leader/async/getInbox', 'patient').status_code, 403)
+        response = self.async_get('/doctor/async/getAgenda?range=month', 'doctor')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('range', response.json()['error'])
+
+
+class SharedBackendsCheckTest(TestCase):
+    shared_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                'LOCATION': '/tmp/wellnest-cache'}}
+
+    def check_ids(self):
+        return [(message.id, message.is_serious()) for message in deployment.check_shared_backends(None)]
+
+    def test_several_workers_need_shared_backends(self):
+        with override_settings(WEB_CONCURRENCY=1):
+            self.assertEqual(self.check_ids(), [])
+        with override_settings(WEB_CONCURRENCY=2):
+            self.assertEqual(self.check_ids(), [('sharedapp.E001', True), ('sharedapp.W001', False)])
+        with override_settings(WEB_CONCURRENCY=2, EVENTS_BROKER='sharedapp.events.RedisBroker', CACHES=self.shared_cache):
+            self.assertEqual(self.check_ids(), [])
+
+    def test_local_broker_does_not_stop_a_wsgi_deployment(self):
+        # The stream is only served under ASGI: a shared cache is enough to migrate and run WSGI workers
+        with override_settings(WEB_CONCURRENCY=2, CACHES=self.shared_cache):
+            self.assertEqual(self.check_ids(), [('sharedapp.W001', False)])
+
+
+@skipUnless(os.environ.get('REDIS_URL'), "needs a Redis server in REDIS_URL")
+class RedisBrokerTest(TestCase):
+    def setUp(self):
+        settings_override = override_settings(
+            EVENTS_BROKER='sharedapp.events.RedisBroker', EVENTS_REDIS_URL=os.environ['REDIS_URL'],
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        events.broker.cache_clear()
+        self.addCleanup(events.broker.cache_clear)
+
+    async def test_events_reach_listeners_through_redis(self):
+        # A second broker stands for another worker process
+        sender = events.RedisBroker()
+        async with events.broker().subscribe(['doctor:1', 'doctor:2']) as subscription:
+            sender.publish('doctor:3', {'type': 'appointments', 'action': 'created', 'ids': [5]})
+            sender.publish('doctor:2', {'type': 'appointments', 'action': 'created', 'ids': [6]})
+            sender.publish('doctor:1', {'type': 'appointments', 'action': 'updated', 'ids': [7]})
+            first, second = await subscription.get(5), await subscription.get(5)
+        self.assertEqual([first['ids'], second['ids']], [[6], [7]])
+        self.assertLess(first['id'], second['id'])
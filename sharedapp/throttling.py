@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+
+class TokenBuckets:
+    """In-process token buckets, one per key, least recently used dropped first.
+
+    Each bucket holds up to ``burst`` tokens and gains ``rate`` per second.
+    Being local, the limits apply per worker process.
+    """
+
+    def __init__(self, burst, rate, max_keys=10000):
+        self.burst, self.rate, self.max_keys = burst, rate, max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def _level(self, key, now):
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def take(self, key):
+        """Spend one token; False (and nothing spent) when the bucket is empty."""
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._level(key, now)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def wait(self, key):
+        """Seconds until ``key`` has a token again."""
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, time.monotonic()))
+            tokens = min(self.burst, tokens + (time.monotonic() - last) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+
+class LoginThrottle(BaseThrottle):
+    """Caps login attempts per client address and per account, before any password is hashed.
+
+    The address bucket is wide enough for a whole clinic behind one NAT
+    logging in at opening time; the account bucket stops password guessing.
+    """
+    buckets = {
+        'ip': TokenBuckets(*settings.LOGIN_THROTTLE_IP),
+        'account': TokenBuckets(*settings.LOGIN_THROTTLE_ACCOUNT),
+    }
+
+    def allow_request(self, request, view):
+        self.keys = {
+            'ip': self.get_ident(request),
+            'account': f"{request.data.get('user_role')}:{request.data.get('role_specific_id')}",
+        }
+        self.blocked = [scope for scope, key in self.keys.items() if not self.buckets[scope].take(key)]
+        return not self.blocked
+
+    def wait(self):
+        return max(self.buckets[scope].wait(self.keys[scope]) for scope in self.blocked)
@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.urls import reverse
+
+from .filestore import get_store
+
+logger = logging.getLogger(__name__)
+
+# Fixed avatar sizes, in pixels (square)
+SIZES = {
+    'small': 64,
+    'medium': 160,
+}
+
+
+
+class _WindowSigner(signing.TimestampSigner):
+    """Timestamps rounded down to the start of a window of half THUMBNAIL_URL_MAX_AGE.
+
+    A picture's URL stays the same for the whole window, so browsers can
+    cache it, and every URL is still good for at least half the max age
+    after it was handed out.
+    """
+
+    def timestamp(self):
+        window = max(1, settings.THUMBNAIL_URL_MAX_AGE // 2)
+        return signing.b62_encode(int(time.time()) // window * window)
+
+
+_signer = _WindowSigner(salt='sharedapp.thumbnails')
+
+
+class ThumbnailCache:
+    """Bounded on-disk LRU of avatar thumbnails, keyed by source digest and size.
+
+    A thumbnail is rendered from the stored original on first request and
+    reused afterwards; its file mtime is refreshed on every hit, so when the
+    directory grows past ``max_bytes`` the least recently used files go first.
+    Hits, misses and evictions are logged and counted in the Django cache
+    (see ``stats()``), so every worker reports into the same numbers.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+    def path(self, digest, size):
+        get_store().path(digest)  # validates the digest
+        return self.root / digest[:2] / f'{digest}-{size}.jpg'
+
+    def get(self, digest, size):
+        """Path to the thumbnail, rendering it first on a miss."""
+        path = self.path(digest, size)
+        if path.exists():
+            os.utime(path)
+            self._count('hits')
+            logger.debug("thumbnail hit %s/%s", digest, size)
+            return path, True
+
+        self._count('misses')
+        logger.debug("thumbnail miss %s/%s", digest, size)
+        self._render(digest, size, path)
+        self._added(path.stat().st_size)
+        return path, False
+
+    def _render(self, digest, size, path):
+        # Pillow is only needed by the processes that actually render
+        from PIL import Image, ImageOps
+
+        pixels = SIZES[size]
+        with get_store().open(digest) as source:
+            image = ImageOps.exif_transpose(Image.open(source))
+            thumbnail = ImageOps.fit(image.convert('RGB'), (pixels, pixels))
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        thumbnail.save(tmp, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp, path)
+
+    def _files(self):
+        return [entry for entry in self.root.glob('*/*.jpg') if entry.is_file()]
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._total is None:
+                self._total = sum(entry.stat().st_size for entry in self._files())
+            else:
+                self._total += nbytes
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Rescan: other workers share the directory, so our running total is only an estimate
+        files = sorted(self._files(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in files)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for entry in files:
+            if total <= target:
+                break
+            size = entry.stat().st_size
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                continue
+            total -= size
+            evicted += 1
+        self._total = total
+        if evicted:
+            self._count('evictions', evicted)
+            logger.info("thumbnail cache evicted %d file(s), %d bytes left", evicted, total)
+
+    def _count(self, name, amount=1):
+        key = f'thumbnails:{name}'
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # Evicted between add() and incr(): start counting again
+            cache.set(key, amount, timeout=None)
+
+
+@lru_cache(maxsize=None)
+def _cache(root, max_bytes):
+    return ThumbnailCache(root, max_bytes)
+
+
+def get_cache():
+    return _cache(str(settings.THUMBNAIL_CACHE_ROOT), settings.THUMBNAIL_CACHE_MAX_BYTES)
+
+
+def stats():
+    values = cache.get_many([f'thumbnails:{name}' for name in ('hits', 'misses', 'evictions')])
+    return {name: values.get(f'thumbnails:{name}', 0) for name in ('hits', 'misses', 'evictions')}
+
+
+def sign(digest):
+    return _signer.sign(digest)
+
+
+def unsign(token):
+    """Digest behind a token from ``thumbnail_urls``; raises signing.BadSignature (SignatureExpired too)."""
+    return _signer.unsign(token, max_age=settings.THUMBNAIL_URL_MAX_AGE)
+
+
+def thumbnail_urls(digest):
+    """URLs of every thumbnail size for a stored picture, or None without one.
+
+    Built from the digest alone (no query, no disk access). The signed token
+    keeps the URLs stable for browser caching yet impossible to forge, so
+    they can go straight into an <img> tag without a bearer token. Tokens
+    expire (THUMBNAIL_URL_MAX_AGE): a URL seen once does not give access to
+    the picture for good.
+    """
+    if not digest:
+        return None
+    token = sign(digest)
+    return {size: reverse('thumbnail', kwargs={'token': token, 'size': size}) for size in SIZES}
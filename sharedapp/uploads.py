@@ -0,0 +1,148 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import transaction
+
+from .filestore import CHUNK_SIZE, DIGEST_RE, get_store, link
+from .models import MessagePat, Ordonance, UploadSession
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# target -> (queryset, stored field, may this user attach a file to that row)
+UPLOAD_TARGETS = {
+    'ordonance': (
+        Ordonance.objects.select_related('ordonance_apointment'), 'ordonance_file',
+        lambda user, row: user.user_role == 'doctor'
+        and row.ordonance_apointment.apointment_doc_id == user.user_role_id,
+    ),
+    'message-picture': (
+        MessagePat.objects.all(), 'message_pic',
+        lambda user, row: user.user_role == 'patient' and row.message_sender_id == user.user_role_id,
+    ),
+}
+
+
+def part_path(session):
+    return get_store().root / 'uploads' / f'{session.upload_id}.part'
+
+
+def _load_target(user, target, target_id, lock=False):
+    if target not in UPLOAD_TARGETS:
+        raise UploadError(f"Unknown upload target {target!r}.")
+    queryset, blob_field, can_attach = UPLOAD_TARGETS[target]
+    if lock:
+        queryset = queryset.select_for_update(of=('self',))
+    try:
+        row = queryset.get(pk=target_id)
+    except queryset.model.DoesNotExist:
+        raise UploadError("Upload target not found.", status=404)
+    if not can_attach(user, row):
+        raise UploadError("You cannot attach a file to this record.", status=403)
+    return row, blob_field
+
+
+def start(user, target, target_id, size, sha256):
+    """Open an upload session for a file of ``size`` bytes with the given checksum."""
+    if not 0 < size <= settings.FILESTORE_MAX_UPLOAD_SIZE:
+        raise UploadError(f"size must be between 1 and {settings.FILESTORE_MAX_UPLOAD_SIZE} bytes.")
+    if not DIGEST_RE.match(sha256):
+        raise UploadError("sha256 must be a lowercase hex SHA-256 digest.")
+    _load_target(user, target, target_id)
+
+    session = UploadSession.objects.create(
+        upload_owner_id=user.pk, upload_target=target, upload_target_id=target_id,
+        upload_size=size, upload_sha256=sha256,
+    )
+    path = part_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return session
+
+
+def write_chunk(session, offset, stream, length, total=None):
+    """Append ``length`` bytes read from ``stream`` at ``offset``, in constant memory.
+
+    Only the next expected offset is accepted, so a client that lost its
+    connection asks for ``upload_received`` and carries on from there.
+    Writing the same chunk twice is harmless. ``total`` is the file size
+    the client announces with the chunk, when it does.
+    """
+    if session.upload_completed:
+        raise UploadError("This upload is already complete.", status=409)
+    if total is not None and total != session.upload_size:
+        raise UploadError(f"This upload was started for a file of {session.upload_size} bytes, not {total}.")
+    if offset != session.upload_received:
+        raise UploadError(f"Expected a chunk starting at byte {session.upload_received}.", status=409)
+    if length <= 0 or offset + length > session.upload_size:
+        raise UploadError("Chunk does not fit in the declared file size.")
+
+    remaining = length
+    with open(part_path(session), 'r+b') as part:
+        part.seek(offset)
+        while remaining:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            part.write(chunk)
+            remaining -= len(chunk)
+    if remaining:
+        # Connection dropped mid-chunk: the offset did not move, resend this chunk
+        raise UploadError("Chunk ended before Content-Range said it would.")
+
+    # Claim the range; a concurrent request for the same offset loses here
+    claimed = UploadSession.objects.filter(
+        pk=session.pk, upload_received=offset, upload_completed=False
+    ).update(upload_received=offset + length)
+    if not claimed:
+        raise UploadError("Another request wrote this chunk first.", status=409)
+    session.upload_received = offset + length
+
+    if session.upload_received == session.upload_size:
+        finish(session)
+    return session
+
+
+def finish(session):
+    """Verify the checksum, move the file into the store and attach it to its target."""
+    path = part_path(session)
+    sha = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+
+    if sha.hexdigest() != session.upload_sha256:
+        # Corrupt upload: start over rather than keep bytes we cannot trust
+        open(path, 'wb').close()
+        UploadSession.objects.filter(pk=session.pk).update(upload_received=0)
+        session.upload_received = 0
+        raise UploadError("Checksum mismatch, the upload has been restarted.", status=422)
+
+    try:
+        with transaction.atomic():
+            # Locked, so the record cannot be deleted between here and the link
+            row, blob_field = _load_target(
+                session.upload_owner, session.upload_target, session.upload_target_id, lock=True)
+            get_store().add(path, session.upload_sha256)
+            link(row, blob_field, session.upload_sha256)
+            session.upload_completed = True
+            session.save(update_fields=['upload_completed'])
+    except UploadError as e:
+        # The record was deleted (or changed hands) while the file was arriving: there is
+        # nothing to attach it to, and a full session could never be completed later
+        discard(session)
+        raise UploadError(f"{e} The upload has been discarded.", status=e.status)
+
+
+def discard(session):
+    """Delete a session and whatever part of its file was received."""
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
@@ -1,6 +1,15 @@
 from django.urls import path
-from .views import MyTokenObtainPairView
+from .views import (
+    MyTokenObtainPairView, LogoutView, EventStreamView, StoredFileView, StartUploadView, UploadChunkView, ThumbnailView, ThumbnailStatsView,
+)
 
 urlpatterns = [
     path('login/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
-]
\ No newline at end of file
+    path('logout/', LogoutView.as_view(), name='logout'),
+    path('events/', EventStreamView.as_view(), name='event-stream'),
+    path('files/<str:kind>/<int:pk>', StoredFileView.as_view(), name='stored-file'),
+    path('uploads/', StartUploadView.as_view(), name='upload-start'),
+    path('uploads/<uuid:upload_id>', UploadChunkView.as_view(), name='upload-chunk'),
+    path('thumbs/<str:size>/<str:token>', ThumbnailView.as_view(), name='thumbnail'),
+    path('thumbs/stats', ThumbnailStatsView.as_view(), name='thumbnail-stats'),
+]
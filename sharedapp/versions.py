@@ -0,0 +1,137 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import deployment
+
+# ==========================================
+# VERSION STAMPS
+# ==========================================
+# A stamp is a nanosecond timestamp stored in the cache under
+# ``version:<scope>:<id>``, moved forward on every write that changes what
+# a read endpoint would return (see the receivers in sharedapp.signals).
+# A stamp that went missing is recreated from the clock, which can only
+# make it newer, so the worst case is a full response instead of a 304.
+#
+# That only holds when every process reads the same stamps. A worker with
+# its own local-memory cache never sees the writes served by the others
+# and would keep answering 304 for data that changed, so conditional GETs
+# are switched off when several workers run on such a cache.
+
+
+def enabled():
+    return settings.WEB_CONCURRENCY == 1 or 'CACHES' not in deployment.process_local_backends()
+
+
+def key(scope, ident):
+    return f'version:{scope}:{ident}'
+
+
+def read(keys):
+    """{key: stamp} for every key, creating the missing ones."""
+    stamps = cache.get_many(keys)
+    missing = [k for k in keys if k not in stamps]
+    if missing:
+        now = time.time_ns()
+        for k in missing:
+            cache.add(k, now, timeout=None)
+        stamps.update(cache.get_many(missing))
+    return stamps
+
+
+async def aread(keys):
+    """``read`` for async views."""
+    stamps = await cache.aget_many(keys)
+    missing = [k for k in keys if k not in stamps]
+    if missing:
+        now = time.time_ns()
+        for k in missing:
+            await cache.aadd(k, now, timeout=None)
+        stamps.update(await cache.aget_many(missing))
+    return stamps
+
+
+def touch(*scopes):
+    """Move the ``(scope, id)`` stamps forward once the current transaction commits."""
+    keys = [key(scope, ident) for scope, ident in scopes if ident is not None]
+    if not keys:
+        return
+
+    def _touch():
+        current = cache.get_many(keys)
+        now = time.time_ns()
+        # Never go backwards, even if this server's clock is behind the one that wrote last
+        cache.set_many({k: max(now, current.get(k, 0) + 1) for k in keys}, timeout=None)
+
+    transaction.on_commit(_touch)
+
+
+# ==========================================
+# CONDITIONAL GET
+# ==========================================
+
+def conditional(keys_for):
+    """Answer If-None-Match / If-Modified-Since on a GET handler before it runs.
+
+    ``keys_for(request, *args, **kwargs)`` returns the cache keys whose
+    stamps cover everything the response contains. The ETag hashes them
+    with the user and the full path (query string included), and
+    Last-Modified is the newest stamp. Stamps are read before the handler
+    runs, so a response is never newer than its validators claim.
+    Works on async handlers too; ``keys_for`` must then not touch the
+    database. Without ``enabled()`` the handler simply runs, uncached.
+    """
+    def decorator(handler):
+        if iscoroutinefunction(handler):
+            @wraps(handler)
+            async def async_wrapper(view, request, *args, **kwargs):
+                if not enabled():
+                    return await handler(view, request, *args, **kwargs)
+                stamps = await aread(keys_for(request, *args, **kwargs))
+                etag, last_modified = _validators(request, stamps)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = await handler(view, request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                return _stamped(response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if not enabled():
+                return handler(view, request, *args, **kwargs)
+            stamps = read(keys_for(request, *args, **kwargs))
+            etag, last_modified = _validators(request, stamps)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            return _stamped(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def _validators(request, stamps):
+    digest = hashlib.sha1(
+        f'{request.user.pk}:{request.get_full_path()}:{sorted(stamps.items())}'.encode()
+    ).hexdigest()
+    last_modified = max(stamps.values()) // 10**9 if stamps else None
+    return quote_etag(digest), last_modified
+
+
+def _stamped(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep it, but must check back every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
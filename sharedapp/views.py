@@ -1,6 +1,291 @@
+import json
+import re
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from rest_framework import status
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import MyTokenObtainPairSerializer
+from .models import Doctor, Patient, Ordonance, MessagePat, UploadSession
+from .filestore import get_store, stored_digest
+from .downloads import serve_stored_file
+from .throttling import LoginThrottle
+from .asyncviews import AsyncAPIView
+from . import authentication, events, profiles, thumbnails, uploads
 
 class MyTokenObtainPairView(TokenObtainPairView):
-    serializer_class = MyTokenObtainPairSerializer
\ No newline at end of file
+    serializer_class = MyTokenObtainPairSerializer
+    # Turned away before the password is hashed
+    throttle_classes = [LoginThrottle]
+
+
+class LogoutView(APIView):
+    """ Revoke the access token the request was made with """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.auth is not None:
+            authentication.revoke_token(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def _is_role(user, role, role_id=None):
+    return user.user_role == role and (role_id is None or user.user_role_id == role_id)
+
+
+# kind in the URL -> (model, stored field, queryset, who may download it)
+STORED_FILES = {
+    'doctor-picture': (
+        Doctor, 'doctor_pic', Doctor.objects.only('doctor_id', 'doctor_pic_ref'),
+        lambda user, row: True,
+    ),
+    'patient-picture': (
+        Patient, 'patient_pic', Patient.objects.only('patient_id', 'patient_pic_ref'),
+        lambda user, row: _is_role(user, 'doctor') or _is_role(user, 'admin')
+        or _is_role(user, 'patient', row.patient_id),
+    ),
+    'ordonance': (
+        Ordonance, 'ordonance_file',
+        Ordonance.objects.select_related('ordonance_apointment').only(
+            'ordonance_id', 'ordonance_file_ref',
+            'ordonance_apointment__apointment_doc', 'ordonance_apointment__apointment_pat'),
+        lambda user, row: _is_role(user, 'admin')
+        or _is_role(user, 'doctor', row.ordonance_apointment.apointment_doc_id)
+        or _is_role(user, 'patient', row.ordonance_apointment.apointment_pat_id),
+    ),
+    'message-picture': (
+        MessagePat, 'message_pic', MessagePat.objects.only('message_id', 'message_sender', 'message_pic_ref'),
+        lambda user, row: _is_role(user, 'admin') or _is_role(user, 'patient', row.message_sender_id),
+    ),
+}
+
+
+class StoredFileView(APIView):
+    """ Download a picture or prescription: streamed, with ETag and Range support """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, kind, pk):
+        if kind not in STORED_FILES:
+            return Response({"error": "Unknown file kind."}, status=status.HTTP_404_NOT_FOUND)
+        model, blob_field, queryset, can_download = STORED_FILES[kind]
+
+        try:
+            row = queryset.get(pk=pk)
+        except model.DoesNotExist:
+            return Response({"error": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if not can_download(request.user, row):
+            return Response({"error": "You cannot access this file."}, status=status.HTTP_403_FORBIDDEN)
+
+        digest = stored_digest(row, blob_field)
+        if digest is None:
+            return Response({"error": "No file uploaded."}, status=status.HTTP_404_NOT_FOUND)
+
+        return serve_stored_file(request, digest, f"{kind}-{pk}")
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def upload_status(session):
+    return {
+        "upload_id": str(session.upload_id),
+        "received": session.upload_received,
+        "size": session.upload_size,
+        "completed": session.upload_completed,
+    }
+
+
+class StartUploadView(APIView):
+    """ Open a chunked upload for an ordonance file or a message picture """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            session = uploads.start(
+                request.user,
+                target=request.data.get("target"),
+                target_id=int(request.data.get("target_id")),
+                size=int(request.data.get("size")),
+                sha256=str(request.data.get("sha256", "")).lower(),
+            )
+            return Response(upload_status(session), status=status.HTTP_201_CREATED)
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=e.status)
+        except (TypeError, ValueError):
+            return Response({"error": "target, target_id, size and sha256 are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadChunkView(APIView):
+    """
+    GET: how many bytes arrived (to resume after a dropped connection)
+    PUT: the next chunk, raw bytes with a 'Content-Range: bytes start-end/size' header
+    DELETE: abandon the upload
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, request, upload_id):
+        return UploadSession.objects.get(upload_id=upload_id, upload_owner_id=request.user.id)
+
+    def get(self, request, upload_id):
+        try:
+            return Response(upload_status(self.get_session(request, upload_id)), status=status.HTTP_200_OK)
+        except UploadSession.DoesNotExist:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    def put(self, request, upload_id):
+        try:
+            session = self.get_session(request, upload_id)
+        except UploadSession.DoesNotExist:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        match = CONTENT_RANGE_RE.match(request.META.get("HTTP_CONTENT_RANGE", ""))
+        if not match:
+            return Response({"error": "A 'Content-Range: bytes start-end/size' header is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        start, end = int(match.group(1)), int(match.group(2))
+        total = None if match.group(3) == "*" else int(match.group(3))
+
+        try:
+            # The body is read straight off the socket, never as a whole
+            uploads.write_chunk(session, start, request.stream, end - start + 1, total)
+            return Response(upload_status(session), status=status.HTTP_200_OK)
+        except uploads.UploadError as e:
+            return Response({"error": str(e), **upload_status(session)}, status=e.status)
+
+    def delete(self, request, upload_id):
+        try:
+            uploads.discard(self.get_session(request, upload_id))
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        except UploadSession.DoesNotExist:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class ThumbnailView(APIView):
+    """ Avatar thumbnail of a stored picture; the signed, expiring token in the URL is the permission """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, token, size):
+        try:
+            digest = thumbnails.unsign(token)
+        except signing.BadSignature:
+            return Response({"error": "Thumbnail not found."}, status=status.HTTP_404_NOT_FOUND)
+        if size not in thumbnails.SIZES or not get_store().exists(digest):
+            return Response({"error": "Thumbnail not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # 1. A thumbnail never changes for a given source and size
+        etag = f'"{digest}-{size}"'
+        if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        # 2. Served from the on-disk cache, rendered on a miss
+        try:
+            path, hit = thumbnails.get_cache().get(digest, size)
+        except OSError:
+            # Pillow could not read the source as an image
+            return Response({"error": "This file is not a picture."}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        response = FileResponse(open(path, "rb"), content_type="image/jpeg")
+        response["ETag"] = etag
+        # The content never changes, but the URL stops working after THUMBNAIL_URL_MAX_AGE
+        response["Cache-Control"] = f"private, max-age={settings.THUMBNAIL_URL_MAX_AGE}, immutable"
+        response["X-Thumbnail-Cache"] = "hit" if hit else "miss"
+        return response
+
+
+class ThumbnailStatsView(APIView):
+    """ Hit / miss / eviction counters of the thumbnail cache, for leaders """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_role != "admin":
+            return Response({"error": "Only leaders can see cache statistics."}, status=status.HTTP_403_FORBIDDEN)
+        return Response(thumbnails.stats(), status=status.HTTP_200_OK)
+
+
+# ==========================================
+# EVENT STREAM (server-sent events)
+# ==========================================
+
+def sse_event(event):
+    return f"id: {event.get('id', '')}\nevent: {event['type']}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n"
+
+
+class EventStreamView(AsyncAPIView):
+    """ Push inbox and agenda changes instead of having the frontend poll
+
+    Leaders get the messages of their willaya, doctors their appointments.
+    An async view: under ASGI each listener costs a coroutine, not a worker.
+    The first event, "ready", arrives once the subscription is live; that is
+    when a client (re)loads its lists. "resync" asks for the same after the
+    client fell behind. "closed" is the last event, sent once the token has
+    expired or been revoked; the client logs in again before reconnecting.
+
+    Only served under ASGI (Procfile.asgi). A WSGI server reads a streaming
+    response to its end before sending any of it, so there the stream would
+    pin a worker and deliver nothing: it answers 501 and clients keep polling.
+    """
+    # EventSource cannot send an Authorization header
+    query_token = True
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({"error": "The event stream is only served by the ASGI deployment."},
+                                status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        # What this caller may follow
+        user = request.user
+        if user.user_role == 'admin':
+            try:
+                leader = await sync_to_async(profiles.load)(user)
+            except ObjectDoesNotExist:
+                return JsonResponse({"error": "You are not registered as a Leader."}, status=status.HTTP_403_FORBIDDEN)
+            channel = events.willaya_channel(leader.admin_willaya)
+        elif user.user_role == 'doctor':
+            channel = events.doctor_channel(user.user_role_id)
+        else:
+            return JsonResponse({"error": "Only leaders and doctors have an event stream."},
+                                status=status.HTTP_403_FORBIDDEN)
+
+        response = StreamingHttpResponse(self.stream(channel, request.auth), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx would otherwise hold events back until its buffer fills
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, channel, token):
+        async with events.broker().subscribe([channel]) as subscription:
+            yield 'retry: 3000\n\n' + sse_event({"type": "ready"})
+            checked = time.monotonic()
+            while True:
+                event = await subscription.get(timeout=min(settings.EVENTS_KEEPALIVE, token['exp'] - time.time()))
+
+                # The token is checked again as the stream goes on: it may have expired,
+                # or been revoked (logout, password change, deactivation) since it was opened
+                reason = None
+                if time.time() >= token['exp']:
+                    reason = "Token has expired."
+                elif event is None or time.monotonic() - checked >= settings.EVENTS_KEEPALIVE:
+                    if await sync_to_async(authentication.is_revoked)(token):
+                        reason = "Token has been revoked."
+                    checked = time.monotonic()
+                if reason:
+                    yield sse_event({"type": "closed", "reason": reason})
+                    return
+
+                # A comment line keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n' if event is None else sse_event(event)
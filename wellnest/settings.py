@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from datetime import timedelta
+from datetime import time, timedelta
 import dj_database_url  # NEW: You must run 'pip install dj_database_url'
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,7 +51,8 @@ ROOT_URLCONF = 'wellnest.urls'
 # REST & JWT
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Trusts the token's role claims instead of loading the User row per request
+        'sharedapp.authentication.StatelessJWTAuthentication',
     )
 }
 
@@ -59,8 +60,51 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_USER_CLASS': 'sharedapp.authentication.RolePrincipal',
 }
 
+# LOGIN (see MyTokenObtainPairSerializer)
+# The first hasher hashes new passwords; logins rehash passwords stored with any other one
+PASSWORD_HASHERS = [
+    'sharedapp.hashers.TunedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# PBKDF2 work factor; unset keeps Django's default
+PASSWORD_HASH_ITERATIONS = int(os.environ['PASSWORD_HASH_ITERATIONS']) if os.environ.get('PASSWORD_HASH_ITERATIONS') else None
+# Login attempts per worker process, as (burst, refill per second), checked before any hashing
+LOGIN_THROTTLE_IP = (60, 1.0)
+LOGIN_THROTTLE_ACCOUNT = (5, 1 / 12)
+
+# BULK PATIENT IMPORT (see sharedapp.onboarding)
+# Valid rows committed per transaction, and processes hashing default passwords (unset: one per CPU)
+ONBOARDING_BATCH_SIZE = int(os.environ.get('ONBOARDING_BATCH_SIZE', 500))
+ONBOARDING_HASH_WORKERS = int(os.environ.get('ONBOARDING_HASH_WORKERS', 0)) or None
+
+# DASHBOARD COUNTERS (see sharedapp.counters): rows each willaya total is spread over, so
+# concurrent bookings and messages of one willaya rarely wait on the same counter row
+DASHBOARD_COUNTER_SHARDS = int(os.environ.get('DASHBOARD_COUNTER_SHARDS', 8))
+
+# LEADER EXPORTS (see sharedapp.exports): rows fetched per server-side cursor round trip
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Worker processes serving requests (gunicorn reads the same variable). More than one needs a
+# shared cache and events broker, see sharedapp.deployment
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# EVENT STREAM (see sharedapp.events)
+# The in-process broker only reaches listeners of the same process; with REDIS_URL set, Redis
+# pub/sub reaches every worker
+EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', os.environ.get('REDIS_URL', ''))
+EVENTS_BROKER = os.environ.get(
+    'EVENTS_BROKER', 'sharedapp.events.RedisBroker' if EVENTS_REDIS_URL else 'sharedapp.events.LocalBroker'
+)
+# Events buffered per listener before it is told to resync, and seconds between keep-alive comments
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE = 15
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -84,15 +128,67 @@ WSGI_APPLICATION = 'wellnest.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600
+        # Persistent connections; the ASGI deployment turns them off (see gunicorn_asgi.conf.py)
+        conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', 600))
     )
 }
 
+# CACHE
+# Local memory by default (per process). Set CACHE_DIR to share a file-based
+# cache between local workers, or REDIS_URL in production.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Public directory entries (sharedapp.directory); writes invalidate them, this only reclaims memory
+DIRECTORY_CACHE_TIMEOUT = 24 * 60 * 60
+# The caller's Doctor / Patient / Leader row (sharedapp.profiles); writes invalidate it, the TTL bounds
+# what a missed invalidation (raw SQL, another deployment) can serve
+PROFILE_CACHE_TIMEOUT = int(os.environ.get('PROFILE_CACHE_TIMEOUT', 60))
+
 # Static files
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') # NEW
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage' # NEW
 
+# FILE STORE (pictures and prescriptions, see sharedapp.filestore)
+FILESTORE_ROOT = os.environ.get('FILESTORE_ROOT', os.path.join(BASE_DIR, 'filestore'))
+# '' streams files from Django; 'x-sendfile' (Apache) or 'x-accel-redirect' (nginx) hands them to the web server
+FILESTORE_SENDFILE_MODE = os.environ.get('FILESTORE_SENDFILE_MODE', '')
+FILESTORE_ACCEL_PREFIX = os.environ.get('FILESTORE_ACCEL_PREFIX', '/protected-files/')
+# Largest file accepted by the chunked upload API, in bytes
+FILESTORE_MAX_UPLOAD_SIZE = int(os.environ.get('FILESTORE_MAX_UPLOAD_SIZE', 25 * 1024 * 1024))
+# Avatar thumbnails rendered from stored pictures (bounded LRU, see sharedapp.thumbnails)
+THUMBNAIL_CACHE_ROOT = os.environ.get('THUMBNAIL_CACHE_ROOT', os.path.join(FILESTORE_ROOT, 'thumbs'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Seconds a thumbnail URL works (at least half of it after it was issued). Listings holding URLs are
+# cached for up to DIRECTORY_CACHE_TIMEOUT, so keep half of this above that
+THUMBNAIL_URL_MAX_AGE = int(os.environ.get('THUMBNAIL_URL_MAX_AGE', 7 * 24 * 60 * 60))
+
+# APPOINTMENT SLOTS (see sharedapp.availability)
+# Opening hours, in TIME_ZONE, and the grid free slots are offered on
+APPOINTMENT_DAY_START = time.fromisoformat(os.environ.get('APPOINTMENT_DAY_START', '08:00'))
+APPOINTMENT_DAY_END = time.fromisoformat(os.environ.get('APPOINTMENT_DAY_END', '17:00'))
+APPOINTMENT_SLOT_STEP = int(os.environ.get('APPOINTMENT_SLOT_STEP', 15))  # minutes
+# How long a doctor-day of bookings stays cached; changes invalidate it sooner
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60
+
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True # Simplified for your initial deployment
 CORS_ALLOW_CREDENTIALS = True